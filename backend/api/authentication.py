@@ -0,0 +1,51 @@
+import copy
+import hashlib
+
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from core.cache import LRUCache
+from core.routers import use_primary
+
+TOKEN_CACHE_TTL = 5 * 60
+# Другие процессы узнают об отзыве токена не позже, чем через это время.
+TOKEN_LOCAL_CACHE_TTL = 10
+
+token_cache = LRUCache(maxsize=10000, ttl=TOKEN_LOCAL_CACHE_TTL)
+
+
+def token_cache_key(key):
+    # Сам токен — секрет, поэтому в ключах кэша хранится его хэш.
+    return f'api:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def invalidate_tokens(keys):
+    cache_keys = [token_cache_key(key) for key in keys]
+    for cache_key in cache_keys:
+        token_cache.delete(cache_key)
+    cache.delete_many(cache_keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # Токен вместе с пользователем берётся из LRU процесса или общего кэша
+    # Django вместо запроса Token JOIN User на каждый запрос. Кэш
+    # сбрасывается сигналами при выходе, смене пароля и любом изменении
+    # пользователя.
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        token = token_cache.get(cache_key, None)
+        if token is None:
+            token = cache.get(cache_key)
+            if token is None:
+                # Токен мог быть выдан только что и ещё не дойти до
+                # реплики.
+                with use_primary():
+                    user, token = super().authenticate_credentials(key)
+                cache.set(cache_key, token, TOKEN_CACHE_TTL)
+            token_cache.set(cache_key, token)
+        # Каждый запрос получает свои копии, чтобы изменения request.user
+        # не попадали в общий кэш процесса.
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
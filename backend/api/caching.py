@@ -0,0 +1,93 @@
+import hashlib
+import math
+
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.cache_versions import (
+    COUNTERS_VERSION_KEY,
+    RECIPES_VERSION_KEY,
+    get_versions,
+    recipe_version_key,
+    user_version_key,
+)
+
+RESPONSE_CACHE_TIMEOUT = 10 * 60
+
+
+class CachedRecipeReadMixin:
+    # ETag и Last-Modified для чтения рецептов. Ключи строятся из версий
+    # рецептов (общей или конкретного рецепта) и, для авторизованных
+    # пользователей, версии их избранного, корзины и подписок. Ответы
+    # анонимам кэшируются целиком: их флаги всегда False.
+
+    def list(self, request, *args, **kwargs):
+        keys = [RECIPES_VERSION_KEY]
+        if 'ordering' in request.query_params:
+            keys.append(COUNTERS_VERSION_KEY)
+        return self.cached_response(
+            request, keys, lambda: super(CachedRecipeReadMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+
+        def get_response():
+            return super(CachedRecipeReadMixin, self).retrieve(
+                request, *args, **kwargs)
+
+        try:
+            recipe_id = int(lookup)
+        except ValueError:
+            # Не id рецепта: ответ всё равно 404, версия не нужна.
+            return get_response()
+        return self.cached_response(
+            request, [recipe_version_key(recipe_id)], get_response)
+
+    def cached_response(self, request, keys, get_response):
+        user = request.user
+        if user.is_authenticated:
+            keys = keys + [user_version_key(user.id)]
+        versions = get_versions(keys)
+        identity = user.id if user.is_authenticated else 'anonymous'
+        etag = quote_etag(hashlib.md5(
+            f'{identity}:{versions}:{request.build_absolute_uri()}:'
+            f'{request.accepted_media_type}'.encode()
+        ).hexdigest())
+        last_modified = math.ceil(max(versions))
+
+        if self.is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        elif user.is_authenticated:
+            response = get_response()
+        else:
+            cache_key = f'recipes:response:{etag}'
+            data = cache.get(cache_key)
+            if data is None:
+                response = get_response()
+                if response.status_code == status.HTTP_200_OK:
+                    cache.set(cache_key, response.data,
+                              RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, no_cache=True,
+                                private=user.is_authenticated)
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+    @staticmethod
+    def is_not_modified(request, etag):
+        # Только по ETag: Last-Modified с точностью до секунды не отличит
+        # изменение в ту же секунду, что и прошлое чтение, поэтому один
+        # If-Modified-Since 304 не даёт.
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is None:
+            return False
+        return etag in (tag.strip() for tag in if_none_match.split(','))
@@ -1,7 +1,9 @@
 from django.contrib.auth import get_user_model
 from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
 
 from recipes.models import Recipe, Ingredient
+from recipes.search import search_recipes
 
 User = get_user_model()
 
@@ -18,21 +20,34 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ['author', 'is_in_shopping_cart', 'is_favorited']
+        fields = ['author', 'is_in_shopping_cart', 'is_favorited', 'search']
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if not self.request.user.is_authenticated:
             return queryset
-        if value:
-            return queryset.filter(in_shopping_cart__user=self.request.user)
-        return queryset.exclude(in_shopping_cart__user=self.request.user)
+        return queryset.filter(is_in_shopping_cart=value)
 
     def filter_is_favorited(self, queryset, name, value):
         if not self.request.user.is_authenticated:
             return queryset
-        if value:
-            return queryset.filter(favorited_by__user=self.request.user)
-        return queryset.exclude(favorited_by__user=self.request.user)
+        return queryset.filter(is_favorited=value)
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    # ?ordering=trending — сначала популярные сейчас, по убыванию
+    # затухающей оценки; ?ordering=-trending — наоборот.
+    aliases = {'trending': '-trending_score', '-trending': 'trending_score'}
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        return super().remove_invalid_fields(
+            queryset, [self.aliases.get(term, term) for term in fields],
+            view, request)
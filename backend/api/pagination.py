@@ -0,0 +1,184 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CursorOptInPagination(LimitOffsetPagination):
+    # По умолчанию limit/offset. С ?pagination=cursor (или переданным
+    # cursor) страница выбирается условием по полям сортировки, например
+    # (created_at, id), без OFFSET и без COUNT(*).
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = False
+        ordering = self.get_keyset_ordering(queryset)
+        if not self.is_cursor_requested(request) or ordering is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.use_cursor = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.ordering = ordering
+        self.model_fields = {
+            field.attname: field
+            for field in queryset.model._meta.concrete_fields
+        }
+        position, reverse = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*(
+            self.invert(field) if reverse else field for field in ordering))
+        if position is not None:
+            queryset = queryset.filter(
+                self.seek_filter(position, reverse))
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.use_cursor:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self.build_link(self.page[0], reverse=True)
+
+    def is_cursor_requested(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+
+    def get_keyset_ordering(self, queryset):
+        # Только обычные поля модели: по аннотациям (например, рангу
+        # поиска) курсор не построить, и остаётся limit/offset.
+        query = queryset.query
+        ordering = list(query.order_by or queryset.model._meta.ordering)
+        ordering = [
+            field.replace('pk', 'id', 1)
+            if isinstance(field, str) and field.lstrip('-') == 'pk'
+            else field for field in ordering
+        ]
+        names = {
+            field.attname for field in queryset.model._meta.concrete_fields
+        }
+        if not all(isinstance(field, str) and field.lstrip('-') in names
+                   for field in ordering):
+            return None
+        if not ordering or ordering[-1].lstrip('-') != 'id':
+            # id замыкает сортировку, чтобы позиция была уникальной.
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return tuple(ordering)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def seek_filter(self, position, reverse):
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def build_link(self, item, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(item, field.lstrip('-'))
+            position.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value)
+        cursor = base64.urlsafe_b64encode(json.dumps(
+            {'p': position, 'r': reverse}).encode()).decode()
+        url = self.request.build_absolute_uri()
+        for param in (self.mode_query_param, self.offset_query_param):
+            url = remove_query_param(url, param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = cursor['p']
+            reverse = bool(cursor.get('r', False))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            # Только строки и числа: null дал бы условие
+            # created_at__lt=None, а списки и словари — не значения полей.
+            if not all(isinstance(value, (str, int, float))
+                       for value in position):
+                raise ValueError
+            position = [
+                self.to_python(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+            if None in position:
+                raise ValueError
+        except (AttributeError, TypeError, ValueError, KeyError,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def to_python(self, name, value):
+        model_field = self.model_fields.get(name)
+        if model_field is None:
+            return value
+        return model_field.to_python(value)
+
+
+class FeedPagination(CursorOptInPagination):
+    # Лента листается только вперёд: курсор — (created_at, id) последнего
+    # рецепта страницы. fetch(position, limit) отдаёт рецепты по порядку.
+    ordering = ('-created_at', '-id')
+
+    def paginate_feed(self, request, model, fetch):
+        self.use_cursor = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.model_fields = {
+            field.attname: field for field in model._meta.concrete_fields
+        }
+        position, reverse = self.decode_cursor(request)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        results = fetch(position, self.limit + 1)
+        self.has_next = len(results) > self.limit
+        self.has_previous = False
+        self.page = results[:self.limit]
+        return self.page
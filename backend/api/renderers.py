@@ -0,0 +1,45 @@
+from django.http import Http404
+from rest_framework import renderers
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.settings import api_settings
+
+
+class PlainTextRenderer(renderers.BaseRenderer):
+    # Списки покупок отдаются потоком мимо рендерера, сюда попадают только
+    # ответы с ошибками.
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return '\n'.join(str(value) for value in data.values())
+        return str(data)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(PlainTextRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class FormatParameterNegotiation(BaseContentNegotiation):
+    # Формат выбирается только параметром ?format=, без учёта Accept:
+    # по умолчанию отдаётся первый рендерер (текст), как и раньше.
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        export_format = format_suffix or request.query_params.get(
+            api_settings.URL_FORMAT_OVERRIDE)
+        if not export_format:
+            return renderers[0], renderers[0].media_type
+        for renderer in renderers:
+            if renderer.format == export_format:
+                return renderer, renderer.media_type
+        raise Http404
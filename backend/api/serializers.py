@@ -1,28 +1,45 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-
-from core.fields import Base64ImageField
-from recipes.constants import MIN_COOKING_TIME, MIN_INGREDIENT_FROM_RECIPES
+from django.db import transaction
+
+from core.fields import (
+    Base64ImageField,
+    ImageVariantsField,
+    VariantImageField,
+)
+from recipes.constants import (
+    MAX_BULK_RECIPES,
+    MAX_PANTRY_INGREDIENTS,
+    MIN_COOKING_TIME,
+    MIN_INGREDIENT_FROM_RECIPES,
+)
 from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.cart import lock_recipes, update_recipe_in_shopping_lists
+from recipes.documents import fill_missing_documents, render_document
+from recipes.search import index_recipes
+from recipes.similarity import schedule_similar_refresh
 
 User = get_user_model()
 
 
 class UserReadSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
-    avatar = serializers.ImageField(read_only=True, allow_null=True)
+    avatar = VariantImageField('small', allow_null=True)
+    avatar_variants = ImageVariantsField('avatar')
 
     class Meta:
         model = User
         fields = (
             'id', 'username', 'email', 'first_name', 'last_name', 'avatar',
-            'is_subscribed')
+            'avatar_variants', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj.subscribers.filter(id=request.user.id).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.subscribers.filter(user=request.user).exists()
 
 
 class UserWriteSerializer(serializers.ModelSerializer):
@@ -49,6 +66,19 @@ class UserWriteSerializer(serializers.ModelSerializer):
         return user
 
 
+class AvatarSerializer(serializers.ModelSerializer):
+    avatar = Base64ImageField()
+
+    class Meta:
+        model = User
+        fields = ('avatar',)
+
+    def update(self, instance, validated_data):
+        if instance.avatar:
+            instance.avatar.delete(save=False)
+        return super().update(instance, validated_data)
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
@@ -67,8 +97,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientWriteSerializer(serializers.Serializer):
-    ingredient = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(min_value=1)
     amount = serializers.IntegerField(min_value=MIN_INGREDIENT_FROM_RECIPES)
 
     def validate(self, data):
@@ -83,7 +112,8 @@ class RecipeIngredientWriteSerializer(serializers.Serializer):
 class RecipeReadSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(source='recipeingredient_set',
                                              many=True, read_only=True)
-    image = serializers.ImageField(use_url=True, read_only=True)
+    image = VariantImageField('medium')
+    image_variants = ImageVariantsField('image')
     author = UserReadSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -91,23 +121,56 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = [
-            'id', 'author', 'name', 'image', 'text', 'cooking_time',
-            'ingredients', 'is_favorited', 'is_in_shopping_cart'
+            'id', 'author', 'name', 'image', 'image_variants', 'text',
+            'cooking_time', 'ingredients', 'is_favorited',
+            'is_in_shopping_cart'
         ]
 
     def get_is_favorited(self, obj):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        return obj.favorites.filter(user=request.user).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.favorited_by.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return obj.in_shopping_cart.filter(user=request.user).exists()
 
 
+class RecipeDocumentListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        recipes = list(data)
+        fill_missing_documents(recipes)
+        return super().to_representation(recipes)
+
+
+class RecipeDocumentSerializer(serializers.BaseSerializer):
+    # Тот же ответ, что у RecipeReadSerializer, но собранный из снимка
+    # recipe.document и флагов, аннотированных в запросе.
+
+    class Meta:
+        list_serializer_class = RecipeDocumentListSerializer
+
+    def to_representation(self, instance):
+        if not instance.document:
+            fill_missing_documents([instance])
+        return render_document(
+            instance.document, self.context.get('request'),
+            thumbnails=self.context.get('thumbnails', False),
+            is_favorited=getattr(instance, 'is_favorited', False),
+            is_in_shopping_cart=getattr(
+                instance, 'is_in_shopping_cart', False),
+            is_subscribed=getattr(instance, 'is_subscribed', False),
+        )
+
+
 class RecipeWriteSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientWriteSerializer(many=True)
     image = Base64ImageField(allow_null=False, allow_empty_file=False)
@@ -122,10 +185,17 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         if not value:
             raise serializers.ValidationError(
                 'Необходимо указать хотя бы один ингредиент.')
-        ingredient_ids = [item['ingredient'].id for item in value]
+        ingredient_ids = [item['id'] for item in value]
         if len(ingredient_ids) != len(set(ingredient_ids)):
             raise serializers.ValidationError(
                 'Ингредиенты не должны повторяться.')
+        # Все id проверяются одним запросом, а не по запросу на ингредиент.
+        missing = set(ingredient_ids) - set(Ingredient.objects.filter(
+            id__in=ingredient_ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(missing)))}.')
         return value
 
     def validate_text(self, value):
@@ -134,32 +204,111 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 'Поле "text" не может быть пустым.')
         return value
 
-    def add_ingredients_to_recipe(self, recipe, ingredients_data):
-        recipe_ingredients = [
+    def add_ingredients_to_recipe(self, recipe, amounts):
+        RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
                 recipe=recipe,
-                ingredient=item['ingredient'],
-                amount=item['amount']
-            ) for item in ingredients_data
-        ]
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+                ingredient_id=ingredient_id,
+                amount=amount
+            ) for ingredient_id, amount in amounts.items()
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(author=self.context['request'].user,
-                                       **validated_data)
-        self.add_ingredients_to_recipe(recipe, ingredients_data)
+        validated_data.setdefault('author', self.context['request'].user)
+        recipe = Recipe.objects.create(**validated_data)
+        self.add_ingredients_to_recipe(recipe, {
+            item['id']: item['amount'] for item in ingredients_data})
+        index_recipes([recipe.id])
+        schedule_similar_refresh([recipe.id])
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients')
+        ingredients_data = validated_data.pop('ingredients', None)
         if instance.image and 'image' in validated_data:
             instance.image.delete(save=False)
         instance = super().update(instance, validated_data)
-        instance.recipeingredient_set.all().delete()
-        self.add_ingredients_to_recipe(instance, ingredients_data)
+        reindex = 'name' in validated_data or 'text' in validated_data
+        if ingredients_data is not None and self.update_ingredients(
+                instance, {item['id']: item['amount']
+                           for item in ingredients_data}):
+            reindex = True
+            schedule_similar_refresh([instance.id])
+        if reindex:
+            index_recipes([instance.id])
         return instance
 
+    def update_ingredients(self, recipe, amounts):
+        # Сравнивает новый состав с сохранённым и меняет только
+        # отличающиеся строки. Возвращает True, если изменился сам набор
+        # ингредиентов.
+        lock_recipes([recipe.id])
+        stored = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount
+            in recipe.recipeingredient_set.values_list(
+                'pk', 'ingredient_id', 'amount')
+        }
+        removed = [
+            pk for ingredient_id, (pk, _) in stored.items()
+            if ingredient_id not in amounts
+        ]
+        added = {
+            ingredient_id: amount for ingredient_id, amount in amounts.items()
+            if ingredient_id not in stored
+        }
+        changed = [
+            RecipeIngredient(pk=stored[ingredient_id][0], amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id in stored and stored[ingredient_id][1] != amount
+        ]
+        if removed:
+            # Удалённые строки вычитает из списков покупок обработчик
+            # post_delete состава, ниже учитываются только остальные.
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if added:
+            self.add_ingredients_to_recipe(recipe, added)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        deltas = {
+            ingredient_id: amount - stored.get(ingredient_id, (None, 0))[1]
+            for ingredient_id, amount in amounts.items()
+        }
+        if any(deltas.values()):
+            update_recipe_in_shopping_lists(recipe.id, deltas)
+        return bool(removed or added)
+
+    def to_representation(self, instance):
+        return RecipeReadSerializer(instance, context=self.context).data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+
+class PantryQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=MAX_PANTRY_INGREDIENTS)
+    min_match = serializers.IntegerField(min_value=1, required=False)
+
+    def to_internal_value(self, data):
+        # Ингредиенты передаются повторяющимся параметром или через
+        # запятую: ?ingredients=1&ingredients=2 или ?ingredients=1,2.
+        values = [
+            value for item in data.getlist('ingredients')
+            for value in item.split(',') if value.strip()
+        ]
+        data = {'ingredients': values, **(
+            {'min_match': data['min_match']} if 'min_match' in data else {})}
+        return super().to_internal_value(data)
+
 
 class ShortLinkSerializer(serializers.Serializer):
     short_link = serializers.SerializerMethodField()
@@ -178,34 +327,34 @@ class ShortLinkSerializer(serializers.Serializer):
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
-    image = serializers.ImageField(use_url=True)
+    image = VariantImageField('small', always=True)
+    image_variants = ImageVariantsField('image')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubscriptionSerializer(UserReadSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta(UserReadSerializer.Meta):
         fields = (
             'id', 'username', 'email', 'first_name', 'last_name', 'avatar',
-            'is_subscribed', 'recipes', 'recipes_count'
+            'avatar_variants', 'is_subscribed', 'recipes', 'recipes_count'
         )
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes = obj.recipes.all()
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            try:
-                recipes = recipes[:int(recipes_limit)]
-            except ValueError:
-                pass
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = request.query_params.get('recipes_limit')
+            if recipes_limit:
+                try:
+                    recipes = recipes[:int(recipes_limit)]
+                except (ValueError, AssertionError):
+                    pass
         return ShortRecipeSerializer(recipes, many=True,
                                      context={'request': request}).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+import tempfile
+
+from django.conf import settings
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+STREAM_CHUNK_SIZE = 64 * 1024
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+
+
+def render_txt(rows):
+    yield 'Список покупок:\n'
+    for name, unit, amount in rows:
+        yield f'- {name}: {amount} {unit}\n'
+
+
+def render_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, unit, amount in rows:
+        writer.writerow((name, amount, unit))
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def render_json(rows):
+    separator = '['
+    for name, unit, amount in rows:
+        yield separator + json.dumps({
+            'name': name,
+            'amount': amount,
+            'measurement_unit': unit,
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+def get_pdf_font():
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT_NAME
+    try:
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+    except Exception:
+        # Без шрифта с кириллицей остаётся встроенный Helvetica.
+        return 'Helvetica'
+    return PDF_FONT_NAME
+
+
+def render_pdf(rows):
+    # В отличие от остальных форматов PDF не отдаётся по мере построения:
+    # ReportLab держит все страницы в памяти и пишет документ только в
+    # save() (таблица ссылок и дерево страниц — в конце файла). Поэтому
+    # документ собирается целиком во временный файл, который сбрасывается
+    # на диск при росте, и возвращается уже готовым для FileResponse.
+    out = tempfile.SpooledTemporaryFile(max_size=STREAM_CHUNK_SIZE * 16)
+    pdf = canvas.Canvas(out, pagesize=A4)
+    font = get_pdf_font()
+    width, height = A4
+    lines_per_page = int((height - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT)
+    line = 0
+    pdf.setFont(font, PDF_FONT_SIZE)
+    pdf.drawString(PDF_MARGIN, height - PDF_MARGIN, 'Список покупок:')
+    line += 1
+    for name, unit, amount in rows:
+        if line >= lines_per_page:
+            pdf.showPage()
+            pdf.setFont(font, PDF_FONT_SIZE)
+            line = 0
+        pdf.drawString(
+            PDF_MARGIN, height - PDF_MARGIN - line * PDF_LINE_HEIGHT,
+            f'- {name}: {amount} {unit}')
+        line += 1
+    pdf.save()
+    out.seek(0)
+    return out
+
+
+EXPORT_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json; charset=utf-8'),
+}
+if canvas is not None:
+    EXPORT_FORMATS['pdf'] = (render_pdf, 'application/pdf')
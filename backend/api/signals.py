@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+
+User = get_user_model()
+
+# Кэш сбрасывается сразу и ещё раз после коммита: параллельный запрос мог
+# успеть положить в кэш данные, прочитанные до коммита.
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    keys = list(Token.objects.filter(
+        user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        invalidate_tokens(keys)
+        transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+    transaction.on_commit(lambda: invalidate_tokens([instance.key]))
@@ -1,58 +1,116 @@
-import base64
-import uuid
+from itertools import chain
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.permissions import (
     IsAuthenticated,
     AllowAny,
     IsAuthenticatedOrReadOnly
 )
-from django.core.files.base import ContentFile
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, redirect
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Window,
+    prefetch_related_objects,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import redirect
 from djoser.views import UserViewSet as DjoserUserViewSet
 
 from recipes.models import (
     Ingredient,
     Recipe,
     Favorite,
+    RecipeSimilarity,
     ShoppingCart,
-    ShortLink,
+    ShoppingListItem,
     RecipeIngredient
 )
 from users.models import Subscription
 from api.serializers import (
+    AvatarSerializer,
     IngredientSerializer,
+    RecipeDocumentSerializer,
     RecipeReadSerializer,
     RecipeWriteSerializer,
     UserReadSerializer,
     UserWriteSerializer,
+    PantryQuerySerializer,
+    RecipeIdsSerializer,
     ShortLinkSerializer,
     SubscriptionSerializer,
     ShortRecipeSerializer
 )
-from recipes.functions import generate_short_code
+from recipes.autocomplete import ingredient_index
+from recipes.cache_versions import bump_user_version
+from recipes.cart import (
+    add_to_shopping_list,
+    lock_recipes,
+    remove_from_shopping_list,
+)
+from recipes.counters import (
+    change_recipe_counters,
+    change_user_counters,
+    lock_user,
+)
+from recipes.feed import get_feed
+from recipes.functions import get_or_create_short_link, resolve_short_code
+from recipes.pantry import pantry_index
+from recipes.trending import change_trending
+from .caching import CachedRecipeReadMixin
+from .pagination import CursorOptInPagination, FeedPagination
+from .renderers import (
+    CSVRenderer,
+    FormatParameterNegotiation,
+    PDFRenderer,
+    PlainTextRenderer,
+)
+from .shopping_list import EXPORT_FORMATS
 from .permissions import IsAuthorOrReadOnly
-from .filters import RecipeFilter, IngredientFilter
+from .filters import RecipeFilter, RecipeOrderingFilter, IngredientFilter
 
 User = get_user_model()
 
+SHOPPING_LIST_RENDERERS = [
+    renderer for renderer in (
+        PlainTextRenderer, CSVRenderer, JSONRenderer, PDFRenderer)
+    if renderer.format in EXPORT_FORMATS
+]
+
 
 class UserViewSet(DjoserUserViewSet):
     queryset = User.objects.all()
     permission_classes = [AllowAny]
+    pagination_class = CursorOptInPagination
 
     def get_serializer_class(self):
         if self.action in ['create', 'partial_update']:
             return UserWriteSerializer
+        if self.action == 'set_password':
+            return super().get_serializer_class()
         return UserReadSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['thumbnails'] = self.action in ('list', 'subscriptions')
+        return context
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
@@ -66,40 +124,89 @@ class UserViewSet(DjoserUserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             try:
-                subscription = Subscription.objects.create(user=user,
-                                                           author=author)
+                with transaction.atomic():
+                    Subscription.objects.create(user=user, author=author)
+                    change_user_counters([author.id], subscribers_count=1)
+                    bump_user_version(user.id)
             except IntegrityError:
                 return Response(
                     {'errors': 'Вы уже подписаны на этого автора.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            serializer = SubscriptionSerializer(subscription,
+            author, = self.prefetch_subscription_recipes(
+                self.get_subscriptions_queryset(
+                    User.objects.filter(pk=author.pk)))
+            serializer = SubscriptionSerializer(author,
                                                 context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         else:
-            subscription = Subscription.objects.filter(user=user,
-                                                       author=author)
-            if not subscription.exists():
+            with transaction.atomic():
+                deleted, _ = Subscription.objects.filter(
+                    user=user, author=author).delete()
+                if deleted:
+                    change_user_counters([author.id], subscribers_count=-1)
+                    bump_user_version(user.id)
+            if not deleted:
                 return Response(
                     {'errors': 'Вы не подписаны на этого пользователя.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_subscriptions_queryset(self, authors):
+        return authors.annotate(
+            is_subscribed=Exists(Subscription.objects.filter(
+                user=self.request.user, author=OuterRef('pk'))),
+        )
+
+    def prefetch_subscription_recipes(self, authors):
+        # Рецепты загружаются одним запросом для уже выбранной страницы
+        # авторов.
+        authors = list(authors)
+        if not authors:
+            return authors
+        recipes = Recipe.objects.order_by('-created_at', '-id')
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        try:
+            recipes_limit = int(recipes_limit)
+        except (TypeError, ValueError):
+            recipes_limit = None
+        if recipes_limit == 0:
+            recipes = recipes.none()
+        elif recipes_limit is not None and recipes_limit > 0:
+            # Первые N рецептов каждого автора — по номеру в окне
+            # ROW_NUMBER() по автору. Django не фильтрует по оконным
+            # выражениям, поэтому номер сравнивается во внешнем SELECT.
+            numbered = Recipe.objects.filter(author__in=authors).annotate(
+                recipe_number=Window(
+                    RowNumber(), partition_by=[F('author_id')],
+                    order_by=[F('created_at').desc(), F('id').desc()]),
+            ).order_by().values('id', 'recipe_number')
+            sql, params = numbered.query.sql_with_params()
+            recipes = recipes.filter(pk__in=RawSQL(
+                f'SELECT numbered.id FROM ({sql}) numbered '
+                f'WHERE numbered.recipe_number <= %s',
+                (*params, recipes_limit)))
+        prefetch_related_objects(authors, Prefetch(
+            'recipes', queryset=recipes, to_attr='limited_recipes'))
+        return authors
+
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         user = request.user
-        subscriptions = User.objects.filter(subscribers__user=user)
+        subscriptions = self.get_subscriptions_queryset(
+            User.objects.filter(subscribers__user=user))
         page = self.paginate_queryset(subscriptions)
         if page is not None:
-            serializer = SubscriptionSerializer(page, many=True,
-                                                context={'request': request})
+            serializer = SubscriptionSerializer(
+                self.prefetch_subscription_recipes(page), many=True,
+                context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
-        serializer = SubscriptionSerializer(subscriptions, many=True,
-                                            context={'request': request})
+        serializer = SubscriptionSerializer(
+            self.prefetch_subscription_recipes(subscriptions), many=True,
+            context=self.get_serializer_context())
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'],
@@ -109,34 +216,13 @@ class UserViewSet(DjoserUserViewSet):
                                         context={'request': request})
         return Response(serializer.data)
 
-    @action(detail=False, methods=['put', 'delete'],
+    @action(detail=False, methods=['put', 'delete'], url_path='me/avatar',
             permission_classes=[IsAuthenticated])
     def avatar(self, request):
         if request.method == 'PUT':
-            avatar_data = request.data.get('avatar')
-            if not avatar_data:
-                return Response(
-                    {'error': 'Поле avatar обязательно'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if not avatar_data.startswith('data:image'):
-                return Response(
-                    {'error': 'Неверный формат base64-изображения'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            try:
-                format, imgstr = avatar_data.split(';base64,')
-                ext = format.split('/')[-1]
-                img_data = base64.b64decode(imgstr)
-                file_name = f"{uuid.uuid4()}.{ext}"
-            except Exception:
-                return Response(
-                    {'error': 'Ошибка обработки изображения'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            user = request.user
-            user.avatar = ContentFile(img_data, name=file_name)
-            user.save()
+            serializer = AvatarSerializer(request.user, data=request.data)
+            serializer.is_valid(raise_exception=True)
+            user = serializer.save()
             return Response({'avatar': user.avatar.url},
                             status=status.HTTP_200_OK)
 
@@ -161,22 +247,125 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        # Подсказки по префиксу отдаются из индекса в памяти процесса,
+        # без запроса к базе на каждое нажатие клавиши.
+        limit = request.query_params.get('limit')
+        try:
+            limit = max(int(limit), 0) if limit else None
+        except ValueError:
+            limit = None
+        return Response(ingredient_index.search(
+            request.query_params.get('name', ''), limit=limit))
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.prefetch_related(
-        'recipeingredient_set__ingredient')
+
+class RecipeViewSet(CachedRecipeReadMixin, viewsets.ModelViewSet):
+    queryset = Recipe.objects.all()
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
-    filter_backends = [DjangoFilterBackend]
+    pagination_class = CursorOptInPagination
+    filter_backends = [DjangoFilterBackend, RecipeOrderingFilter]
     filterset_class = RecipeFilter
+    ordering_fields = ['created_at', 'favorites_count', 'shopping_cart_count',
+                       'trending_score']
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return self.get_document_queryset()
+        user = self.request.user
+        authors = User.objects.all()
+        queryset = Recipe.objects.prefetch_related(
+            Prefetch('recipeingredient_set',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        )
+        if user.is_authenticated:
+            # Флаги текущего пользователя вычисляются в основном запросе,
+            # а не отдельным exists() на каждый рецепт.
+            authors = authors.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(user=user,
+                                            author=OuterRef('pk'))))
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+            )
+        return queryset.prefetch_related(Prefetch('author', queryset=authors))
+
+    def get_document_queryset(self):
+        # Для чтения достаточно снимка и полей сортировки: автор
+        # и ингредиенты уже лежат в снимке, флаги — в том же запросе.
+        user = self.request.user
+        queryset = Recipe.objects.only(
+            'id', 'author', 'document', *self.ordering_fields)
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_subscribed=Exists(Subscription.objects.filter(
+                    user=user, author=OuterRef('author'))),
+            )
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ['create', 'partial_update']:
             return RecipeWriteSerializer
+        if self.action in ('list', 'retrieve'):
+            return RecipeDocumentSerializer
         return RecipeReadSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['thumbnails'] = self.action in ('list', 'feed', 'pantry')
+        return context
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        recipes = self.get_document_queryset()
+
+        def fetch(position, limit):
+            ids = [pk for _, pk in get_feed(request.user.id, position, limit)]
+            found = recipes.in_bulk(ids)
+            return [found[pk] for pk in ids if pk in found]
+
+        paginator = FeedPagination()
+        page = paginator.paginate_feed(request, Recipe, fetch)
+        serializer = RecipeDocumentSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    def pantry(self, request):
+        # Рецепты из имеющихся ингредиентов: все (или min_match) из списка
+        # есть в рецепте. Порядок — по доле ингредиентов рецепта, которые
+        # уже есть, затем по числу совпавших.
+        query = PantryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        matches = pantry_index.search(
+            query.validated_data['ingredients'],
+            query.validated_data.get('min_match'))
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        found = self.get_document_queryset().in_bulk(
+            [pk for pk, _, _ in page])
+        page = [
+            (found[pk], matched, coverage)
+            for pk, matched, coverage in page if pk in found
+        ]
+        data = RecipeDocumentSerializer(
+            [recipe for recipe, _, _ in page], many=True,
+            context=self.get_serializer_context()).data
+        for item, (_, matched, coverage) in zip(data, page):
+            item['matched_ingredients'] = matched
+            item['coverage'] = round(coverage, 3)
+        return paginator.get_paginated_response(data)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
@@ -191,7 +380,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         if request.method == 'POST':
             try:
-                Favorite.objects.create(user=user, recipe=recipe)
+                with transaction.atomic():
+                    lock_user(user.id)
+                    favorite = Favorite.objects.create(
+                        user=user, recipe=recipe)
+                    change_recipe_counters([recipe.id], favorites_count=1)
+                    change_trending(
+                        Favorite, [(recipe.id, favorite.added_at)])
+                    bump_user_version(user.id, counters=True)
             except IntegrityError:
                 return Response(
                     {'errors': 'Этот рецепт уже в вашем избранном.'},
@@ -202,13 +398,21 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            favorite_item = Favorite.objects.filter(user=user, recipe=recipe)
-            if not favorite_item.exists():
+            with transaction.atomic():
+                lock_user(user.id)
+                favorites = Favorite.objects.filter(user=user, recipe=recipe)
+                removed = list(favorites.select_for_update().values_list(
+                    'recipe_id', 'added_at'))
+                deleted, _ = favorites.delete()
+                if deleted:
+                    change_recipe_counters([recipe.id], favorites_count=-1)
+                    change_trending(Favorite, removed, sign=-1)
+                    bump_user_version(user.id, counters=True)
+            if not deleted:
                 return Response(
                     {'errors': 'Этот рецепт не находится в вашем избранном.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            favorite_item.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post', 'delete'],
@@ -219,7 +423,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         if request.method == 'POST':
             try:
-                ShoppingCart.objects.create(user=user, recipe=recipe)
+                with transaction.atomic():
+                    lock_user(user.id)
+                    lock_recipes([recipe.id])
+                    cart = ShoppingCart.objects.create(
+                        user=user, recipe=recipe)
+                    add_to_shopping_list(user.id, [recipe.id])
+                    change_recipe_counters([recipe.id], shopping_cart_count=1)
+                    change_trending(
+                        ShoppingCart, [(recipe.id, cart.added_at)])
+                    bump_user_version(user.id, counters=True)
             except IntegrityError:
                 return Response(
                     {'errors': 'Этот рецепт уже в вашей корзине.'},
@@ -230,68 +443,140 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            cart_item = ShoppingCart.objects.filter(user=user, recipe=recipe)
-            if not cart_item.exists():
+            with transaction.atomic():
+                lock_user(user.id)
+                lock_recipes([recipe.id])
+                carts = ShoppingCart.objects.filter(user=user, recipe=recipe)
+                removed = list(carts.select_for_update().values_list(
+                    'recipe_id', 'added_at'))
+                deleted, _ = carts.delete()
+                if deleted:
+                    remove_from_shopping_list(user.id, [recipe.id])
+                    change_recipe_counters([recipe.id],
+                                           shopping_cart_count=-1)
+                    change_trending(ShoppingCart, removed, sign=-1)
+                    bump_user_version(user.id, counters=True)
+            if not deleted:
                 return Response(
                     {'errors': 'Этот рецепт не находится в вашей корзине.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            cart_item.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['get'],
+    @action(detail=False, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
-    def download_shopping_cart(self, request):
+    def bulk_favorite(self, request):
+        return self.bulk_change(request, Favorite, 'favorites_count')
+
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated])
+    def bulk_shopping_cart(self, request):
+        return self.bulk_change(
+            request, ShoppingCart, 'shopping_cart_count',
+            on_add=add_to_shopping_list, on_remove=remove_from_shopping_list)
+
+    def bulk_change(self, request, model, counter, on_add=None,
+                    on_remove=None):
+        # Добавляет или удаляет сразу список рецептов. Число запросов
+        # не зависит от длины списка: блокировка пользователя, выборка
+        # рецептов и уже добавленных, одна вставка или удаление,
+        # обновление счётчиков и популярности.
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
         user = request.user
-        shopping_cart = ShoppingCart.objects.filter(user=user)
-        if not shopping_cart.exists():
+        with transaction.atomic():
+            # Под блокировкой пользователя разница с уже добавленными
+            # точна: вставить или удалить те же строки параллельно никто
+            # не успеет, и счётчики меняются только для реальных строк.
+            lock_user(user.id)
+            recipes = Recipe.objects.filter(pk__in=recipe_ids)
+            if on_add is not None:
+                # Корзина зависит от состава рецептов, см. lock_recipes.
+                recipes = recipes.select_for_update().order_by('pk')
+            found = set(recipes.values_list('pk', flat=True))
+            present = dict(model.objects.filter(
+                user=user, recipe_id__in=found
+            ).values_list('recipe_id', 'added_at'))
+            if request.method == 'POST':
+                changed = found - present.keys()
+                rows = model.objects.bulk_create(
+                    [model(user=user, recipe_id=pk) for pk in changed])
+                events = [(row.recipe_id, row.added_at) for row in rows]
+                hook, delta, statuses = on_add, 1, ('added', 'exists')
+            else:
+                changed = set(present)
+                model.objects.filter(
+                    user=user, recipe_id__in=changed).delete()
+                events = list(present.items())
+                hook, delta, statuses = on_remove, -1, ('removed', 'absent')
+            if changed:
+                if hook:
+                    hook(user.id, changed)
+                change_recipe_counters(changed, **{counter: delta})
+                change_trending(model, events, sign=delta)
+                bump_user_version(user.id, counters=True)
+        return Response({'results': [
+            {'id': pk, 'status': (
+                'not_found' if pk not in found
+                else statuses[0] if pk in changed else statuses[1])}
+            for pk in recipe_ids
+        ]})
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS,
+            content_negotiation_class=FormatParameterNegotiation)
+    def download_shopping_cart(self, request):
+        export_format = request.accepted_renderer.format
+        render, content_type = EXPORT_FORMATS[export_format]
+        rows = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'total_amount'
+        ).order_by('ingredient__name').iterator(chunk_size=2000)
+        first = next(rows, None)
+        if first is None:
             return HttpResponse(
                 'Ваша корзина пуста.',
                 content_type='text/plain; charset=utf-8',
                 status=status.HTTP_200_OK
             )
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in_shopping_cart__user=user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('amount')
-        ).order_by('ingredient__name')
-        content = 'Список покупок:\n'
-        for item in ingredients:
-            name = item['ingredient__name']
-            unit = item['ingredient__measurement_unit']
-            amount = item['total_amount']
-            content += f'- {name}: {amount} {unit}\n'
-        response = HttpResponse(
-            content,
-            content_type='text/plain; charset=utf-8'
-        )
-        response[
-            'Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
+        content = render(chain([first], rows))
+        if hasattr(content, 'read'):
+            # Готовый файл (PDF собирается целиком, см. render_pdf).
+            response = FileResponse(content, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{export_format}"')
         return response
 
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    def similar(self, request, pk=None):
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        recipes = [
+            similarity.similar for similarity in
+            RecipeSimilarity.objects.filter(recipe=recipe).select_related(
+                'similar').order_by('-score', 'similar_id')
+        ]
+        return Response(ShortRecipeSerializer(
+            recipes, many=True, context={'request': request}).data)
+
     @action(detail=True, methods=['get'], permission_classes=[AllowAny])
     def get_link(self, request, pk=None):
-        recipe = self.get_object()
-        short_link = ShortLink.objects.filter(recipe=recipe).first()
-        if not short_link:
-            while True:
-                short_code = generate_short_code()
-                if not ShortLink.objects.filter(
-                        short_code=short_code).exists():
-                    break
-            short_link = ShortLink.objects.create(
-                recipe=recipe,
-                short_code=short_code
-            )
+        short_link = get_or_create_short_link(self.get_object())
         serializer = ShortLinkSerializer(short_link,
                                          context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 def redirect_short_link(request, short_code):
-    short_link = get_object_or_404(ShortLink, short_code=short_code)
-    recipe_url = f"/api/recipes/{short_link.recipe.id}/"
+    recipe_id = resolve_short_code(short_code)
+    if recipe_id is None:
+        raise Http404
+    recipe_url = f"/api/recipes/{recipe_id}/"
     return redirect(recipe_url)
@@ -0,0 +1,33 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def run_in_background(func, *args):
+    # Работа после коммита (картинки, индексы, ленты, похожие рецепты)
+    # идёт в общем пуле потоков. При BACKGROUND_WORKERS = 0 — сразу в
+    # вызывающем потоке, как в тестах.
+    global _executor
+    workers = settings.BACKGROUND_WORKERS
+    if not workers:
+        return _run_job(func, *args)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='background')
+    return _executor.submit(_run_job, func, *args, close_connections=True)
+
+
+def _run_job(func, *args, close_connections=False):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка фоновой задачи %s', func.__name__)
+    finally:
+        if close_connections:
+            connections.close_all()
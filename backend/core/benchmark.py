@@ -0,0 +1,46 @@
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def measure(func, repeat=100, warmup=1):
+    # Время в микросекундах и среднее число SQL-запросов на вызов.
+    for _ in range(warmup):
+        func()
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1_000_000)
+    return {
+        'repeat': repeat,
+        'mean_us': round(statistics.mean(timings), 1),
+        'p50_us': round(percentile(timings, 50), 1),
+        'p95_us': round(percentile(timings, 95), 1),
+        'p99_us': round(percentile(timings, 99), 1),
+        'queries': round(len(queries) / repeat, 2),
+    }
+
+
+def format_result(name, result):
+    return (
+        f'{name}: p50={result["p50_us"]}мкс p95={result["p95_us"]}мкс '
+        f'p99={result["p99_us"]}мкс запросов={result["queries"]}'
+    )
+
+
+def format_throughput(rows, started):
+    # started — значение time.monotonic() в начале работы.
+    elapsed = max(time.monotonic() - started, 1e-6)
+    return f'{rows} строк за {elapsed:.1f} с ({rows / elapsed:.0f} строк/с)'
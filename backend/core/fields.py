@@ -1,12 +1,59 @@
 from rest_framework import serializers
-import base64
-from django.core.files.base import ContentFile
+
+from core.images import decode_base64_image
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=f'image.{ext}')
+            data = decode_base64_image(data)
         return super().to_internal_value(data)
+
+
+class ImageVariantsField(serializers.Field):
+    # Ссылки на уменьшенные копии: {'small': {'url': ..., 'webp': ...}}.
+    # Пока копии не готовы, отдаётся пустой словарь.
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        storage = getattr(instance, self.image_field).storage
+        return {
+            variant: {
+                key: build_url(request, storage.url(name))
+                for key, name in files.items()
+            }
+            for variant, files in getattr(
+                instance, f'{self.image_field}_variants').items()
+            if variant != 'source'
+        }
+
+
+class VariantImageField(serializers.ImageField):
+    # Отдаёт уменьшенную копию variant вместо оригинала, если она готова.
+    # Без always копия отдаётся только при thumbnails в контексте
+    # сериализатора, то есть в списках.
+
+    def __init__(self, variant, always=False, **kwargs):
+        self.variant = variant
+        self.always = always
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        image = getattr(instance, self.field_name)
+        files = getattr(instance, f'{self.field_name}_variants').get(
+            self.variant)
+        if (not image or not files
+                or not (self.always or self.context.get('thumbnails'))):
+            return super().to_representation(image)
+        return build_url(self.context.get('request'),
+                         image.storage.url(files['url']))
+
+
+def build_url(request, url):
+    return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,128 @@
+import base64
+import binascii
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png'}
+VARIANTS_DIR = 'variants'
+
+
+def decode_base64_image(data):
+    # Проверяет размер строки до декодирования base64 и размеры картинки
+    # по заголовку, не распаковывая пиксели.
+    try:
+        header, encoded = data.split(';base64,', 1)
+    except ValueError:
+        raise ValidationError('Неверный формат base64-изображения.')
+    max_size = settings.IMAGE_MAX_UPLOAD_SIZE
+    if len(encoded) > (max_size + 2) // 3 * 4:
+        raise ValidationError(
+            f'Размер изображения превышает {max_size // 1024 ** 2} МБ.')
+    try:
+        content = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValidationError('Неверный формат base64-изображения.')
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            check_image(image)
+            ext = IMAGE_EXTENSIONS.get(image.format)
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise ValidationError('Загрузите корректное изображение.')
+    if ext is None:
+        raise ValidationError('Допустимы только изображения PNG и JPEG.')
+    return ContentFile(content, name=f'image.{ext}')
+
+
+def check_image(image):
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            f'Изображение {width}x{height} слишком большое.')
+
+
+def variant_name(name, variant, ext):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, VARIANTS_DIR, f'{stem}_{variant}.{ext}')
+
+
+def render_variants(field_file):
+    # Уменьшенные копии в исходном формате и в WebP. Каждая следующая
+    # копия строится из предыдущей, JPEG декодируется сразу в уменьшенном
+    # масштабе через draft().
+    storage = field_file.storage
+    sizes = sorted(settings.IMAGE_VARIANTS.items(),
+                   key=lambda item: item[1], reverse=True)
+    variants = {'source': field_file.name}
+    with storage.open(field_file.name) as source, Image.open(source) as image:
+        check_image(image)
+        image_format = 'PNG' if image.format == 'PNG' else 'JPEG'
+        if image.format == 'JPEG':
+            image.draft('RGB', (sizes[0][1], sizes[0][1]))
+        current = ImageOps.exif_transpose(image)
+        if image_format == 'JPEG' and current.mode not in ('RGB', 'L'):
+            current = current.convert('RGB')
+        for variant, size in sizes:
+            current = current.copy()
+            current.thumbnail((size, size))
+            variants[variant] = {
+                'url': save_variant(
+                    storage, current, image_format,
+                    variant_name(field_file.name, variant,
+                                 IMAGE_EXTENSIONS[image_format])),
+                'webp': save_variant(
+                    storage, current, 'WEBP',
+                    variant_name(field_file.name, variant, 'webp')),
+            }
+    return variants
+
+
+def save_variant(storage, image, image_format, name):
+    buffer = io.BytesIO()
+    options = {'optimize': True}
+    if image_format != 'PNG':
+        options['quality'] = settings.IMAGE_VARIANT_QUALITY
+    image.save(buffer, image_format, **options)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def delete_variants(storage, variants):
+    for variant, files in variants.items():
+        if variant == 'source':
+            continue
+        for name in files.values():
+            storage.delete(name)
+
+
+def generate_variants(model, pk, field_name, force=False):
+    # Возвращает True, если копии изменились. Если пока шла обработка
+    # картинку успели заменить, результат выбрасывается.
+    variants_field = f'{field_name}_variants'
+    instance = model.objects.filter(pk=pk).only(
+        field_name, variants_field).first()
+    if instance is None:
+        return False
+    field_file = getattr(instance, field_name)
+    old_variants = getattr(instance, variants_field)
+    if not force and (
+            (old_variants.get('source') or None) == (field_file.name or None)):
+        return False
+    if field_file and not field_file.storage.exists(field_file.name):
+        return False
+    if field_file:
+        variants = render_variants(field_file)
+        current = Q(**{field_name: field_file.name})
+    else:
+        variants = {}
+        current = Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True})
+    updated = model.objects.filter(current, pk=pk).update(
+        **{variants_field: variants})
+    storage = getattr(model, field_name).field.storage
+    delete_variants(storage, old_variants if updated else variants)
+    return bool(updated)
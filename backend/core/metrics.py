@@ -0,0 +1,138 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+HISTOGRAMS = {
+    'foodgram_request_duration_seconds': (
+        DURATION_BUCKETS, 'Время обработки запроса'),
+    'foodgram_request_db_queries': (
+        QUERY_BUCKETS, 'Число SQL-запросов на запрос'),
+    'foodgram_request_db_duration_seconds': (
+        DURATION_BUCKETS, 'Время SQL-запросов на запрос'),
+    'foodgram_response_size_bytes': (SIZE_BUCKETS, 'Размер ответа'),
+}
+
+
+class MetricsRegistry:
+    # Гистограммы по меткам в памяти процесса. Если задан METRICS_DIR,
+    # каждый процесс не чаще раза в METRICS_FLUSH_INTERVAL секунд пишет
+    # свой снимок в отдельный файл, а выдача метрик складывает файлы всех
+    # процессов — так данные собираются со всех воркеров gunicorn без
+    # общей памяти и блокировок между процессами.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._histograms = {}
+        self._flushed_at = 0.0
+
+    def observe(self, labels, values):
+        # labels — кортеж пар (имя, значение), values — {метрика: значение}.
+        with self._lock:
+            self._check_pid()
+            for name, value in values.items():
+                buckets = HISTOGRAMS[name][0]
+                histogram = self._histograms.setdefault(
+                    (name, labels), [0] * (len(buckets) + 1) + [0.0])
+                histogram[bisect_left(buckets, value)] += 1
+                histogram[-1] += value
+        if (settings.METRICS_DIR and time.monotonic() - self._flushed_at
+                >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def _check_pid(self):
+        # После fork дочерний процесс не должен повторно отдавать
+        # значения, накопленные родителем.
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._histograms = {}
+
+    def snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return [
+                [name, list(labels), list(histogram)]
+                for (name, labels), histogram in self._histograms.items()
+            ]
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, f'metrics-{self._pid}.json')
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)
+
+    def collect(self):
+        if not settings.METRICS_DIR:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(
+                    os.path.join(settings.METRICS_DIR, 'metrics-*.json')):
+                try:
+                    with open(path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for snapshot in snapshots:
+            for name, labels, histogram in snapshot:
+                key = (name, tuple(map(tuple, labels)))
+                total = merged.setdefault(key, [0] * len(histogram))
+                for index, value in enumerate(histogram):
+                    total[index] += value
+        return merged
+
+    def clear(self):
+        with self._lock:
+            self._histograms = {}
+
+    def render(self):
+        # Текстовый формат Prometheus 0.0.4.
+        merged = self.collect()
+        lines = []
+        for name, (buckets, description) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), histogram in sorted(merged.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(
+                        [*buckets, '+Inf'], histogram[:-1]):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{format_labels(labels, le=bound)} '
+                        f'{cumulative}')
+                lines.append(
+                    f'{name}_sum{format_labels(labels)} {histogram[-1]}')
+                lines.append(
+                    f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    return '{' + ','.join(
+        f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connections
+
+from core.metrics import registry
+from core.routers import replica_health, route_reads
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    # Обёртка для connection.execute_wrapper: считает запросы и их время.
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    # Время ответа, число и время SQL-запросов и размер ответа по view
+    # и action. Медленные запросы дополнительно пишутся в лог.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        view, action = resolve_view(request)
+        labels = (('view', view), ('action', action),
+                  ('method', request.method),
+                  ('status', str(response.status_code)))
+        values = {
+            'foodgram_request_duration_seconds': duration,
+            'foodgram_request_db_queries': stats.count,
+            'foodgram_request_db_duration_seconds': stats.duration,
+        }
+        if not response.streaming:
+            values['foodgram_response_size_bytes'] = len(response.content)
+        registry.observe(labels, values)
+        threshold = settings.SLOW_REQUEST_THRESHOLD_MS
+        if threshold and duration * 1000 >= threshold:
+            logger.warning(
+                'Медленный запрос %s %s (%s.%s): %.0f мс, SQL-запросов %d '
+                'за %.0f мс', request.method, request.get_full_path(), view,
+                action, duration * 1000, stats.count, stats.duration * 1000)
+        return response
+
+
+class ReplicaMiddleware:
+    # GET и HEAD читают с одной из доступных реплик. Запрос, который
+    # что-то записал, на REPLICA_STICKY_SECONDS закрепляет клиента за
+    # основной базой (cookie, а для клиентов с токеном — ещё и ключ
+    # в кэше), чтобы он сразу видел свои изменения. Если реплика упала
+    # посреди запроса, он повторяется на основной базе.
+    safe_methods = ('GET', 'HEAD')
+    cookie_name = 'db_primary_until'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.READ_REPLICAS:
+            return self.get_response(request)
+        replica = None
+        if request.method in self.safe_methods and not self.is_sticky(
+                request):
+            replica = replica_health.choose()
+        with ExitStack() as stack:
+            routing = stack.enter_context(route_reads(replica))
+            if replica:
+                stack.enter_context(connections[replica].execute_wrapper(
+                    ReplicaWatcher(replica, routing)))
+            response = self.get_response(request)
+        if routing.failed:
+            with route_reads(None) as routing:
+                response = self.get_response(request)
+        if routing.wrote:
+            self.stick(request, response)
+        return response
+
+    def is_sticky(self, request):
+        try:
+            until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            until = 0
+        if until > time.time():
+            return True
+        key = sticky_cache_key(request)
+        return key is not None and cache.get(key) is not None
+
+    def stick(self, request, response):
+        window = settings.REPLICA_STICKY_SECONDS
+        response.set_cookie(
+            self.cookie_name, str(time.time() + window), max_age=window,
+            httponly=True, samesite='Lax')
+        key = sticky_cache_key(request)
+        if key is not None:
+            cache.set(key, True, window)
+
+
+class ReplicaWatcher:
+    # Обёртка для connection.execute_wrapper реплики: ошибка соединения
+    # исключает реплику до следующей проверки.
+
+    def __init__(self, alias, routing):
+        self.alias = alias
+        self.routing = routing
+
+    def __call__(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError:
+            self.routing.failed = True
+            replica_health.mark_down(self.alias)
+            raise
+
+
+def sticky_cache_key(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return ('core:db_primary:'
+            f'{hashlib.sha256(authorization.encode()).hexdigest()}')
+
+
+def resolve_view(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', ''
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return getattr(match.func, '__name__', 'unknown'), ''
+    actions = getattr(match.func, 'actions', None) or {}
+    return (view_class.__name__,
+            actions.get(request.method.lower(), request.method.lower()))
@@ -0,0 +1,133 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+
+logger = logging.getLogger(__name__)
+
+# Отставание реплики PostgreSQL в секундах; 0, если всё полученное уже
+# применено (иначе простаивающая основная база выглядела бы отставанием).
+LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - '
+    'pg_last_xact_replay_timestamp()) END'
+)
+
+
+class Routing:
+    # Состояние маршрутизации одного запроса: реплика для чтения (None —
+    # основная база), была ли запись и падала ли реплика.
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+        self.failed = False
+
+
+_routing = ContextVar('db_routing', default=None)
+
+
+@contextmanager
+def route_reads(replica):
+    routing = Routing(replica)
+    token = _routing.set(routing)
+    try:
+        yield routing
+    finally:
+        _routing.reset(token)
+
+
+def use_primary():
+    # Чтение внутри блока идёт с основной базы, например когда данные
+    # могли появиться только что и ещё не дойти до реплики.
+    return route_reads(None)
+
+
+class ReplicaRouter:
+    # Вне запросов (команды, оболочка) маршрутизация не вмешивается.
+    # В запросе чтение идёт с выбранной middleware реплики, пока в этом
+    # же запросе не было записи; запись — всегда в основную базу.
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None:
+            return None
+        if routing.replica and not routing.wrote:
+            return routing.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На реплике те же строки, что и в основной базе.
+        aliases = {DEFAULT_DB_ALIAS, *settings.READ_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.READ_REPLICAS:
+            return False
+        return None
+
+
+def check_replica(alias):
+    try:
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+            else:
+                cursor.execute('SELECT 1')
+                lag = None
+    except (ConnectionDoesNotExist, DatabaseError):
+        logger.warning('Реплика %s недоступна', alias, exc_info=True)
+        return False
+    if lag is not None and lag > settings.REPLICA_MAX_LAG:
+        logger.warning('Реплика %s отстаёт на %.1f с', alias, lag)
+        return False
+    return True
+
+
+class ReplicaHealth:
+    # Доступность реплик в памяти процесса. Каждая проверяется не чаще
+    # раза в REPLICA_CHECK_INTERVAL секунд; реплика, на которой упал
+    # запрос, исключается до следующей проверки.
+
+    def __init__(self):
+        self._checked = {}
+
+    def choose(self):
+        healthy = [
+            alias for alias in settings.READ_REPLICAS
+            if self.is_healthy(alias)
+        ]
+        return random.choice(healthy) if healthy else None
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        checked = self._checked.get(alias)
+        if checked is None or (
+                now - checked[0] >= settings.REPLICA_CHECK_INTERVAL):
+            checked = (now, check_replica(alias))
+            self._checked[alias] = checked
+        return checked[1]
+
+    def mark_down(self, alias):
+        self._checked[alias] = (time.monotonic(), False)
+
+    def clear(self):
+        self._checked = {}
+
+
+replica_health = ReplicaHealth()
@@ -0,0 +1,67 @@
+import csv
+import json
+import re
+from itertools import islice
+
+CHUNK_SIZE = 64 * 1024
+# Неразобранный элемент длиннее этого числа символов считается ошибкой:
+# иначе файл без закрывающей скобки целиком собирался бы в памяти.
+MAX_OBJECT_SIZE = 16 * 1024 * 1024
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json(file, chunk_size=CHUNK_SIZE, max_size=MAX_OBJECT_SIZE):
+    # Отдаёт по одному элементы массива JSON верхнего уровня или строки
+    # JSON Lines, читая файл кусками по chunk_size символов.
+    decoder = json.JSONDecoder()
+    buffer, position, eof, started = '', 0, False, False
+    while True:
+        position = _SEPARATORS.match(buffer, position).end()
+        if position < len(buffer):
+            if not started:
+                started = True
+                if buffer[position] == '[':
+                    position += 1
+                    continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # Число в конце буфера могло прочитаться не полностью.
+                if end < len(buffer) or eof:
+                    yield item
+                    position = end
+                    continue
+        elif eof:
+            return
+        if len(buffer) - position > max_size:
+            raise ValueError(
+                f'Элемент JSON длиннее {max_size} символов')
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+
+
+def iter_csv(file, header=None):
+    # Пропускает первую строку, если она совпадает с header.
+    rows = csv.reader(file)
+    for row in rows:
+        if row != header:
+            yield row
+        break
+    yield from rows
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
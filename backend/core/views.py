@@ -0,0 +1,29 @@
+import ipaddress
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from core.metrics import registry
+
+
+def metrics_allowed(request):
+    if request.user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network.strip(), strict=False)
+        for network in settings.METRICS_ALLOWED_NETWORKS if network.strip()
+    )
+
+
+def metrics(request):
+    # Наружу не проксируется nginx: собирается Prometheus напрямую
+    # с backend:8000. Остальным адресам отвечает 404, как будто адреса
+    # нет.
+    if not metrics_allowed(request):
+        raise Http404
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
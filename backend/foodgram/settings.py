@@ -27,6 +27,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,9 +58,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+DB_ENGINE = os.getenv('DB_ENGINE', 'django.db.backends.postgresql')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': DB_ENGINE,
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
@@ -67,6 +71,34 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: DB_REPLICAS — хосты через запятую с теми же
+# параметрами, что у основной базы. Для SQLite — пути к копиям файла базы.
+for number, location in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'NAME' if DB_ENGINE.endswith('sqlite3') else 'HOST': location.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    if DB_ENGINE.endswith('postgresql'):
+        DATABASES[f'replica{number}']['OPTIONS'] = {'connect_timeout': 2}
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# Сколько секунд после записи клиент читает с основной базы.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+REPLICA_CHECK_INTERVAL = 10
+# Реплика, отстающая больше чем на столько секунд, не используется.
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -98,11 +130,36 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/django')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_MAX_UPLOAD_SIZE = 5 * 1024 ** 2
+IMAGE_MAX_PIXELS = 25_000_000
+IMAGE_VARIANTS = {
+    'small': 320,
+    'medium': 800,
+}
+IMAGE_VARIANT_QUALITY = 80
+
+# Потоки для работы после коммита: картинки, поисковый индекс, ленты,
+# похожие рецепты. 0 — выполнять сразу в потоке запроса.
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Каталог для метрик воркеров gunicorn; без него метрики только
+# текущего процесса.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1
+SLOW_REQUEST_THRESHOLD_MS = int(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 1000))
+# Адреса и подсети, с которых доступен /metrics (например, подсеть
+# docker-сети с Prometheus). Сотрудникам он доступен с любого адреса.
+METRICS_ALLOWED_NETWORKS = os.getenv(
+    'METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128').split(',')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -4,12 +4,16 @@ from django.conf import settings
 from django.conf.urls.static import static
 
 from api.views import redirect_short_link
+from core.views import metrics
+from recipes.constants import MAX_SHORT_CODE_LEN, MIN_SHORT_CODE_LEN
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics),
     re_path(
-        r'^s/(?P<short_code>[a-zA-Z0-9]{4})/$',
+        rf'^s/(?P<short_code>[a-zA-Z0-9]'
+        rf'{{{MIN_SHORT_CODE_LEN},{MAX_SHORT_CODE_LEN}}})/$',
         redirect_short_link
     ),
     path('api/', include('api.urls')),
@@ -5,11 +5,27 @@ from .models import (
     Recipe,
     RecipeIngredient,
     ShoppingCart,
+    ShoppingListItem,
     Favorite,
     ShortLink
 )
 
 
+class ReadOnlyAdmin(admin.ModelAdmin):
+    # Корзины, избранное и списки покупок меняются только через API:
+    # вместе со строкой пересчитываются счётчики, список покупок
+    # и популярность рецепта, которые админка не обновляет.
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
@@ -18,14 +34,11 @@ class IngredientAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count')
+    list_select_related = ('author',)
     search_fields = ('name', 'author__username')
-    readonly_fields = ('favorite_count',)
-
-    def favorite_count(self, obj):
-        return obj.favorite_set.count()
-
-    favorite_count.short_description = 'Добавлений в избранное'
+    readonly_fields = ('favorites_count', 'shopping_cart_count',
+                       'trending_score')
 
 
 @admin.register(RecipeIngredient)
@@ -34,12 +47,18 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(ReadOnlyAdmin):
     list_display = ('user', 'recipe', 'added_at')
 
 
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(ReadOnlyAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    list_select_related = ('user', 'ingredient')
+
+
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(ReadOnlyAdmin):
     list_display = ('user', 'recipe', 'added_at')
 
 
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+        post_migrate.connect(signals.setup_search, sender=self)
+        post_migrate.connect(signals.setup_trending, sender=self)
@@ -0,0 +1,73 @@
+import threading
+import uuid
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from .models import Ingredient
+
+INDEX_VERSION_KEY = 'recipes:ingredient_index:version'
+
+
+def fold(value):
+    return value.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex:
+    # Отсортированный по свёрнутому регистру каталог ингредиентов в памяти
+    # процесса. Поиск по префиксу — бинарный поиск по списку ключей.
+    # Версия каталога хранится в кэше Django: её смена в любом процессе
+    # приводит к перезагрузке индекса при следующем запросе.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._catalog = ([], [])
+
+    def search(self, prefix='', limit=None):
+        self._ensure_fresh()
+        keys, rows = self._catalog
+        prefix = fold(prefix)
+        start = bisect_left(keys, prefix)
+        stop = len(keys)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        results = []
+        for position in range(start, stop):
+            if not keys[position].startswith(prefix):
+                break
+            pk, name, measurement_unit = rows[position]
+            results.append({
+                'id': pk,
+                'name': name,
+                'measurement_unit': measurement_unit,
+            })
+        return results
+
+    def invalidate(self):
+        cache.set(INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+        self._version = None
+
+    def _ensure_fresh(self):
+        version = cache.get(INDEX_VERSION_KEY)
+        if version is not None and version == self._version:
+            return
+        with self._lock:
+            if version is None:
+                cache.add(INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(INDEX_VERSION_KEY)
+            if version != self._version:
+                self._load(version)
+
+    def _load(self, version):
+        catalog = sorted(
+            (fold(name), (pk, name, measurement_unit))
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit').iterator()
+        )
+        self._catalog = (
+            [key for key, _ in catalog], [row for _, row in catalog])
+        self._version = version
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,57 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+RECIPES_VERSION_KEY = 'recipes:version'
+COUNTERS_VERSION_KEY = 'recipes:counters_version'
+# Версии, созданные при чтении, живут ограниченное время: иначе запросы
+# к несуществующим рецептам оставляли бы в кэше вечные ключи.
+MISSING_VERSION_TIMEOUT = 24 * 60 * 60
+
+
+def recipe_version_key(recipe_id):
+    return f'recipes:version:{recipe_id}'
+
+
+def user_version_key(user_id):
+    return f'recipes:user_version:{user_id}'
+
+
+def get_versions(keys):
+    # Версия — время последнего изменения (в секундах), поэтому она же
+    # служит значением Last-Modified. Потерянная версия считается новой.
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, MISSING_VERSION_TIMEOUT)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def set_versions(keys):
+    current = cache.get_many(keys)
+    now = time.time()
+    cache.set_many({
+        key: max(now, current.get(key, 0) + 0.001) for key in keys
+    }, None)
+
+
+def bump_versions(keys):
+    transaction.on_commit(lambda: set_versions(keys))
+
+
+def recipe_version_keys(recipe_ids=()):
+    return [RECIPES_VERSION_KEY] + [
+        recipe_version_key(pk) for pk in recipe_ids]
+
+
+def bump_recipe_versions(recipe_ids=()):
+    bump_versions(recipe_version_keys(recipe_ids))
+
+
+def bump_user_version(user_id, counters=False):
+    keys = [user_version_key(user_id)]
+    if counters:
+        keys.append(COUNTERS_VERSION_KEY)
+    bump_versions(keys)
@@ -0,0 +1,90 @@
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Recipe, RecipeIngredient, ShoppingCart, ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+def lock_recipes(recipe_ids):
+    # Правка состава и изменения корзин с рецептом идут по очереди.
+    # Иначе добавление в корзину может прочитать старый состав, а правка
+    # не увидеть новую корзину, и список покупок разойдётся с составом.
+    # Порядок по id — чтобы пакетные запросы не блокировали друг друга.
+    list(Recipe.objects.select_for_update().filter(
+        pk__in=recipe_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def get_recipe_amounts(recipe_ids):
+    return dict(
+        RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(total=Sum('amount'))
+    )
+
+
+def apply_shopping_list_changes(user_ids, deltas):
+    # Изменяет суммы ингредиентов в списках покупок пользователей на
+    # величины из deltas ({ingredient_id: delta}) одним UPDATE.
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=pk)
+             for user_id in user_ids for pk in added),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    items.update(total_amount=Greatest(
+        F('total_amount') + Case(
+            *(When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    ))
+    if len(added) < len(deltas):
+        items.filter(total_amount=0).delete()
+
+
+def add_to_shopping_list(user_id, recipe_ids):
+    apply_shopping_list_changes([user_id], get_recipe_amounts(recipe_ids))
+
+
+def remove_from_shopping_list(user_id, recipe_ids):
+    apply_shopping_list_changes([user_id], {
+        pk: -amount for pk, amount in get_recipe_amounts(recipe_ids).items()
+    })
+
+
+def get_cart_user_ids(recipe_id):
+    return list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+
+
+def update_recipe_in_shopping_lists(recipe_id, deltas):
+    lock_recipes([recipe_id])
+    apply_shopping_list_changes(get_cart_user_ids(recipe_id), deltas)
+
+
+def remove_recipe_from_shopping_lists(recipe_id):
+    lock_recipes([recipe_id])
+    apply_shopping_list_changes(get_cart_user_ids(recipe_id), {
+        pk: -amount for pk, amount in get_recipe_amounts([recipe_id]).items()
+    })
+
+
+def get_expected_shopping_lists(user_ids):
+    expected = {}
+    for user_id, ingredient_id, total in RecipeIngredient.objects.filter(
+            recipe__in_shopping_cart__user_id__in=user_ids
+    ).values_list(
+        'recipe__in_shopping_cart__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')):
+        expected[user_id, ingredient_id] = total
+    return expected
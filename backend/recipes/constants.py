@@ -4,7 +4,32 @@ MAX_INGREDIENT_NAME_LEN = 128
 MAX_MEASUREMENT_UNIT_LEN = 64
 MIN_COOKING_TIME = 1
 MIN_INGREDIENT_FROM_RECIPES = 1
+MIN_SHORT_CODE_LEN = 4
 MAX_SHORT_CODE_LEN = 6
+MAX_BULK_RECIPES = 100
+# Рецепты авторов с таким числом подписчиков не раскладываются по лентам,
+# а подмешиваются при чтении.
+FEED_FAN_OUT_MAX_SUBSCRIBERS = 5000
+FEED_BACKFILL_RECIPES = 100
+SIMILAR_RECIPES_COUNT = 10
+# jaccard или cosine.
+SIMILARITY_METRIC = 'jaccard'
+# Ингредиент считается частым, если он есть больше чем в такой доле
+# рецептов, но не меньше чем в SIMILARITY_MIN_POSTINGS рецептах.
+SIMILARITY_MAX_DF = 0.05
+SIMILARITY_MIN_POSTINGS = 1000
+MAX_PANTRY_INGREDIENTS = 50
+# Изменения рецептов, которые процессы догоняют точечно; при большем
+# отставании индекс по ингредиентам перезагружается целиком.
+PANTRY_MAX_CHANGES = 1000
+PANTRY_CHANGE_TIMEOUT = 60 * 60
+# Вклад добавления в избранное или корзину в популярность рецепта
+# уменьшается вдвое за TRENDING_HALF_LIFE_HOURS часов.
+TRENDING_HALF_LIFE_HOURS = 72
+TRENDING_FAVORITE_WEIGHT = 1.0
+TRENDING_CART_WEIGHT = 0.5
+# Оценки меньше этой при перенормировке обнуляются.
+TRENDING_MIN_SCORE = 1e-6
 
 # Константы для моделей юзера
 MAX_USER_EMAIL_LEN = 254
@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Subscription
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+
+def change_counters(queryset, **deltas):
+    # Атомарное изменение счётчиков в базе, без чтения значений в Python.
+    queryset.update(**{
+        field: Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items()
+    })
+
+
+def change_recipe_counters(recipe_ids, **deltas):
+    change_counters(Recipe.objects.filter(pk__in=recipe_ids), **deltas)
+
+
+def change_user_counters(user_ids, **deltas):
+    change_counters(User.objects.filter(pk__in=user_ids), **deltas)
+
+
+def lock_user(user_id):
+    # Изменения избранного и корзины одного пользователя идут по очереди.
+    # Иначе два параллельных добавления одного рецепта оба не видят его
+    # среди добавленных и оба меняют счётчики, хотя строка вставится одна.
+    list(User.objects.select_for_update().filter(
+        pk=user_id).values_list('pk', flat=True))
+
+
+def forget_user(user):
+    # Вызывается перед удалением пользователя: его избранное, корзина и
+    # подписки удалятся каскадом, минуя счётчики.
+    change_counters(
+        Recipe.objects.filter(favorited_by__user=user), favorites_count=-1)
+    change_counters(
+        Recipe.objects.filter(in_shopping_cart__user=user),
+        shopping_cart_count=-1)
+    change_counters(
+        User.objects.filter(subscribers__user=user), subscribers_count=-1)
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(count=Count('*')).values('count')
+    ), Value(0))
+
+
+RECIPE_COUNTERS = {
+    'favorites_count': (Favorite, 'recipe'),
+    'shopping_cart_count': (ShoppingCart, 'recipe'),
+}
+USER_COUNTERS = {
+    'recipes_count': (Recipe, 'author'),
+    'subscribers_count': (Subscription, 'author'),
+}
+
+
+def recount(queryset, counters):
+    return queryset.update(**{
+        name: count_subquery(model, field)
+        for name, (model, field) in counters.items()
+    })
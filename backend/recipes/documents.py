@@ -0,0 +1,158 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from core.streaming import batched
+from .cache_versions import recipe_version_keys, set_versions
+from .models import Recipe, RecipeIngredient
+
+User = get_user_model()
+
+BATCH_SIZE = 500
+AUTHOR_FIELDS = (
+    'username', 'email', 'first_name', 'last_name', 'avatar',
+    'avatar_variants',
+)
+
+# Снимок рецепта — то же, что отдаёт RecipeReadSerializer, без флагов
+# текущего пользователя и с относительными ссылками на картинки. Чтение
+# списка и рецепта подставляет в снимок флаги и хост вместо сериализации
+# рецепта, автора и ингредиентов через поля DRF.
+
+
+def build_documents(recipe_ids):
+    # Три запроса на пакет: рецепты, авторы, ингредиенты.
+    recipes = list(Recipe.objects.filter(pk__in=recipe_ids).values(
+        'id', 'author_id', 'name', 'image', 'image_variants', 'text',
+        'cooking_time'))
+    authors = {
+        author['id']: author for author in User.objects.filter(
+            pk__in={recipe['author_id'] for recipe in recipes}
+        ).values('id', *AUTHOR_FIELDS)
+    }
+    ingredients = {}
+    for recipe_id, pk, name, unit, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).order_by('pk').values_list(
+            'recipe_id', 'ingredient_id', 'ingredient__name',
+            'ingredient__measurement_unit', 'amount'):
+        ingredients.setdefault(recipe_id, []).append({
+            'id': pk, 'name': name, 'measurement_unit': unit,
+            'amount': amount,
+        })
+    recipe_storage = Recipe._meta.get_field('image').storage
+    avatar_storage = User._meta.get_field('avatar').storage
+    documents = {}
+    for recipe in recipes:
+        author = authors[recipe['author_id']]
+        documents[recipe['id']] = {
+            'id': recipe['id'],
+            'author': {
+                'id': author['id'],
+                'username': author['username'],
+                'email': author['email'],
+                'first_name': author['first_name'],
+                'last_name': author['last_name'],
+                'avatar': file_url(avatar_storage, author['avatar']),
+                'avatar_variants': variant_urls(
+                    avatar_storage, author['avatar_variants']),
+            },
+            'name': recipe['name'],
+            'image': file_url(recipe_storage, recipe['image']),
+            'image_variants': variant_urls(
+                recipe_storage, recipe['image_variants']),
+            'text': recipe['text'],
+            'cooking_time': recipe['cooking_time'],
+            'ingredients': ingredients.get(recipe['id'], []),
+        }
+    return documents
+
+
+def file_url(storage, name):
+    return storage.url(name) if name else None
+
+
+def variant_urls(storage, variants):
+    return {
+        variant: {key: storage.url(name) for key, name in files.items()}
+        for variant, files in variants.items() if variant != 'source'
+    }
+
+
+def refresh_documents(recipe_ids):
+    refreshed = {}
+    for batch in batched(recipe_ids, BATCH_SIZE):
+        documents = build_documents(batch)
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, document=document)
+             for pk, document in documents.items()],
+            ['document'])
+        refreshed.update(documents)
+    return refreshed
+
+
+def schedule_document_refresh(recipe_ids):
+    # Снимок строится после коммита, когда ингредиенты рецепта уже
+    # записаны. Версии меняются только после записи снимка: иначе
+    # запрос между ними закэширует старый снимок под новой версией.
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: refresh_and_bump(recipe_ids))
+
+
+def refresh_and_bump(recipe_ids):
+    refresh_documents(recipe_ids)
+    set_versions(recipe_version_keys(recipe_ids))
+
+
+def fill_missing_documents(recipes):
+    # Рецепты без снимка (например, вставленные в обход сигналов)
+    # получают его при первом чтении.
+    missing = {recipe.pk: recipe for recipe in recipes if not recipe.document}
+    if missing:
+        for pk, document in refresh_documents(list(missing)).items():
+            missing[pk].document = document
+
+
+def render_document(document, request=None, thumbnails=False,
+                    is_favorited=False, is_in_shopping_cart=False,
+                    is_subscribed=False):
+    absolute = url_builder(request)
+    image_variants = {
+        variant: {key: absolute(url) for key, url in files.items()}
+        for variant, files in document['image_variants'].items()
+    }
+    author = dict(document['author'])
+    avatar_variants = {
+        variant: {key: absolute(url) for key, url in files.items()}
+        for variant, files in author['avatar_variants'].items()
+    }
+    avatar = author['avatar'] and (
+        thumbnails and avatar_variants.get('small', {}).get('url')
+        or absolute(author['avatar']))
+    author.update(avatar=avatar, avatar_variants=avatar_variants,
+                  is_subscribed=is_subscribed)
+    image = document['image'] and (
+        thumbnails and image_variants.get('medium', {}).get('url')
+        or absolute(document['image']))
+    return {
+        'id': document['id'],
+        'author': author,
+        'name': document['name'],
+        'image': image,
+        'image_variants': image_variants,
+        'text': document['text'],
+        'cooking_time': document['cooking_time'],
+        'ingredients': document['ingredients'],
+        'is_favorited': is_favorited,
+        'is_in_shopping_cart': is_in_shopping_cart,
+    }
+
+
+def url_builder(request):
+    # build_absolute_uri на каждую ссылку заметно дороже, чем склеить
+    # адрес хоста, вычисленный один раз на запрос.
+    if request is None:
+        return lambda url: url
+    host = request.build_absolute_uri('/')[:-1]
+    return lambda url: (
+        host + url if url.startswith('/') and not url.startswith('//')
+        else request.build_absolute_uri(url))
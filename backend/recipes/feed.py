@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.db.models import Q
+
+from core.background import run_in_background
+from core.streaming import batched
+from users.models import Subscription
+from .constants import FEED_BACKFILL_RECIPES, FEED_FAN_OUT_MAX_SUBSCRIBERS
+from .models import FeedEntry, Recipe
+
+BATCH_SIZE = 1000
+
+# Ленты подписок строятся при записи: новый рецепт раскладывается по
+# лентам подписчиков автора, новая подписка получает последние рецепты
+# автора. У авторов с FEED_FAN_OUT_MAX_SUBSCRIBERS подписчиков и больше
+# раскладка слишком дорога, их рецепты подмешиваются при чтении. Порог
+# подмешивания вдвое ниже, чтобы рецепты, опубликованные без раскладки,
+# не пропадали из лент, когда число подписчиков колеблется у порога.
+FAN_IN_MIN_SUBSCRIBERS = FEED_FAN_OUT_MAX_SUBSCRIBERS // 2
+
+
+def fan_out(recipe_ids):
+    by_author = {}
+    for recipe_id, author_id, created_at in Recipe.objects.filter(
+            pk__in=recipe_ids,
+            author__subscribers_count__lt=FEED_FAN_OUT_MAX_SUBSCRIBERS,
+    ).values_list('id', 'author_id', 'created_at'):
+        by_author.setdefault(author_id, []).append((recipe_id, created_at))
+    for author_id, recipes in by_author.items():
+        subscribers = Subscription.objects.filter(
+            author_id=author_id).order_by('user_id').values_list(
+            'user_id', flat=True).iterator(chunk_size=BATCH_SIZE)
+        for batch in batched(subscribers, BATCH_SIZE):
+            with transaction.atomic():
+                FeedEntry.objects.bulk_create(
+                    (FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                               author_id=author_id, created_at=created_at)
+                     for user_id in batch
+                     for recipe_id, created_at in recipes),
+                    batch_size=BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+
+
+def backfill(pairs):
+    # pairs — (user_id, author_id) новых подписок.
+    entries = []
+    for user_id, author_id in pairs:
+        recipes = Recipe.objects.filter(
+            author_id=author_id,
+            author__subscribers_count__lt=FEED_FAN_OUT_MAX_SUBSCRIBERS,
+        ).order_by('-created_at', '-id').values_list(
+            'id', 'created_at')[:FEED_BACKFILL_RECIPES]
+        entries.extend(
+            FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id, created_at=created_at)
+            for recipe_id, created_at in recipes)
+    FeedEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def schedule_fan_out(recipe_ids):
+    # Раскладка по тысячам подписчиков идёт в фоне, как обработка
+    # картинок, а не в запросе, создавшем рецепт.
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: run_in_background(fan_out, recipe_ids))
+
+
+def schedule_backfill(user_id, author_id):
+    transaction.on_commit(lambda: backfill([(user_id, author_id)]))
+
+
+def forget_subscription(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def get_feed(user_id, position=None, limit=10):
+    # Страница ленты: (created_at, recipe_id) по убыванию после position.
+    # Разложенные записи читаются одним проходом по индексу, рецепты
+    # популярных авторов — по индексу (author, -created_at, -id).
+    entries = FeedEntry.objects.filter(user_id=user_id)
+    if position is not None:
+        created_at, recipe_id = position
+        entries = entries.filter(
+            Q(created_at__lt=created_at)
+            | Q(created_at=created_at, recipe_id__lt=recipe_id))
+    page = set(entries.order_by('-created_at', '-recipe_id').values_list(
+        'created_at', 'recipe_id')[:limit])
+    celebrities = list(Subscription.objects.filter(
+        user_id=user_id,
+        author__subscribers_count__gte=FAN_IN_MIN_SUBSCRIBERS,
+    ).values_list('author_id', flat=True))
+    if celebrities:
+        recipes = Recipe.objects.filter(author_id__in=celebrities)
+        if position is not None:
+            recipes = recipes.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, id__lt=recipe_id))
+        page.update(recipes.order_by('-created_at', '-id').values_list(
+            'created_at', 'id')[:limit])
+    return sorted(page, reverse=True)[:limit]
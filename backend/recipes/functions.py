@@ -1,7 +1,92 @@
 import string
-import random
 
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 
-def generate_short_code(length=4):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+from core.cache import MISSING, LRUCache
+from .constants import MAX_SHORT_CODE_LEN, MIN_SHORT_CODE_LEN
+from .models import ShortLink
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+# Множитель взаимно прост с 62, поэтому n -> (n * M + C) mod 62**length
+# переставляет все коды заданной длины: разные id дают разные коды, а
+# соседние id не дают соседних кодов.
+SHORT_CODE_MULTIPLIER = 1580030173
+SHORT_CODE_INCREMENT = 7919
+
+SHORT_LINK_CACHE_TTL = 24 * 60 * 60
+SHORT_LINK_LOCAL_CACHE_TTL = 5 * 60
+SHORT_LINK_NEGATIVE_CACHE_TTL = 30
+
+short_link_cache = LRUCache(maxsize=10000, ttl=SHORT_LINK_LOCAL_CACHE_TTL)
+
+
+def short_code_length(number):
+    length = MIN_SHORT_CODE_LEN
+    while number >= len(BASE62_ALPHABET) ** length:
+        length += 1
+    return length
+
+
+def encode_short_code(number, length=None):
+    length = length or short_code_length(number)
+    if length > MAX_SHORT_CODE_LEN:
+        raise ValueError(
+            f'Короткий код длиннее {MAX_SHORT_CODE_LEN} символов.')
+    base = len(BASE62_ALPHABET)
+    value = (
+        number * SHORT_CODE_MULTIPLIER + SHORT_CODE_INCREMENT
+    ) % base ** length
+    code = []
+    for _ in range(length):
+        value, digit = divmod(value, base)
+        code.append(BASE62_ALPHABET[digit])
+    return ''.join(reversed(code))
+
+
+def get_or_create_short_link(recipe):
+    # Код вычисляется из id рецепта, поэтому проверять занятость заранее
+    # не нужно. Конфликт возможен только со старыми случайными кодами,
+    # тогда берётся код на символ длиннее.
+    length = short_code_length(recipe.id)
+    while True:
+        try:
+            with transaction.atomic():
+                short_link, _ = ShortLink.objects.get_or_create(
+                    recipe=recipe,
+                    defaults={
+                        'short_code': encode_short_code(recipe.id, length)
+                    },
+                )
+            return short_link
+        except IntegrityError:
+            length += 1
+
+
+def short_link_cache_key(short_code):
+    return f'recipes:short_link:{short_code}'
+
+
+def resolve_short_code(short_code):
+    # id рецепта по короткому коду: сначала LRU процесса, затем общий кэш,
+    # и только потом база. Неизвестные коды тоже кэшируются, на меньший срок.
+    recipe_id = short_link_cache.get(short_code)
+    if recipe_id is not MISSING:
+        return recipe_id
+    key = short_link_cache_key(short_code)
+    recipe_id = cache.get(key)
+    if recipe_id is None:
+        recipe_id = ShortLink.objects.filter(
+            short_code=short_code
+        ).values_list('recipe_id', flat=True).first()
+        cache.set(key, recipe_id or 0, SHORT_LINK_CACHE_TTL if recipe_id
+                  else SHORT_LINK_NEGATIVE_CACHE_TTL)
+    recipe_id = recipe_id or None
+    short_link_cache.set(short_code, recipe_id, None if recipe_id
+                         else SHORT_LINK_NEGATIVE_CACHE_TTL)
+    return recipe_id
+
+
+def invalidate_short_code(short_code):
+    short_link_cache.delete(short_code)
+    cache.delete(short_link_cache_key(short_code))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.benchmark import format_result, measure
+from recipes.autocomplete import ingredient_index
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает подсказки ингредиентов из индекса и через ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument(
+            '--prefixes', nargs='+', default=['а', 'мол', 'Сах', 'x'])
+
+    def handle(self, *args, **options):
+        repeat, limit = options['repeat'], options['limit']
+        ingredient_index.invalidate()
+        for prefix in options['prefixes']:
+            def orm():
+                queryset = Ingredient.objects.filter(
+                    name__istartswith=prefix).values(
+                    'id', 'name', 'measurement_unit')
+                return list(queryset[:limit] if limit else queryset)
+
+            def index():
+                return ingredient_index.search(prefix, limit=limit)
+
+            self.stdout.write(
+                f'Префикс "{prefix}": найдено {len(index())} в индексе, '
+                f'{len(orm())} через ORM')
+            self.stdout.write(
+                '  ' + format_result('ORM', measure(orm, repeat)))
+            self.stdout.write(
+                '  ' + format_result('Индекс', measure(index, repeat)))
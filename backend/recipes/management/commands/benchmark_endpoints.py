@@ -0,0 +1,150 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from rest_framework.test import APIClient
+
+from core.benchmark import format_result, measure
+from recipes.functions import get_or_create_short_link
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingListItem
+from users.models import Subscription
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет основные эндпоинты API на текущей базе и сохраняет '
+            'p50/p95/p99 и число SQL-запросов в JSON для сравнения '
+            'между коммитами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--output', help='Куда сохранить результаты')
+        parser.add_argument(
+            '--compare', help='Результаты предыдущего прогона для сравнения')
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Допустимый рост медианы в процентах')
+        parser.add_argument('--ingredient-prefix', default='са')
+
+    def handle(self, *args, **options):
+        cases = self.get_cases(options['ingredient_prefix'])
+        results = {}
+        for name, (client, path) in cases.items():
+            results[name] = measure(
+                lambda: self.request(client, path), options['repeat'])
+            self.stdout.write(format_result(name, results[name]))
+        report = {
+            'commit': get_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'rows': {
+                model._meta.label: model.objects.count()
+                for model in (User, Recipe, Ingredient, Favorite,
+                              Subscription, ShoppingListItem)
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    def get_cases(self, prefix):
+        recipe = Recipe.objects.order_by('-favorites_count', '-id').first()
+        if recipe is None:
+            raise CommandError(
+                'Нет рецептов: сначала заполните базу seed_benchmark_data')
+        subscriber = most_active(Subscription)
+        buyer = most_active(ShoppingListItem)
+        code = get_or_create_short_link(recipe).short_code
+        pantry = ','.join(map(str, Ingredient.objects.annotate(
+            recipes_count=Count('recipes')).order_by(
+            '-recipes_count').values_list('id', flat=True)[:3]))
+        anonymous = self.client()
+        reader = self.client(subscriber or recipe.author)
+        cases = {
+            'recipes:list:anonymous': (anonymous, '/api/recipes/'),
+            'recipes:list': (reader, '/api/recipes/'),
+            'recipes:list:trending': (
+                anonymous, '/api/recipes/?ordering=trending'),
+            'recipes:detail': (reader, f'/api/recipes/{recipe.id}/'),
+            'ingredients:search': (
+                anonymous, f'/api/ingredients/?name={prefix}'),
+            'users:subscriptions': (reader, '/api/users/subscriptions/'),
+            'recipes:feed': (reader, '/api/recipes/feed/'),
+            'recipes:pantry': (
+                anonymous,
+                f'/api/recipes/pantry/?ingredients={pantry}&min_match=2'),
+            'short_link:redirect': (anonymous, f'/s/{code}/'),
+        }
+        if buyer is not None:
+            cases['recipes:download_shopping_cart'] = (
+                self.client(buyer), '/api/recipes/download_shopping_cart/')
+        return cases
+
+    def client(self, user=None):
+        # Запросы проходят весь стек middleware, поэтому нужен
+        # разрешённый Host.
+        host = next(
+            (host.lstrip('.') for host in settings.ALLOWED_HOSTS
+             if host != '*'), 'localhost')
+        client = APIClient(SERVER_NAME=host)
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.status_code >= 400:
+            raise CommandError(f'{path}: ответ {response.status_code}')
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def compare(self, path, results, threshold):
+        with open(path) as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            # Хвосты распределения шумят от прогона к прогону, поэтому
+            # регрессия определяется по медиане.
+            before = baseline[name]
+            change = (result['p50_us'] / before['p50_us'] - 1) * 100
+            line = (f'{name}: p50 {before["p50_us"]} -> {result["p50_us"]} '
+                    f'мкс ({change:+.0f}%), p95 {before["p95_us"]} -> '
+                    f'{result["p95_us"]} мкс, запросов {before["queries"]} '
+                    f'-> {result["queries"]}')
+            if change > threshold or result['queries'] > before['queries']:
+                regressions.append(name)
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Регрессия: {", ".join(regressions)}')
+
+
+def most_active(model):
+    # Пользователь с наибольшим числом строк в model, чтобы замерять
+    # самый тяжёлый случай.
+    row = model.objects.values('user').annotate(
+        rows=Count('*')).order_by('-rows').first()
+    return row and User.objects.get(pk=row['user'])
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
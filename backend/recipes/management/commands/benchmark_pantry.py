@@ -0,0 +1,71 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+
+from core.benchmark import format_result, measure
+from recipes.models import Ingredient, Recipe
+from recipes.pantry import pantry_index
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск рецептов по имеющимся ингредиентам через '
+            'индекс в памяти и через GROUP BY в базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        popular = list(Ingredient.objects.annotate(
+            recipes_count=Count('recipes')).filter(
+            recipes_count__gt=0).order_by('-recipes_count').values_list(
+            'id', flat=True))
+        if len(popular) < 10:
+            raise CommandError(
+                'Мало ингредиентов в рецептах: сначала заполните базу '
+                'seed_benchmark_data')
+        generator = random.Random(options['seed'])
+        middle = popular[len(popular) // 10:len(popular) // 2]
+        cases = {
+            'частые, все': (popular[:3], None),
+            'частые, от 2': (popular[:3], 2),
+            'обычные, все': (generator.sample(middle, 2), None),
+            'обычные, от 1': (generator.sample(middle, 3), 1),
+            'кладовая из 10, от 3': (
+                popular[:3] + generator.sample(middle, 7), 3),
+        }
+        repeat, limit = options['repeat'], options['limit']
+        pantry_index.invalidate()
+        for name, (ingredient_ids, min_match) in cases.items():
+            min_match = min_match or len(ingredient_ids)
+
+            def sql():
+                # То же, что отдаёт эндпоинт: число найденных и первая
+                # страница по убыванию доли покрытых ингредиентов.
+                queryset = Recipe.objects.annotate(
+                    matched=Count('recipeingredient', filter=Q(
+                        recipeingredient__ingredient_id__in=ingredient_ids)),
+                    total=Count('recipeingredient'),
+                ).filter(matched__gte=min_match).annotate(
+                    coverage=Cast('matched', FloatField()) / F('total'))
+                return queryset.count(), list(queryset.order_by(
+                    '-coverage', '-matched', '-id').values_list(
+                    'id', 'matched')[:limit])
+
+            def index():
+                matches = pantry_index.search(ingredient_ids, min_match)
+                return len(matches), [
+                    (pk, matched) for pk, matched, _ in matches[:limit]]
+
+            found, page = index()
+            if sql() != (found, page):
+                raise CommandError(f'{name}: результаты индекса и SQL '
+                                   'расходятся')
+            self.stdout.write(f'{name}: найдено {found}')
+            self.stdout.write('  ' + format_result('SQL', measure(
+                sql, repeat)))
+            self.stdout.write('  ' + format_result('Индекс', measure(
+                index, repeat)))
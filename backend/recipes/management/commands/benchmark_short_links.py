@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.http import Http404
+from django.test import RequestFactory
+
+from api.views import redirect_short_link
+from core.benchmark import format_result, measure
+from recipes.functions import invalidate_short_code, short_link_cache
+from recipes.models import ShortLink
+
+UNKNOWN_CODE = 'zzzzzz'
+
+
+class Command(BaseCommand):
+    help = 'Замеряет редирект по короткой ссылке с холодным и тёплым кэшем'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=500)
+
+    def handle(self, *args, **options):
+        short_link = ShortLink.objects.first()
+        if short_link is None:
+            raise CommandError(
+                'Нет коротких ссылок: сначала вызовите get_link для рецепта.')
+        code = short_link.short_code
+        requests = {
+            short_code: RequestFactory().get(f'/s/{short_code}/')
+            for short_code in (code, UNKNOWN_CODE)
+        }
+
+        def redirect(short_code):
+            try:
+                return redirect_short_link(requests[short_code], short_code)
+            except Http404:
+                return None
+
+        def cold():
+            invalidate_short_code(code)
+            return redirect(code)
+
+        def shared():
+            short_link_cache.delete(code)
+            return redirect(code)
+
+        cases = (
+            ('Холодный кэш', cold),
+            ('Общий кэш Django', shared),
+            ('LRU процесса', lambda: redirect(code)),
+            ('Неизвестный код', lambda: redirect(UNKNOWN_CODE)),
+        )
+        for name, func in cases:
+            self.stdout.write(
+                format_result(name, measure(func, options['repeat'])))
+        invalidate_short_code(UNKNOWN_CODE)
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import (
+    CachedTokenAuthentication,
+    token_cache,
+    token_cache_key,
+)
+from core.benchmark import format_result, measure
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет аутентификацию по токену: запрос в базу, общий кэш '
+            'Django и LRU процесса')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user, created = User.objects.get_or_create(
+            email='benchmark-auth@example.com',
+            defaults={'username': 'benchmark-auth', 'first_name': 'Bench',
+                      'last_name': 'Mark'})
+        token, _ = Token.objects.get_or_create(user=user)
+        request = Request(APIRequestFactory().get(
+            '/api/recipes/', HTTP_AUTHORIZATION=f'Token {token.key}'))
+        cache_key = token_cache_key(token.key)
+        cached = CachedTokenAuthentication()
+
+        def shared():
+            token_cache.delete(cache_key)
+            return cached.authenticate(request)
+
+        cases = (
+            ('TokenAuthentication', lambda: TokenAuthentication().authenticate(
+                request)),
+            ('Общий кэш Django', shared),
+            ('LRU процесса', lambda: cached.authenticate(request)),
+        )
+        try:
+            for name, func in cases:
+                self.stdout.write(
+                    format_result(name, measure(func, options['repeat'])))
+        finally:
+            token_cache.delete(cache_key)
+            cache.delete(cache_key)
+            if created:
+                user.delete()
@@ -0,0 +1,38 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.benchmark import format_throughput
+from recipes.constants import SIMILAR_RECIPES_COUNT
+from recipes.similarity import iter_blocks, load_matrix, save_block
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты по составу ингредиентов '
+            'блоками в нескольких процессах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--block-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        matrix = load_matrix()
+        self.stdout.write(
+            f'Матрица {len(matrix)} рецептов загружена за '
+            f'{time.monotonic() - started:.1f} с')
+        started = time.monotonic()
+        done = pairs = 0
+        for block in iter_blocks(matrix, options['block_size'],
+                                 options['workers']):
+            save_block(block)
+            done += len(block)
+            pairs += sum(len(neighbours) for _, neighbours in block)
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'{done} из {len(matrix)}: '
+                    f'{format_throughput(done, started)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов: {done}, пар до {SIMILAR_RECIPES_COUNT} на рецепт: '
+            f'{pairs}, {format_throughput(done, started)}'))
@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.cart import get_expected_shopping_lists
+from recipes.models import ShoppingListItem
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Сверяет списки покупок с корзинами пользователей '
+            'и при --fix пересобирает расхождения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = User.objects.order_by('id').values_list('id', flat=True)
+        mismatched = 0
+        last_id = 0
+        while True:
+            user_ids = list(users.filter(id__gt=last_id)[:batch_size])
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            with transaction.atomic():
+                mismatched += self.check_batch(user_ids, options['fix'])
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено расхождений: {mismatched}'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {mismatched}'))
+
+    def check_batch(self, user_ids, fix):
+        expected = get_expected_shopping_lists(user_ids)
+        items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+        if fix:
+            items = items.select_for_update()
+        actual = {
+            (item.user_id, item.ingredient_id): item for item in items
+        }
+        stale, changed, missing = [], [], []
+        for key, item in actual.items():
+            if key not in expected:
+                stale.append(item.id)
+                self.report(key, 'лишняя позиция')
+        for key, total in expected.items():
+            item = actual.get(key)
+            if item is None:
+                missing.append(ShoppingListItem(
+                    user_id=key[0], ingredient_id=key[1], total_amount=total))
+            elif item.total_amount != total:
+                item.total_amount = total
+                changed.append(item)
+            else:
+                continue
+            self.report(key, f'ожидается {total}')
+        if fix:
+            ShoppingListItem.objects.filter(id__in=stale).delete()
+            ShoppingListItem.objects.bulk_create(missing)
+            ShoppingListItem.objects.bulk_update(changed, ['total_amount'])
+        return len(stale) + len(changed) + len(missing)
+
+    def report(self, key, message):
+        user_id, ingredient_id = key
+        self.stdout.write(
+            f'Пользователь {user_id}, ингредиент {ingredient_id}: {message}')
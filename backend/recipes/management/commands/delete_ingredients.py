@@ -1,17 +1,58 @@
 from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from recipes.documents import schedule_document_refresh
+from recipes.models import Ingredient, RecipeIngredient, ShoppingListItem
+from recipes.pantry import schedule_pantry_update
+from recipes.search import index_recipes
+from recipes.signals import remove_recipe_ingredient
 
 
 class Command(BaseCommand):
-    help = 'Удаляет все ингредиенты из базы данных'
+    help = 'Удаляет все ингредиенты из базы данных пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
 
-    def handle(self, *args, **kwargs):
-        count = Ingredient.objects.count()
+    def handle(self, *args, **options):
+        ids = Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        count = 0
+        # Обработчик удаления состава отключается на время команды: без
+        # получателей сигнала Django удаляет строки одним DELETE, не
+        # загружая их, а списки покупок и рецепты обновляются пакетом.
+        post_delete.disconnect(
+            remove_recipe_ingredient, sender=RecipeIngredient)
+        try:
+            while True:
+                batch = list(ids[:options['batch_size']])
+                if not batch:
+                    break
+                with transaction.atomic():
+                    count += self.delete_batch(batch)
+        finally:
+            post_delete.connect(
+                remove_recipe_ingredient, sender=RecipeIngredient)
         if count == 0:
             self.stdout.write(self.style.WARNING(
                 'База данных уже пуста: ингредиенты отсутствуют'))
             return
-
-        Ingredient.objects.all().delete()
         self.stdout.write(
             self.style.SUCCESS(f'Успешно удалено {count} ингредиентов'))
+
+    def delete_batch(self, ingredient_ids):
+        # Связанные строки удаляются отдельными DELETE заранее, чтобы
+        # сборщик каскадов не загружал их в память. Списки покупок по этим
+        # ингредиентам удаляются целиком, а рецепты обновляются ниже.
+        recipe_items = RecipeIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids)
+        recipe_ids = list(
+            recipe_items.values_list('recipe_id', flat=True).distinct())
+        recipe_items.delete()
+        ShoppingListItem.objects.filter(
+            ingredient_id__in=ingredient_ids).delete()
+        deleted, _ = Ingredient.objects.filter(pk__in=ingredient_ids).delete()
+        index_recipes(recipe_ids)
+        schedule_document_refresh(recipe_ids)
+        schedule_pantry_update(recipe_ids)
+        return deleted
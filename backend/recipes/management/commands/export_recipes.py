@@ -0,0 +1,71 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, OutputWrapper
+
+from core.benchmark import format_throughput
+from core.streaming import batched
+from recipes.models import Recipe, RecipeIngredient
+
+
+class Command(BaseCommand):
+    help = ('Выгружает рецепты с авторами, ингредиентами и ссылками '
+            'на картинки в JSON Lines')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file = (self.stdout if output == '-'
+                else OutputWrapper(open(output, 'w', encoding='utf-8')))
+        # Итог пишется в stderr, если сами рецепты идут в stdout.
+        report = self.stderr if output == '-' else self.stdout
+        started = time.monotonic()
+        recipes = rows = 0
+        try:
+            for batch in batched(self.get_recipes(options['batch_size']),
+                                 options['batch_size']):
+                ingredients = {}
+                for recipe_id, name, unit, amount in (
+                        RecipeIngredient.objects.filter(
+                            recipe_id__in=[recipe['id'] for recipe in batch]
+                        ).order_by('pk').values_list(
+                            'recipe_id', 'ingredient__name',
+                            'ingredient__measurement_unit', 'amount')):
+                    ingredients.setdefault(recipe_id, []).append({
+                        'name': name, 'measurement_unit': unit,
+                        'amount': amount,
+                    })
+                for recipe in batch:
+                    recipe['ingredients'] = ingredients.get(recipe['id'], [])
+                    rows += len(recipe['ingredients'])
+                    file.write(json.dumps(recipe, ensure_ascii=False))
+                recipes += len(batch)
+        finally:
+            if file is not self.stdout:
+                file.close()
+        report.write(
+            f'Выгружено рецептов: {recipes}, ингредиентов в рецептах: {rows}, '
+            f'{format_throughput(recipes + rows, started)}')
+
+    def get_recipes(self, chunk_size):
+        # iterator() читает рецепты через курсор на стороне сервера
+        # (в PostgreSQL), не загружая выборку целиком.
+        for recipe in Recipe.objects.order_by('pk').values(
+                'id', 'name', 'text', 'cooking_time', 'image', 'created_at',
+                'author__email', 'author__username', 'author__first_name',
+                'author__last_name').iterator(chunk_size=chunk_size):
+            yield {
+                'id': recipe['id'],
+                'author': {
+                    field: recipe[f'author__{field}'] for field in (
+                        'email', 'username', 'first_name', 'last_name')
+                },
+                'name': recipe['name'],
+                'text': recipe['text'],
+                'cooking_time': recipe['cooking_time'],
+                'image': recipe['image'],
+                'created_at': recipe['created_at'].isoformat(),
+            }
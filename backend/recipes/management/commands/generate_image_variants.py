@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.images import generate_variants
+from recipes.cache_versions import bump_recipe_versions
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Создаёт уменьшенные копии картинок рецептов и аватаров, '
+            'которых ещё нет (с --force — все заново)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true')
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        for model, field_name in ((Recipe, 'image'), (User, 'avatar')):
+            ids = model.objects.exclude(
+                **{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True}).values_list(
+                'pk', flat=True)
+            if not options['force']:
+                ids = ids.filter(**{f'{field_name}_variants': {}})
+            jobs = [(model, pk, field_name, options['force']) for pk in ids]
+            if options['workers'] > 1:
+                with ThreadPoolExecutor(options['workers']) as executor:
+                    done = sum(executor.map(self.generate_in_thread, jobs))
+            else:
+                done = sum(map(self.generate, jobs))
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: обработано {done} '
+                f'из {len(jobs)}'))
+        bump_recipe_versions()
+
+    def generate(self, job):
+        try:
+            return generate_variants(*job)
+        except Exception as error:
+            self.stderr.write(f'{job[0].__name__} {job[1]}: {error}')
+            return False
+
+    def generate_in_thread(self, job):
+        try:
+            return self.generate(job)
+        finally:
+            connections.close_all()
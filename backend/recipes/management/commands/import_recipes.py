@@ -0,0 +1,235 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from core.benchmark import format_throughput
+from core.streaming import batched, iter_json
+from recipes.cache_versions import bump_recipe_versions
+from recipes.counters import change_user_counters
+from recipes.documents import refresh_documents
+from recipes.feed import fan_out
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.pantry import schedule_pantry_update
+from recipes.search import index_recipes
+
+User = get_user_model()
+
+UNUSABLE_PASSWORD = make_password(None)
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из JSON Lines, выгруженного export_recipes, '
+            'пакетами с продолжением с контрольной точки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с числом загруженных строк; по умолчанию <path>.done')
+        parser.add_argument(
+            '--new-ids', action='store_true',
+            help='Не сохранять id рецептов, а выдавать новые')
+
+    def handle(self, *args, **options):
+        if (options['new_ids']
+                and not connection.features.can_return_rows_from_bulk_insert):
+            raise CommandError(
+                '--new-ids требует базы, возвращающей id из bulk_create')
+        self.new_ids = options['new_ids']
+        self.verbosity = options['verbosity']
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stderr.write('SQLite не допускает параллельной записи, '
+                              'загрузка пойдёт в один поток')
+            workers = 1
+        checkpoint = options['checkpoint'] or f'{options["path"]}.done'
+        done = read_checkpoint(checkpoint)
+        if done:
+            self.stdout.write(f'Продолжение с {done + 1}-й строки')
+        started = time.monotonic()
+        self.counts = Counter(recipes=0, rows=0, existing=0, skipped=0)
+        try:
+            with open(options['path'], encoding='utf-8') as file:
+                batches = batched(
+                    islice(iter_json(file), done, None), options['batch_size'])
+                if workers > 1:
+                    self.run_parallel(batches, workers, checkpoint, done)
+                else:
+                    for batch in batches:
+                        self.counts.update(self.import_batch(batch))
+                        done += len(batch)
+                        write_checkpoint(checkpoint, done)
+                        self.report_progress(started)
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать файл: {error}')
+        except ValueError as error:
+            raise CommandError(f'Ошибка в файле: {error}')
+        if not self.new_ids:
+            self.reset_sequences()
+        bump_recipe_versions()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {self.counts["recipes"]}, ингредиентов '
+            f'в рецептах: {self.counts["rows"]}, уже были в базе: '
+            f'{self.counts["existing"]}, пропущено рецептов: '
+            f'{self.counts["skipped"]}, ' + format_throughput(
+                self.counts['recipes'] + self.counts['rows'], started)))
+        if self.counts['recipes']:
+            # Поштучный пересчёт на каждый рецепт дольше полного.
+            self.stdout.write(
+                'Похожие рецепты для загруженных не посчитаны, запустите '
+                'build_similar_recipes')
+
+    def run_parallel(self, batches, workers, checkpoint, done):
+        # Пакеты завершаются в любом порядке, поэтому контрольная точка
+        # сдвигается только по непрерывному префиксу готовых пакетов.
+        started = time.monotonic()
+        sizes, finished, pending = [], set(), {}
+        next_batch = 0
+        with ThreadPoolExecutor(workers) as executor:
+            for batch in chain(batches, [None]):
+                if batch is not None:
+                    pending[executor.submit(
+                        self.import_in_thread, batch)] = len(sizes)
+                    sizes.append(len(batch))
+                    if len(pending) < workers * 2:
+                        continue
+                while pending:
+                    completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        self.counts.update(future.result())
+                        finished.add(pending.pop(future))
+                    while next_batch in finished:
+                        done += sizes[next_batch]
+                        next_batch += 1
+                    write_checkpoint(checkpoint, done)
+                    self.report_progress(started)
+                    if batch is not None:
+                        break
+
+    def import_in_thread(self, batch):
+        try:
+            return self.import_batch(batch)
+        finally:
+            connections.close_all()
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        authors = self.resolve_authors(batch)
+        ingredients = self.resolve_ingredients(batch)
+        existing = set() if self.new_ids else set(
+            Recipe.objects.filter(
+                pk__in=[item['id'] for item in batch]
+            ).values_list('pk', flat=True))
+        recipes, sources, counts = [], [], Counter()
+        for item in batch:
+            author = authors.get(item['author']['email'])
+            if item['id'] in existing:
+                counts['existing'] += 1
+                continue
+            if author is None:
+                counts['skipped'] += 1
+                continue
+            recipes.append(Recipe(
+                id=None if self.new_ids else item['id'],
+                author_id=author, name=item['name'], text=item['text'],
+                cooking_time=item['cooking_time'], image=item['image']))
+            sources.append(item)
+        Recipe.objects.bulk_create(recipes)
+        # auto_now_add перезаписывает дату при вставке, поэтому исходная
+        # дата восстанавливается отдельным UPDATE.
+        for recipe, item in zip(recipes, sources):
+            recipe.created_at = parse_datetime(item['created_at'])
+        Recipe.objects.bulk_update(recipes, ['created_at'])
+        rows = RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, amount=row['amount'],
+                ingredient_id=ingredients[row['name']])
+            for recipe, item in zip(recipes, sources)
+            for row in item['ingredients']
+        )
+        authors_by_count = {}
+        for author, count in Counter(
+                recipe.author_id for recipe in recipes).items():
+            authors_by_count.setdefault(count, []).append(author)
+        for count, author_ids in authors_by_count.items():
+            change_user_counters(author_ids, recipes_count=count)
+        index_recipes([recipe.id for recipe in recipes])
+        refresh_documents([recipe.id for recipe in recipes])
+        fan_out([recipe.id for recipe in recipes])
+        schedule_pantry_update([recipe.id for recipe in recipes])
+        counts.update(recipes=len(recipes), rows=len(rows))
+        return counts
+
+    def resolve_authors(self, batch):
+        # Авторы сопоставляются по email, недостающие создаются без пароля.
+        # Если username уже занят другим email, рецепты автора пропускаются.
+        authors = {item['author']['email']: item['author'] for item in batch}
+        known = dict(User.objects.filter(email__in=authors).values_list(
+            'email', 'pk'))
+        missing = [
+            User(email=email, username=author['username'],
+                 first_name=author['first_name'],
+                 last_name=author['last_name'], password=UNUSABLE_PASSWORD)
+            for email, author in authors.items() if email not in known
+        ]
+        if missing:
+            User.objects.bulk_create(missing, ignore_conflicts=True)
+            known = dict(User.objects.filter(email__in=authors).values_list(
+                'email', 'pk'))
+        return known
+
+    def resolve_ingredients(self, batch):
+        units = {
+            row['name']: row['measurement_unit']
+            for item in batch for row in item['ingredients']
+        }
+        known = dict(Ingredient.objects.filter(name__in=units).values_list(
+            'name', 'pk'))
+        missing = [
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in units.items() if name not in known
+        ]
+        if missing:
+            Ingredient.objects.bulk_create(missing, ignore_conflicts=True)
+            known = dict(Ingredient.objects.filter(
+                name__in=units).values_list('name', 'pk'))
+        return known
+
+    def reset_sequences(self):
+        # После вставки с явными id счётчик id в PostgreSQL надо сдвинуть.
+        statements = connection.ops.sequence_reset_sql(no_style(), [Recipe])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    def report_progress(self, started):
+        if self.verbosity > 1:
+            self.stdout.write(format_throughput(
+                self.counts['recipes'] + self.counts['rows'], started))
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, done):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(str(done))
+    os.replace(temporary, path)
@@ -1,20 +1,104 @@
-import json
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.streaming import batched, iter_csv, iter_json
+from recipes.autocomplete import ingredient_index
+from recipes.constants import MAX_INGREDIENT_NAME_LEN, MAX_MEASUREMENT_UNIT_LEN
+from recipes.documents import schedule_document_refresh
+from recipes.models import Ingredient, RecipeIngredient
+
+FORMATS = ('json', 'jsonl', 'csv')
 
 
 class Command(BaseCommand):
-    help = "Загрузка ингридентов для тестов"
-
-    def handle(self, *args, **kwargs):
-        with open('data/ingredients.json', 'r', encoding='utf-8') as f:
-            count = 0
-            data = json.load(f)
-            for item in data:
-                Ingredient.objects.get_or_create(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit']
-                )
-                count += 1
-        self.stdout.write(
-            self.style.SUCCESS(f'Успешно загружено {count} ингредиентов'))
+    help = ('Загружает ингредиенты из JSON, JSON Lines или CSV пакетами: '
+            'новые добавляются, у существующих обновляется единица измерения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='data/ingredients.json')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1][1:]
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Не удалось определить формат файла {path}, '
+                f'укажите --format')
+        counts = Counter(inserted=0, updated=0, skipped=0)
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                for number, batch in enumerate(batched(
+                        self.read(file, file_format),
+                        options['batch_size']), 1):
+                    with transaction.atomic():
+                        counts.update(self.upsert(batch))
+                    if options['verbosity'] > 1:
+                        self.stdout.write(
+                            f'Пакет {number}: добавлено {counts["inserted"]}'
+                            f', обновлено {counts["updated"]}')
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        except ValueError as error:
+            raise CommandError(f'Ошибка в файле {path}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено {counts["inserted"]}, обновлено {counts["updated"]}, '
+            f'пропущено {counts["skipped"]} ингредиентов'))
+
+    def read(self, file, file_format):
+        if file_format == 'csv':
+            rows = iter_csv(file, header=['name', 'measurement_unit'])
+        else:
+            rows = (
+                (item.get('name'), item.get('measurement_unit'))
+                if isinstance(item, dict) else (None, None)
+                for item in iter_json(file)
+            )
+        for row in rows:
+            name, unit = (list(row) + [None, None])[:2]
+            yield str(name or '').strip(), str(unit or '').strip()
+
+    def upsert(self, batch):
+        # Один SELECT по именам и по одному INSERT/UPDATE на пакет.
+        # Пустые и слишком длинные значения пропускаются, из повторов
+        # остаётся последний, как и между пакетами.
+        units = {}
+        skipped = 0
+        for name, unit in batch:
+            if (not name or not unit
+                    or len(name) > MAX_INGREDIENT_NAME_LEN
+                    or len(unit) > MAX_MEASUREMENT_UNIT_LEN):
+                skipped += 1
+                continue
+            if name in units:
+                skipped += 1
+            units[name] = unit
+        changed = []
+        for ingredient in Ingredient.objects.filter(name__in=units):
+            unit = units.pop(ingredient.name)
+            if ingredient.measurement_unit == unit:
+                skipped += 1
+            else:
+                ingredient.measurement_unit = unit
+                changed.append(ingredient)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in units.items()],
+            ignore_conflicts=True,
+        )
+        if changed:
+            Ingredient.objects.bulk_update(changed, ['measurement_unit'])
+            recipe_ids = list(RecipeIngredient.objects.filter(
+                ingredient__in=changed
+            ).values_list('recipe_id', flat=True).distinct())
+            schedule_document_refresh(recipe_ids)
+        if units or changed:
+            transaction.on_commit(ingredient_index.invalidate)
+        return {
+            'inserted': len(units), 'updated': len(changed),
+            'skipped': skipped,
+        }
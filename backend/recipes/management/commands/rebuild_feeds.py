@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import backfill
+from recipes.models import FeedEntry
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = ('Заново заполняет ленты подписок последними рецептами авторов '
+            'пакетами подписок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        FeedEntry.objects.all().delete()
+        subscriptions = Subscription.objects.order_by('pk').values_list(
+            'pk', 'user_id', 'author_id')
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(subscriptions.filter(
+                pk__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                backfill([(user_id, author_id)
+                          for _, user_id, author_id in batch])
+            count += len(batch)
+            last_id = batch[-1][0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Подписок обработано: {count}, записей в лентах: '
+            f'{FeedEntry.objects.count()}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.documents import refresh_documents
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает снимки рецептов для чтения пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(Recipe.objects.filter(id__gt=last_id).order_by(
+                'id').values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                refresh_documents(batch)
+            count += len(batch)
+            last_id = batch[-1]
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересобрано {count} снимков рецептов'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+from recipes.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Заполняет поисковый индекс рецептов пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.setup()
+        batch_size = options['batch_size']
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(Recipe.objects.filter(id__gt=last_id).order_by(
+                'id').values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            # Без транзакции SQLite фиксирует каждую строку индекса
+            # отдельно.
+            with transaction.atomic():
+                backend.index(batch)
+            count += len(batch)
+            last_id = batch[-1]
+        self.stdout.write(
+            self.style.SUCCESS(f'Проиндексировано {count} рецептов'))
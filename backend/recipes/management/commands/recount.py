@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import RECIPE_COUNTERS, USER_COUNTERS, recount
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики рецептов и пользователей пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model, counters in ((Recipe, RECIPE_COUNTERS),
+                                (User, USER_COUNTERS)):
+            count = self.recount_model(
+                model, counters, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: пересчитано {count}'))
+
+    def recount_model(self, model, counters, batch_size):
+        ids = model.objects.order_by('pk').values_list('pk', flat=True)
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                return count
+            with transaction.atomic():
+                count += recount(
+                    model.objects.filter(pk__in=batch), counters)
+            last_id = batch[-1]
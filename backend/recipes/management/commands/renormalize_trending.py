@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from recipes.trending import rebuild_trending, renormalize
+
+
+class Command(BaseCommand):
+    help = ('Переносит точку отсчёта популярности рецептов в текущий момент; '
+            'запускается периодически, например раз в сутки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересчитать оценки заново по избранному и корзинам')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = rebuild_trending()
+            self.stdout.write(self.style.SUCCESS(
+                f'Популярность пересчитана для {count} рецептов'))
+            return
+        count = renormalize()
+        self.stdout.write(self.style.SUCCESS(
+            f'Популярность перенормирована для {count} рецептов'))
@@ -0,0 +1,228 @@
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.benchmark import format_throughput
+from core.streaming import batched
+from recipes.autocomplete import ingredient_index
+from recipes.cache_versions import bump_recipe_versions
+from recipes.cart import get_expected_shopping_lists
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+)
+from recipes.pantry import pantry_index
+from users.models import Subscription
+
+User = get_user_model()
+
+UNUSABLE_PASSWORD = make_password(None)
+ADDED_DAYS = 30
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'избранным, корзинами и подписками для нагрузочных замеров')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Размер каталога; недостающие ингредиенты создаются')
+        parser.add_argument(
+            '--per-recipe', type=int, default=8,
+            help='Среднее число ингредиентов в рецепте')
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--carts', type=int, default=5000)
+        parser.add_argument('--subscriptions', type=int, default=20000)
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель закона Ципфа для авторов, рецептов '
+                 'и ингредиентов')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='bench')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт')
+        self.random = random.Random(options['seed'])
+        self.skew = options['skew']
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        users = self.create_users(options['users'], options['prefix'])
+        ingredients = self.create_ingredients(options['ingredients'])
+        recipes = self.create_recipes(
+            options['recipes'], users, ingredients, options['per_recipe'])
+        self.create_pairs(Favorite, 'recipe', users, recipes,
+                          options['favorites'])
+        carts = self.create_pairs(ShoppingCart, 'recipe', users, recipes,
+                                  options['carts'])
+        self.create_pairs(Subscription, 'author', users, users,
+                          options['subscriptions'])
+        self.fill_shopping_lists(sorted({user for user, _ in carts}))
+        call_command('recount', batch_size=self.batch_size,
+                     verbosity=self.verbosity, stdout=self.stdout)
+        call_command('rebuild_search_index', batch_size=self.batch_size,
+                     verbosity=self.verbosity, stdout=self.stdout)
+        call_command('rebuild_recipe_documents', batch_size=self.batch_size,
+                     verbosity=self.verbosity, stdout=self.stdout)
+        call_command('rebuild_feeds', verbosity=self.verbosity,
+                     stdout=self.stdout)
+        call_command('build_similar_recipes', verbosity=self.verbosity,
+                     stdout=self.stdout)
+        call_command('renormalize_trending', rebuild=True,
+                     stdout=self.stdout)
+        ingredient_index.invalidate()
+        pantry_index.invalidate()
+        bump_recipe_versions()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с'))
+
+    def zipf(self, population):
+        # Номер по популярности не должен совпадать с порядком id,
+        # иначе самые популярные объекты окажутся самыми старыми.
+        population = list(population)
+        self.random.shuffle(population)
+        weights = list(accumulate(
+            1 / rank ** self.skew for rank in range(1, len(population) + 1)))
+        return lambda count: self.random.choices(
+            population, cum_weights=weights, k=count)
+
+    def insert(self, model, objects):
+        started = time.monotonic()
+        count = 0
+        for batch in batched(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            count += len(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f'  {count}')
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: '
+            f'{format_throughput(count, started)}')
+
+    def insert_rows(self, model, fields, rows):
+        # Для узких таблиц связей кортежи вставляются многострочным
+        # INSERT напрямую: сборка SQL в bulk_create занимает большую
+        # часть времени на каждую строку.
+        started = time.monotonic()
+        columns = [model._meta.get_field(name) for name in fields]
+        quote = connection.ops.quote_name
+        prefix = 'INSERT INTO {} ({}) VALUES '.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(column.column) for column in columns))
+        placeholder = '({})'.format(', '.join(['%s'] * len(columns)))
+        count = 0
+        for batch in batched(rows, self.batch_size):
+            size = connection.ops.bulk_batch_size(columns, batch)
+            with transaction.atomic(), connection.cursor() as cursor:
+                for chunk in batched(batch, size):
+                    cursor.execute(
+                        prefix + ', '.join([placeholder] * len(chunk)),
+                        [value for row in chunk for value in row])
+            count += len(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f'  {count}')
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: '
+            f'{format_throughput(count, started)}')
+
+    def create_users(self, count, prefix):
+        last_id = User.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.insert(User, (
+            User(username=f'{prefix}{number}',
+                 email=f'{prefix}{number}@example.com',
+                 first_name='Пользователь', last_name=str(number),
+                 password=UNUSABLE_PASSWORD)
+            for number in range(last_id + 1, last_id + count + 1)
+        ))
+        return list(User.objects.filter(pk__gt=last_id).values_list(
+            'pk', flat=True))
+
+    def create_ingredients(self, count):
+        missing = count - Ingredient.objects.count()
+        if missing > 0:
+            last_id = Ingredient.objects.aggregate(
+                last=Max('pk'))['last'] or 0
+            self.insert(Ingredient, (
+                Ingredient(name=f'Ингредиент {number}',
+                           measurement_unit='г')
+                for number in range(last_id + 1, last_id + missing + 1)
+            ))
+        return list(Ingredient.objects.values_list('pk', flat=True))
+
+    def create_recipes(self, count, users, ingredients, per_recipe):
+        last_id = Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+        authors = self.zipf(users)
+        self.insert(Recipe, (
+            Recipe(author_id=author, name=f'Рецепт {number}',
+                   text='Синтетический рецепт для замеров',
+                   cooking_time=self.random.randint(5, 180),
+                   image='recipes/images/benchmark.png')
+            for number, author in enumerate(authors(count), last_id + 1)
+        ))
+        recipes = list(Recipe.objects.filter(pk__gt=last_id).values_list(
+            'pk', flat=True))
+        popular = self.zipf(ingredients)
+        rows = (
+            (recipe, ingredient, self.random.randint(1, 500))
+            for recipe in recipes
+            for ingredient in set(popular(self.random.randint(
+                max(1, per_recipe // 2), per_recipe * 3 // 2)))
+        )
+        self.insert_rows(RecipeIngredient,
+                         ('recipe', 'ingredient', 'amount'), rows)
+        return recipes
+
+    def create_pairs(self, model, field, users, targets, count):
+        # Активность пользователей и популярность объектов распределены
+        # по Ципфу; повторы и подписки на себя отбрасываются, поэтому
+        # при малом числе возможных пар их может выйти меньше count.
+        active, popular = self.zipf(users), self.zipf(targets)
+        pairs = set()
+        for _ in range(100):
+            missing = count - len(pairs)
+            if missing <= 0:
+                break
+            pairs.update(
+                pair for pair in zip(active(missing), popular(missing))
+                if pair[0] != pair[1] or model is not Subscription)
+        pairs = sorted(pairs)[:count]
+        fields = ['user', field]
+        rows = pairs
+        if model is not Subscription:
+            # Добавления разбросаны по последним ADDED_DAYS дням, чтобы
+            # популярность сейчас отличалась от популярности вообще.
+            fields.append('added_at')
+            now = timezone.now()
+            rows = (pair + (connection.ops.adapt_datetimefield_value(
+                now - timedelta(seconds=self.random.uniform(
+                    0, ADDED_DAYS * 24 * 60 * 60))),) for pair in pairs)
+        self.insert_rows(model, fields, rows)
+        return pairs
+
+    def fill_shopping_lists(self, user_ids):
+        rows = (
+            (user, ingredient, total)
+            for batch in batched(user_ids, max(1, self.batch_size // 50))
+            for (user, ingredient), total
+            in get_expected_shopping_lists(batch).items()
+        )
+        self.insert_rows(ShoppingListItem,
+                         ('user', 'ingredient', 'total_amount'), rows)
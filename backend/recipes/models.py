@@ -42,6 +42,12 @@ class Recipe(models.Model):
         ),
         verbose_name='Картинка',
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки',
+    )
     text = models.TextField(blank=True, verbose_name='Описание')
     cooking_time = models.PositiveIntegerField(
         verbose_name='Время приготовления (в минутах)')
@@ -53,12 +59,38 @@ class Recipe(models.Model):
         related_name='recipes',
         verbose_name='Ингредиенты'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Добавлений в избранное'
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Добавлений в корзину'
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность сейчас',
+    )
+    document = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Снимок для чтения',
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-created_at']
-        indexes = [models.Index(fields=['name'])]
+        indexes = [
+            models.Index(fields=['name']),
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['author', '-created_at', '-id']),
+            models.Index(fields=['-favorites_count', '-id']),
+            models.Index(fields=['-shopping_cart_count', '-id']),
+            models.Index(fields=['-trending_score', '-id']),
+        ]
 
     def __str__(self):
         return self.name
@@ -163,11 +195,127 @@ class ShoppingCart(models.Model):
         return f'{self.user} добавил {self.recipe} в корзину'
 
 
-class ShortLink(models.Model):
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} ({self.total_amount})'
+
+
+class FeedEntry(models.Model):
+    # Строка ленты подписок: рецепт автора, на которого подписан user.
+    # created_at копируется из рецепта, чтобы лента читалась одним
+    # проходом по индексу (user, -created_at, -recipe).
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    created_at = models.DateTimeField(verbose_name='Дата создания рецепта')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-recipe']),
+            models.Index(fields=['user', 'author']),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
+
+
+class RecipeSimilarity(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
-        related_name='short_links',
+        related_name='similarities',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_recipe_similarity'
+            )
+        ]
+        indexes = [models.Index(fields=['recipe', '-score'])]
+
+    def __str__(self):
+        return f'{self.recipe_id} ~ {self.similar_id} ({self.score:.3f})'
+
+
+class TrendingState(models.Model):
+    # Единственная строка: момент (секунды Unix), к которому приведены
+    # оценки Recipe.trending_score.
+    landmark = models.FloatField(verbose_name='Точка отсчёта')
+
+    class Meta:
+        verbose_name = 'Точка отсчёта популярности'
+        verbose_name_plural = 'Точка отсчёта популярности'
+
+    def __str__(self):
+        return str(self.landmark)
+
+
+class ShortLink(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='short_link',
         verbose_name='Рецепт'
     )
     short_code = models.CharField(
@@ -183,7 +331,6 @@ class ShortLink(models.Model):
     class Meta:
         verbose_name = 'Короткая ссылка'
         verbose_name_plural = 'Короткие ссылки'
-        indexes = [models.Index(fields=['short_code'])]
 
     def __str__(self):
-        return f'{self.short_code} -> Рецепт {self.recipe.id}'
+        return f'{self.short_code} -> Рецепт {self.recipe_id}'
@@ -0,0 +1,213 @@
+import threading
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+from core.streaming import batched
+from .constants import PANTRY_CHANGE_TIMEOUT, PANTRY_MAX_CHANGES
+from .models import RecipeIngredient
+
+GENERATION_KEY = 'recipes:pantry:generation'
+SEQUENCE_KEY = 'recipes:pantry:sequence'
+
+EMPTY = np.empty(0, dtype=np.int32)
+BATCH_SIZE = 1000
+
+
+def change_key(number):
+    return f'recipes:pantry:change:{number}'
+
+
+def contains(postings, values):
+    # Маска values, которые есть в отсортированном массиве postings.
+    positions = np.searchsorted(postings, values)
+    found = np.zeros(len(values), dtype=bool)
+    inside = positions < len(postings)
+    found[inside] = postings[positions[inside]] == values[inside]
+    return found
+
+
+class PantryMatches:
+    # Найденные рецепты по убыванию доли покрытых ингредиентов рецепта.
+    # Срез отдаёт тройки (id рецепта, совпало ингредиентов, доля).
+
+    def __init__(self, ids, matched, coverage):
+        order = np.lexsort((-ids, -matched, -coverage))
+        self.ids = ids[order]
+        self.matched = matched[order]
+        self.coverage = coverage[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        return list(zip(
+            self.ids[key].tolist(), self.matched[key].tolist(),
+            self.coverage[key].tolist()))
+
+
+class PantryIndex:
+    # Инвертированный индекс «ингредиент → отсортированный массив id
+    # рецептов» в памяти процесса. Изменённые рецепты записываются в
+    # журнал в кэше Django под возрастающими номерами; процесс при запросе
+    # догоняет журнал и перестраивает только затронутые списки. Смена
+    # поколения или слишком большое отставание — полная перезагрузка.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._sequence = 0
+        self._recipes = {}
+        # Списки по ингредиентам и число ингредиентов в рецепте по id
+        # рецепта подменяются одной парой, чтобы поиск не видел
+        # полуобновлённый индекс.
+        self._state = ({}, EMPTY)
+
+    def search(self, ingredient_ids, min_match=None):
+        # Рецепты, в которых есть хотя бы min_match ингредиентов из
+        # ingredient_ids (по умолчанию все).
+        self._ensure_fresh()
+        postings, sizes = self._state
+        lists = sorted(
+            (postings.get(pk, EMPTY) for pk in set(ingredient_ids)), key=len)
+        total = len(lists)
+        if min_match is None or min_match > total:
+            min_match = total
+        min_match = max(min_match, 1)
+        if not lists:
+            return PantryMatches(EMPTY, EMPTY, np.empty(0))
+        # Рецепт с min_match совпадениями обязательно есть хотя бы в одном
+        # из total - min_match + 1 самых коротких списков. Остальные списки
+        # только проверяются бинарным поиском, и кандидаты, которым уже
+        # не набрать min_match, отбрасываются по ходу.
+        seeds = total - min_match + 1
+        candidates = np.unique(np.concatenate(lists[:seeds]))
+        matched = np.zeros(len(candidates), dtype=np.int32)
+        for index, postings_list in enumerate(lists):
+            matched += contains(postings_list, candidates)
+            keep = matched + (total - index - 1) >= min_match
+            candidates, matched = candidates[keep], matched[keep]
+        return PantryMatches(
+            candidates, matched, matched / sizes[candidates])
+
+    def notify(self, recipe_ids):
+        # Вызывается после коммита, когда состав рецептов уже записан.
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        cache.add(SEQUENCE_KEY, 0, None)
+        try:
+            number = cache.incr(SEQUENCE_KEY)
+        except ValueError:
+            self.invalidate()
+            return
+        cache.set(change_key(number), recipe_ids, PANTRY_CHANGE_TIMEOUT)
+
+    def invalidate(self):
+        cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        self._generation = None
+
+    def _ensure_fresh(self):
+        values = cache.get_many([GENERATION_KEY, SEQUENCE_KEY])
+        generation = values.get(GENERATION_KEY)
+        sequence = values.get(SEQUENCE_KEY, 0)
+        if generation is not None and generation == self._generation and (
+                sequence == self._sequence):
+            return
+        with self._lock:
+            if generation is None:
+                cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+                generation = cache.get(GENERATION_KEY)
+            if generation != self._generation:
+                self._load(generation, sequence)
+            elif sequence != self._sequence:
+                self._catch_up(sequence)
+
+    def _catch_up(self, sequence):
+        # Номер мог и уменьшиться, если счётчик вытеснен из кэша.
+        if not 0 < sequence - self._sequence <= PANTRY_MAX_CHANGES:
+            self._load(self._generation, sequence)
+            return
+        keys = [
+            change_key(number)
+            for number in range(self._sequence + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            # Часть журнала вытеснена из кэша.
+            self._load(self._generation, sequence)
+            return
+        self._apply({pk for ids in changes.values() for pk in ids})
+        self._sequence = sequence
+
+    def _load(self, generation, sequence):
+        # Номер журнала запоминается до чтения базы: изменения, попавшие
+        # между ними, применятся повторно, что безопасно.
+        rows = np.fromiter(
+            (value for row in RecipeIngredient.objects.values_list(
+                'ingredient_id', 'recipe_id').iterator(chunk_size=10000)
+             for value in row),
+            dtype=np.int32).reshape(-1, 2)
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+        ingredients, starts = np.unique(rows[:, 0], return_index=True)
+        recipe_ids = rows[:, 1]
+        postings = {
+            pk: recipe_ids[start:stop] for pk, start, stop in zip(
+                ingredients.tolist(), starts.tolist(),
+                [*starts[1:].tolist(), len(rows)])
+        }
+        sizes = np.bincount(recipe_ids).astype(np.int32) if len(
+            rows) else EMPTY
+        self._recipes = {}
+        for ingredient_id, recipe_id in rows.tolist():
+            self._recipes.setdefault(recipe_id, []).append(ingredient_id)
+        self._state = (postings, sizes)
+        self._generation = generation
+        self._sequence = sequence
+
+    def _apply(self, recipe_ids):
+        current = {}
+        for batch in batched(sorted(recipe_ids), BATCH_SIZE):
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                    recipe_id__in=batch).values_list(
+                    'recipe_id', 'ingredient_id'):
+                current.setdefault(recipe_id, []).append(ingredient_id)
+        added, removed = {}, {}
+        for recipe_id in recipe_ids:
+            old = set(self._recipes.pop(recipe_id, ()))
+            new = set(current.get(recipe_id, ()))
+            if new:
+                self._recipes[recipe_id] = sorted(new)
+            for pk in new - old:
+                added.setdefault(pk, []).append(recipe_id)
+            for pk in old - new:
+                removed.setdefault(pk, []).append(recipe_id)
+        postings, sizes = self._state
+        postings = dict(postings)
+        for pk in added.keys() | removed.keys():
+            values = postings.get(pk, EMPTY)
+            if pk in removed:
+                values = values[~np.isin(values, removed[pk])]
+            if pk in added:
+                values = np.union1d(
+                    values, np.array(added[pk], dtype=np.int32))
+            if len(values):
+                postings[pk] = values
+            else:
+                postings.pop(pk, None)
+        sizes = np.concatenate([sizes, np.zeros(
+            max(max(recipe_ids) + 1 - len(sizes), 0), dtype=np.int32)])
+        for recipe_id in recipe_ids:
+            sizes[recipe_id] = len(self._recipes.get(recipe_id, ()))
+        self._state = (postings, sizes)
+
+
+def schedule_pantry_update(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: pantry_index.notify(recipe_ids))
+
+
+pantry_index = PantryIndex()
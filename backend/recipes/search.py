@@ -0,0 +1,276 @@
+import re
+from functools import lru_cache
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Ingredient, Recipe, RecipeIngredient
+
+SEARCH_TABLE = 'recipes_recipe_search'
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = ('в', 'вши', 'вшись')
+_PERFECTIVE_GERUND_2 = ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись')
+_ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+    'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая',
+    'яя', 'ою', 'ею',
+)
+_PARTICIPLE = ('ем', 'нн', 'вш', 'ющ', 'щ')
+_PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+_REFLEXIVE = ('ся', 'сь')
+_VERB = (
+    'ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+    'ют', 'ны', 'ть', 'ешь', 'нно',
+)
+_VERB_2 = (
+    'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+    'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+    'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+)
+_NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+_SUPERLATIVE = ('ейш', 'ейше')
+_DERIVATIONAL = ('ост', 'ость')
+
+
+def _regions(word):
+    rv = r1 = r2 = len(word)
+    for index, char in enumerate(word):
+        if char in _VOWELS:
+            rv = index + 1
+            break
+    for index in range(1, len(word)):
+        if word[index - 1] in _VOWELS and word[index] not in _VOWELS:
+            r1 = index + 1
+            break
+    for index in range(r1 + 1, len(word)):
+        if word[index - 1] in _VOWELS and word[index] not in _VOWELS:
+            r2 = index + 1
+            break
+    return rv, r2
+
+
+def _strip(word, start, endings, preceded=()):
+    # Отрезает самое длинное окончание, лежащее в регионе с позиции start.
+    # Окончания из preceded должны идти после «а» или «я».
+    for ending in sorted(endings + preceded, key=len, reverse=True):
+        if not word.endswith(ending) or len(word) - len(ending) < start:
+            continue
+        stem = word[:-len(ending)]
+        if ending in preceded and (
+                len(stem) - 1 < start or stem[-1] not in 'ая'):
+            return None
+        return stem
+    return None
+
+
+@lru_cache(maxsize=100_000)
+def stem_russian(word):
+    # Стеммер Snowball для русского языка. Словарь рецептов невелик,
+    # поэтому основы кэшируются: при переиндексации слова повторяются.
+    word = word.lower().replace('ё', 'е')
+    rv, r2 = _regions(word)
+    stem = _strip(word, rv, _PERFECTIVE_GERUND_2, _PERFECTIVE_GERUND)
+    if stem is None:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        stem = _strip(word, rv, _ADJECTIVE)
+        if stem is not None:
+            stem = _strip(stem, rv, _PARTICIPLE_2, _PARTICIPLE) or stem
+        else:
+            stem = _strip(word, rv, _VERB_2, _VERB)
+            if stem is None:
+                stem = _strip(word, rv, _NOUN)
+    word = stem if stem is not None else word
+    if word.endswith('и') and len(word) > rv:
+        word = word[:-1]
+    word = _strip(word, r2, _DERIVATIONAL) or word
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        return word[:-1]
+    stem = _strip(word, rv, _SUPERLATIVE)
+    if stem is not None:
+        return stem[:-1] if stem.endswith('нн') else stem
+    if word.endswith('ь') and len(word) > rv:
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [
+        stem_russian(token) if re.search('[а-яё]', token) else token
+        for token in re.findall(r'\w+', text.lower())
+    ]
+
+
+class BaseSearchBackend:
+
+    def setup(self):
+        raise NotImplementedError
+
+    def index(self, recipe_ids):
+        raise NotImplementedError
+
+    def remove(self, recipe_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE {self.key_column} IN '
+                f'({", ".join(["%s"] * len(recipe_ids))})', list(recipe_ids))
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    # tsvector с весами (название, описание, ингредиенты) и GIN-индексом,
+    # плюс триграммы pg_trgm по названию для опечаток.
+    key_column = 'recipe_id'
+    config = 'russian'
+
+    def setup(self):
+        recipe_table = Recipe._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'recipe_id bigint PRIMARY KEY REFERENCES {recipe_table} (id)'
+                f' ON DELETE CASCADE, document tsvector NOT NULL)')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document '
+                f'ON {SEARCH_TABLE} USING gin (document)')
+            try:
+                with transaction.atomic():
+                    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                    cursor.execute(
+                        f'CREATE INDEX IF NOT EXISTS {recipe_table}_name_trgm'
+                        f' ON {recipe_table} USING gin (name gin_trgm_ops)')
+            except DatabaseError:
+                pass
+
+    @property
+    def trigram(self):
+        if not hasattr(self, '_trigram'):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                self._trigram = cursor.fetchone() is not None
+        return self._trigram
+
+    def index(self, recipe_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {SEARCH_TABLE} (recipe_id, document)
+                SELECT r.id,
+                    setweight(to_tsvector(%s, r.name), 'A')
+                    || setweight(to_tsvector(%s, r.text), 'C')
+                    || setweight(to_tsvector(%s, coalesce(
+                        string_agg(i.name, ' '), '')), 'B')
+                FROM {Recipe._meta.db_table} r
+                LEFT JOIN {RecipeIngredient._meta.db_table} ri
+                    ON ri.recipe_id = r.id
+                LEFT JOIN {Ingredient._meta.db_table} i
+                    ON i.id = ri.ingredient_id
+                WHERE r.id = ANY(%s)
+                GROUP BY r.id
+                ON CONFLICT (recipe_id)
+                DO UPDATE SET document = EXCLUDED.document
+            ''', [self.config] * 3 + [list(recipe_ids)])
+
+    def search(self, queryset, query):
+        recipe_table = Recipe._meta.db_table
+        tsquery = f"websearch_to_tsquery('{self.config}', %s)"
+        rank = (
+            f'coalesce((SELECT ts_rank(s.document, {tsquery}) '
+            f'FROM {SEARCH_TABLE} s WHERE s.recipe_id = {recipe_table}.id '
+            f'AND s.document @@ {tsquery}), 0)'
+        )
+        matches = (
+            f'SELECT recipe_id FROM {SEARCH_TABLE} WHERE document @@ {tsquery}'
+        )
+        rank_params, match_params = [query, query], [query]
+        if self.trigram:
+            rank += f' + similarity({recipe_table}.name, %s)'
+            matches += f' UNION SELECT id FROM {recipe_table} WHERE name %% %s'
+            rank_params.append(query)
+            match_params.append(query)
+        return queryset.filter(
+            id__in=RawSQL(matches, match_params)
+        ).annotate(search_rank=RawSQL(rank, rank_params))
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    # FTS5 для локальной разработки и тестов. Русские слова приводятся
+    # к основе стеммером на стороне Python и при индексации, и при поиске.
+    key_column = 'rowid'
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING '
+                f"fts5(name, text, ingredients, tokenize='unicode61')")
+
+    def index(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        ingredients = {}
+        for recipe_id, name in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient__name'):
+            ingredients.setdefault(recipe_id, []).append(name)
+        rows = [
+            (pk, ' '.join(tokenize(name)), ' '.join(tokenize(text)),
+             ' '.join(tokenize(' '.join(ingredients.get(pk, [])))))
+            for pk, name, text in Recipe.objects.filter(
+                id__in=recipe_ids).values_list('id', 'name', 'text')
+        ]
+        self.remove(recipe_ids)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} '
+                f'(rowid, name, text, ingredients) VALUES (%s, %s, %s, %s)',
+                rows)
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        # Соединение с таблицей FTS: SQLite начинает с поиска по индексу и
+        # считает ранг только для найденных строк. Коррелированный подзапрос
+        # с MATCH повторял бы полнотекстовый поиск для каждой строки.
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[
+                f'{SEARCH_TABLE}.rowid = {Recipe._meta.db_table}.id',
+                f'{SEARCH_TABLE} MATCH %s',
+            ],
+            params=[match],
+            select={'search_rank': f'-bm25({SEARCH_TABLE}, 10.0, 1.0, 5.0)'},
+        )
+
+
+_backends = {}
+
+
+def get_search_backend():
+    if connection.vendor not in _backends:
+        _backends[connection.vendor] = (
+            PostgresSearchBackend() if connection.vendor == 'postgresql'
+            else SqliteSearchBackend()
+        )
+    return _backends[connection.vendor]
+
+
+def index_recipes(recipe_ids):
+    if recipe_ids:
+        get_search_backend().index(recipe_ids)
+
+
+def remove_recipes(recipe_ids):
+    if recipe_ids:
+        get_search_backend().remove(recipe_ids)
+
+
+def search_recipes(queryset, query):
+    return get_search_backend().search(queryset, query).order_by(
+        '-search_rank', '-id')
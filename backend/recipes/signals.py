@@ -0,0 +1,265 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from core.background import run_in_background
+from core.images import delete_variants, generate_variants
+from core.streaming import batched
+from users.models import Subscription
+from .autocomplete import ingredient_index
+from .cache_versions import bump_recipe_versions
+from .cart import (
+    remove_recipe_from_shopping_lists,
+    update_recipe_in_shopping_lists,
+)
+from .counters import change_user_counters, forget_user
+from .documents import (
+    AUTHOR_FIELDS,
+    refresh_and_bump,
+    refresh_documents,
+    schedule_document_refresh,
+)
+from .feed import forget_subscription, schedule_backfill, schedule_fan_out
+from .functions import invalidate_short_code
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeSimilarity,
+    ShoppingCart,
+    ShortLink,
+)
+from .pantry import schedule_pantry_update
+from .search import get_search_backend, index_recipes, remove_recipes
+from .similarity import schedule_similar_refill, schedule_similar_refresh
+from .trending import forget_user_trending, get_landmark
+
+User = get_user_model()
+
+REINDEX_BATCH_SIZE = 500
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+def reindex_ingredient(ingredient_id):
+    # Популярный ингредиент входит в тысячи рецептов, поэтому они
+    # переиндексируются в фоне пакетами, а не внутри сохранения в админке.
+    recipe_ids = list(RecipeIngredient.objects.filter(
+        ingredient_id=ingredient_id).values_list('recipe_id', flat=True))
+    for batch in batched(recipe_ids, REINDEX_BATCH_SIZE):
+        index_recipes(batch)
+        refresh_and_bump(batch)
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(
+            lambda: run_in_background(reindex_ingredient, instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    bump_recipe_versions([instance.id])
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_document(sender, instance, **kwargs):
+    # Версия рецепта меняется после пересборки снимка.
+    schedule_document_refresh([instance.id])
+
+
+def schedule_recipe_ingredients_upkeep(recipe_ids):
+    schedule_document_refresh(recipe_ids)
+    schedule_pantry_update(recipe_ids)
+    transaction.on_commit(
+        lambda: run_in_background(index_recipes, recipe_ids))
+    schedule_similar_refresh(recipe_ids)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, raw=False, **kwargs):
+    # Поштучные изменения состава (например, в админке): прежняя строка
+    # нужна, чтобы поправить списки покупок на разницу.
+    instance._stored = None
+    if instance.pk and not raw:
+        instance._stored = RecipeIngredient.objects.filter(
+            pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_recipe_ingredient(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {instance.recipe_id: {instance.ingredient_id: instance.amount}}
+    stored = getattr(instance, '_stored', None)
+    if stored:
+        recipe_id, ingredient_id, amount = stored
+        changes = deltas.setdefault(recipe_id, {})
+        changes[ingredient_id] = changes.get(ingredient_id, 0) - amount
+    for recipe_id, changes in deltas.items():
+        update_recipe_in_shopping_lists(recipe_id, changes)
+    schedule_recipe_ingredients_upkeep(list(deltas))
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_recipe_ingredient(sender, instance, **kwargs):
+    update_recipe_in_shopping_lists(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount})
+    schedule_recipe_ingredients_upkeep([instance.recipe_id])
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        schedule_fan_out([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_pantry_index(sender, instance, **kwargs):
+    schedule_pantry_update([instance.id])
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        schedule_backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def clear_feed(sender, instance, **kwargs):
+    forget_subscription(instance.user_id, instance.author_id)
+
+
+def author_fields(user):
+    values = {field: getattr(user, field) for field in AUTHOR_FIELDS}
+    values['avatar'] = user.avatar.name or ''
+    return values
+
+
+def refresh_author_documents(user_id):
+    recipe_ids = list(Recipe.objects.filter(
+        author_id=user_id).values_list('id', flat=True))
+    for batch in batched(recipe_ids, REINDEX_BATCH_SIZE):
+        refresh_and_bump(batch)
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(sender, instance, update_fields=None, raw=False,
+                           **kwargs):
+    # Снимки рецептов зависят только от полей автора из AUTHOR_FIELDS:
+    # вход, смена пароля и остальные правки их не пересобирают.
+    instance._author_fields = None
+    if raw or not instance.pk or (
+            update_fields and not set(update_fields) & set(AUTHOR_FIELDS)):
+        return
+    stored = User.objects.filter(pk=instance.pk).first()
+    if stored is not None:
+        instance._author_fields = author_fields(stored)
+
+
+@receiver(post_save, sender=User)
+def refresh_author_recipe_documents(sender, instance, **kwargs):
+    stored = getattr(instance, '_author_fields', None)
+    if stored is not None and stored != author_fields(instance):
+        transaction.on_commit(lambda: run_in_background(
+            refresh_author_documents, instance.id))
+
+
+@receiver(post_save, sender=Recipe)
+def count_author_recipe(sender, instance, created, raw=False, **kwargs):
+    # Пара к remove_recipe_from_carts. Пакетные вставки в обход сигналов
+    # (import_recipes, seed_benchmark_data) меняют счётчик сами.
+    if created and not raw:
+        change_user_counters([instance.author_id], recipes_count=1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_carts(sender, instance, **kwargs):
+    # Строки корзин удаляются сразу, чтобы удаление состава рецепта
+    # каскадом не вычло его из списков покупок второй раз.
+    remove_recipe_from_shopping_lists(instance.id)
+    ShoppingCart.objects.filter(recipe_id=instance.id).delete()
+    change_user_counters([instance.author_id], recipes_count=-1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def refill_similar_lists(sender, instance, **kwargs):
+    # Строки с удаляемым рецептом уйдут каскадом, и списки его соседей
+    # нужно дополнить.
+    schedule_similar_refill(RecipeSimilarity.objects.filter(
+        similar_id=instance.id).values_list('recipe_id', flat=True))
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_from_counters(sender, instance, **kwargs):
+    forget_user(instance)
+    forget_user_trending(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_search(sender, instance, **kwargs):
+    remove_recipes([instance.id])
+
+
+@receiver([post_save, post_delete], sender=ShortLink)
+def invalidate_short_link(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_short_code(instance.short_code))
+
+
+def refresh_recipe_image(recipe_id):
+    if generate_variants(Recipe, recipe_id, 'image'):
+        refresh_documents([recipe_id])
+        bump_recipe_versions([recipe_id])
+
+
+def refresh_user_avatar(user_id):
+    if generate_variants(User, user_id, 'avatar'):
+        refresh_author_documents(user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_image_variants(sender, instance, **kwargs):
+    if instance.image.name != instance.image_variants.get('source'):
+        transaction.on_commit(
+            lambda: run_in_background(refresh_recipe_image, instance.id))
+
+
+@receiver(post_save, sender=User)
+def schedule_avatar_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'avatar' not in update_fields:
+        return
+    if (instance.avatar.name or None) != (
+            instance.avatar_variants.get('source') or None):
+        transaction.on_commit(
+            lambda: run_in_background(refresh_user_avatar, instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image_variants(sender, instance, **kwargs):
+    transaction.on_commit(lambda: delete_variants(
+        instance.image.storage, instance.image_variants))
+
+
+@receiver(post_delete, sender=User)
+def delete_avatar_variants(sender, instance, **kwargs):
+    transaction.on_commit(lambda: delete_variants(
+        instance.avatar.storage, instance.avatar_variants))
+
+
+def setup_search(sender, **kwargs):
+    get_search_backend().setup()
+
+
+def setup_trending(sender, **kwargs):
+    get_landmark()
@@ -0,0 +1,303 @@
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
+from django.db import connections, transaction
+from django.db.models import Count
+from scipy import sparse
+
+from core.background import run_in_background
+from .constants import (
+    SIMILAR_RECIPES_COUNT,
+    SIMILARITY_MAX_DF,
+    SIMILARITY_METRIC,
+    SIMILARITY_MIN_POSTINGS,
+)
+from .models import Recipe, RecipeIngredient, RecipeSimilarity
+
+# Похожие рецепты — K ближайших по составу ингредиентов (Jaccard или
+# косинус по бинарным векторам). Пересечения для блока рецептов
+# считаются произведением разреженных матриц «блок × всё»; частые
+# ингредиенты (соль, вода) в произведение не входят, чтобы строки не
+# становились плотными, а досчитываются по битовым маскам рецептов.
+# Поэтому K ближайших приблизительны: рецепты, у которых общие только
+# частые ингредиенты, друг другу в кандидаты не попадают (кроме случая,
+# когда у рецепта все ингредиенты частые). Порог частоты задают
+# SIMILARITY_MAX_DF и SIMILARITY_MIN_POSTINGS; при SIMILARITY_MAX_DF = 1
+# частых нет и результат точный, но строки произведения плотнее.
+# Между полными пересчётами (build_similar_recipes) списки правятся
+# точечно. Изменённый рецепт вставляется только в списки своих K
+# ближайших: рецепт, которому он стал ближе, но который сам не вошёл в
+# эти K (сходство не симметрично по рангу), получит его лишь после
+# полного пересчёта. Списки, откуда рецепт выбыл после правки или
+# удаления, считаются заново, поэтому пустых мест в них не остаётся.
+
+# Частых ингредиентов в маске не больше числа бит в uint64, остальные
+# частые считаются обычными.
+FREQUENT_BITS = 64
+# Оценка округляется до 6 знаков и сортируется как целое число.
+SCORE_SCALE = 10 ** 6
+
+
+def jaccard(common, size, other_size):
+    return common / (size + other_size - common)
+
+
+def cosine(common, size, other_size):
+    return common / (size * other_size) ** 0.5
+
+
+METRICS = {'jaccard': jaccard, 'cosine': cosine}
+
+
+def frequency_limit(total):
+    return max(SIMILARITY_MAX_DF * total, SIMILARITY_MIN_POSTINGS)
+
+
+def candidate_ingredients(ingredients, frequencies, limit):
+    # Если все ингредиенты рецепта частые, кандидатов даёт самый редкий.
+    rare = [pk for pk in ingredients if frequencies[pk] <= limit]
+    return rare or [min(ingredients, key=frequencies.__getitem__)]
+
+
+def popcount(values):
+    # Число единичных бит в каждом uint64 без цикла по байтам.
+    values = values - ((values >> np.uint64(1))
+                       & np.uint64(0x5555555555555555))
+    values = ((values & np.uint64(0x3333333333333333))
+              + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333)))
+    values = (values + (values >> np.uint64(4))) & np.uint64(
+        0x0F0F0F0F0F0F0F0F)
+    return ((values * np.uint64(0x0101010101010101))
+            >> np.uint64(56)).astype(np.int64)
+
+
+class SimilarityMatrix:
+
+    def __init__(self, pairs, limit=None, metric=SIMILARITY_METRIC):
+        # pairs — пары (recipe_id, ingredient_id) в любом порядке.
+        self.metric = METRICS[metric]
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        ingredient_ids, columns = np.unique(
+            pairs[:, 1], return_inverse=True)
+        frequencies = np.bincount(columns, minlength=len(ingredient_ids))
+        self.sizes = np.bincount(rows, minlength=len(self.ids))
+        if limit is None:
+            limit = frequency_limit(len(self.ids))
+        frequent = np.flatnonzero(frequencies > limit)
+        frequent = frequent[np.argsort(
+            -frequencies[frequent], kind='stable')][:FREQUENT_BITS]
+        bits = np.full(len(ingredient_ids), -1)
+        bits[frequent] = np.arange(len(frequent))
+        pair_bits = bits[columns]
+        in_mask = pair_bits >= 0
+        # Рецептам только из частых ингредиентов кандидатов даёт самый
+        # редкий из них — так же, как candidate_ingredients.
+        has_rare = np.zeros(len(self.ids), dtype=bool)
+        has_rare[rows[~in_mask]] = True
+        orphans = np.flatnonzero(~has_rare[rows])
+        if len(orphans):
+            orphans = orphans[np.lexsort(
+                (frequencies[columns[orphans]], rows[orphans]))]
+            first = np.r_[True, rows[orphans][1:] != rows[orphans][:-1]]
+            in_mask[orphans[first]] = False
+        self.masks = np.zeros(len(self.ids), dtype=np.uint64)
+        np.bitwise_or.at(
+            self.masks, rows[in_mask],
+            np.left_shift(np.uint64(1), pair_bits[in_mask].astype(np.uint64)))
+        rare = ~in_mask
+        self.matrix = sparse.csr_matrix(
+            (np.ones(rare.sum(), dtype=np.int32),
+             (rows[rare], columns[rare])),
+            shape=(len(self.ids), len(ingredient_ids)))
+        self.transposed = self.matrix.T.tocsr()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def block(self, start, stop, count=SIMILAR_RECIPES_COUNT):
+        # Соседи рецептов с номерами [start, stop): список
+        # (recipe_id, [(similar_id, score), ...]) по убыванию сходства.
+        overlaps = self.matrix[start:stop] @ self.transposed
+        overlaps.sort_indices()
+        overlaps = overlaps.tocoo()
+        rows = overlaps.row.astype(np.int64) + start
+        columns = overlaps.col.astype(np.int64)
+        keep = columns != rows
+        rows, columns = rows[keep], columns[keep]
+        common = overlaps.data[keep] + popcount(
+            self.masks[rows] & self.masks[columns])
+        scores = np.rint(self.metric(
+            common, self.sizes[rows], self.sizes[columns]) * SCORE_SCALE
+        ).astype(np.int64)
+        # Строки уже идут по порядку, внутри строки — по убыванию оценки,
+        # при равенстве — по возрастанию номера (сортировка устойчива).
+        order = np.argsort(
+            (rows - start) * (SCORE_SCALE + 1) + SCORE_SCALE - scores,
+            kind='stable')
+        rows, columns, scores = rows[order], columns[order], scores[order]
+        firsts = np.searchsorted(rows, np.arange(start, stop + 1))
+        top = np.arange(len(rows)) - firsts[rows - start] < count
+        rows, columns, scores = rows[top], columns[top], scores[top]
+        bounds = np.searchsorted(rows, np.arange(start, stop + 1))
+        similar_ids = self.ids[columns].tolist()
+        scores = (scores / SCORE_SCALE).tolist()
+        return [
+            (int(self.ids[index]), list(zip(
+                similar_ids[bounds[offset]:bounds[offset + 1]],
+                scores[bounds[offset]:bounds[offset + 1]])))
+            for offset, index in enumerate(range(start, stop))
+        ]
+
+
+def load_matrix(**kwargs):
+    pairs = RecipeIngredient.objects.values_list(
+        'recipe_id', 'ingredient_id').iterator(chunk_size=10000)
+    return SimilarityMatrix(
+        np.fromiter(chain.from_iterable(pairs), dtype=np.int64), **kwargs)
+
+
+# Матрица передаётся дочерним процессам через fork без сериализации.
+_matrix = None
+
+
+def _compute_block(bounds):
+    return _matrix.block(*bounds)
+
+
+def iter_blocks(matrix, block_size, workers=1):
+    # Отдаёт соседей блоками по block_size рецептов; в памяти одновременно
+    # не больше workers * 2 блоков результатов.
+    global _matrix
+    bounds = [
+        (start, min(start + block_size, len(matrix)))
+        for start in range(0, len(matrix), block_size)
+    ]
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for start, stop in bounds:
+            yield matrix.block(start, stop)
+        return
+    _matrix = matrix
+    # Соединения с базой не должны достаться дочерним процессам.
+    connections.close_all()
+    try:
+        with ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            pending = []
+            for bound in bounds:
+                pending.append(executor.submit(_compute_block, bound))
+                if len(pending) >= workers * 2:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+    finally:
+        _matrix = None
+
+
+def save_block(block):
+    recipe_ids = [recipe_id for recipe_id, _ in block]
+    with transaction.atomic():
+        RecipeSimilarity.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeSimilarity.objects.bulk_create(
+            RecipeSimilarity(recipe_id=recipe_id, similar_id=similar_id,
+                             score=score)
+            for recipe_id, neighbours in block
+            for similar_id, score in neighbours
+        )
+
+
+def find_similar(recipe_id, count=SIMILAR_RECIPES_COUNT):
+    # Соседи одного рецепта прямо по базе: [(score, similar_id), ...]
+    # по убыванию сходства.
+    ingredients = set(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+    if not ingredients:
+        return []
+    frequencies = dict(RecipeIngredient.objects.filter(
+        ingredient_id__in=ingredients).values_list(
+        'ingredient_id').annotate(count=Count('*')))
+    candidates = candidate_ingredients(
+        ingredients, frequencies, frequency_limit(Recipe.objects.count()))
+    others = {}
+    for other, pk in RecipeIngredient.objects.filter(
+            recipe_id__in=RecipeIngredient.objects.filter(
+                ingredient_id__in=candidates).exclude(
+                recipe_id=recipe_id).values('recipe_id')
+    ).values_list('recipe_id', 'ingredient_id'):
+        others.setdefault(other, set()).add(pk)
+    metric = METRICS[SIMILARITY_METRIC]
+    return heapq.nlargest(count, (
+        (round(metric(len(ingredients & other_ingredients),
+                      len(ingredients), len(other_ingredients)), 6),
+         other)
+        for other, other_ingredients in others.items()
+    ))
+
+
+def replace_similar(recipe_id, neighbours):
+    RecipeSimilarity.objects.filter(recipe_id=recipe_id).delete()
+    RecipeSimilarity.objects.bulk_create(
+        RecipeSimilarity(recipe_id=recipe_id, similar_id=other, score=score)
+        for score, other in neighbours)
+
+
+def refill_similar(recipe_ids, count=SIMILAR_RECIPES_COUNT):
+    for recipe_id in recipe_ids:
+        with transaction.atomic():
+            replace_similar(recipe_id, find_similar(recipe_id, count))
+
+
+def refresh_similar(recipe_id, count=SIMILAR_RECIPES_COUNT):
+    # Пересчёт после изменения одного рецепта прямо по базе: его соседи
+    # считаются заново, а сам рецепт попадает в списки соседей, если
+    # теснит там последнего.
+    with transaction.atomic():
+        listed_in = set(RecipeSimilarity.objects.filter(
+            similar_id=recipe_id).values_list('recipe_id', flat=True))
+        RecipeSimilarity.objects.filter(similar_id=recipe_id).delete()
+        neighbours = find_similar(recipe_id, count)
+        replace_similar(recipe_id, neighbours)
+        lists = {}
+        for other, score in RecipeSimilarity.objects.filter(
+                recipe_id__in=[other for _, other in neighbours]
+        ).values_list('recipe_id', 'score'):
+            lists.setdefault(other, []).append(score)
+        added = [
+            (score, other) for score, other in neighbours
+            if len(lists.get(other, ())) < count
+            or score > min(lists[other])
+        ]
+        RecipeSimilarity.objects.bulk_create(
+            RecipeSimilarity(recipe_id=other, similar_id=recipe_id,
+                             score=score)
+            for score, other in added)
+        # Полные списки теряют последнее место.
+        for _, other in added:
+            if len(lists.get(other, ())) >= count:
+                RecipeSimilarity.objects.filter(pk__in=list(
+                    RecipeSimilarity.objects.filter(
+                        recipe_id=other).order_by('score', 'id').values_list(
+                        'pk', flat=True)[:1])).delete()
+        # Списки, из которых рецепт выбыл, считаются заново: иначе
+        # освободившееся место осталось бы пустым до полного пересчёта.
+        refill_similar(listed_in - {other for _, other in added}, count)
+    return [(other, score) for score, other in neighbours]
+
+
+def schedule_similar_refresh(recipe_ids):
+    # Только для рецептов с новым набором ингредиентов: от количеств и
+    # остальных полей соседи не зависят.
+    for recipe_id in recipe_ids:
+        transaction.on_commit(
+            lambda pk=recipe_id: run_in_background(refresh_similar, pk))
+
+
+def schedule_similar_refill(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(
+            lambda: run_in_background(refill_similar, recipe_ids))
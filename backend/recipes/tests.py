@@ -0,0 +1,1855 @@
+import base64
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO, StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+
+from api.serializers import RecipeReadSerializer
+from core.metrics import DURATION_BUCKETS, registry
+from core.routers import replica_health
+from core.streaming import iter_json
+from recipes.autocomplete import ingredient_index
+from recipes.cache_versions import recipe_version_key
+from recipes.cart import add_to_shopping_list
+from recipes.constants import FEED_FAN_OUT_MAX_SUBSCRIBERS
+from recipes.documents import refresh_documents
+from recipes.functions import (
+    encode_short_code,
+    get_or_create_short_link,
+    short_link_cache,
+)
+from recipes.models import (
+    Favorite,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeSimilarity,
+    ShoppingCart,
+    ShoppingListItem,
+    ShortLink,
+)
+from recipes.pantry import pantry_index
+from recipes.search import index_recipes
+from recipes.similarity import (
+    SimilarityMatrix,
+    candidate_ingredients,
+    refill_similar,
+    refresh_similar,
+)
+from recipes.trending import (
+    TAU,
+    WEIGHTS,
+    change_trending,
+    get_landmark,
+    rebuild_trending,
+    renormalize,
+    score_at,
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+# Запросов на страницу списка: count и рецепты со снимками.
+RECIPE_LIST_QUERY_BUDGET = 2
+# Запросов на один рецепт: рецепт со снимком.
+RECIPE_DETAIL_QUERY_BUDGET = 1
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class RecipesAPITestCase(APITestCase):
+
+    def setUp(self):
+        # Кэш живёт дольше транзакции теста, а версии рецептов меняются
+        # только после коммита, которого в тестах нет.
+        cache.clear()
+
+    def use_temporary_media(self):
+        # Загруженные в тесте файлы пишутся во временный каталог, который
+        # удаляется после теста.
+        media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, media_root)
+        return media_root
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        first_name=username, last_name=username, password='password')
+
+
+def create_recipes(author, count, ingredients):
+    Recipe.objects.bulk_create(
+        Recipe(author=author, name=f'Рецепт {i}', text='Описание',
+               cooking_time=10, image='recipes/images/test.png')
+        for i in range(count)
+    )
+    recipes = list(Recipe.objects.filter(author=author))
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+        for recipe in recipes for ingredient in ingredients
+    )
+    return recipes
+
+
+class RecipeQueryCountTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(3)
+        )
+        ingredients = list(Ingredient.objects.all())
+        cls.recipes = []
+        for i in range(5):
+            author = create_user(f'author{i}')
+            cls.recipes += create_recipes(author, 5, ingredients)
+        Subscription.objects.create(user=cls.reader,
+                                    author=cls.recipes[0].author)
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipes[1])
+        refresh_documents([recipe.id for recipe in cls.recipes])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_list_query_budget_does_not_depend_on_page_size(self):
+        for user in (None, self.reader):
+            self.client.force_authenticate(user)
+            for limit in (1, 5, 25):
+                with self.subTest(user=user, limit=limit):
+                    count, _ = self.count_queries(
+                        f'/api/recipes/?limit={limit}')
+                    self.assertLessEqual(count, RECIPE_LIST_QUERY_BUDGET)
+
+    def test_detail_query_budget(self):
+        for user in (None, self.reader):
+            self.client.force_authenticate(user)
+            with self.subTest(user=user):
+                count, _ = self.count_queries(
+                    f'/api/recipes/{self.recipes[0].id}/')
+                self.assertLessEqual(count, RECIPE_DETAIL_QUERY_BUDGET)
+
+    def test_user_flags_are_annotated(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get('/api/recipes/?limit=25')
+        flags = {
+            item['id']: (item['is_favorited'], item['is_in_shopping_cart'],
+                         item['author']['is_subscribed'])
+            for item in response.data['results']
+        }
+        first, second = self.recipes[0], self.recipes[1]
+        self.assertEqual(flags[first.id], (True, False, True))
+        self.assertEqual(flags[second.id], (False, True, True))
+        self.assertEqual(flags[self.recipes[-1].id], (False, False, False))
+
+    def test_filters_use_annotations(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get('/api/recipes/?is_favorited=true')
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [self.recipes[0].id])
+        response = self.client.get('/api/recipes/?is_in_shopping_cart=true')
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [self.recipes[1].id])
+
+
+class RecipeCursorPaginationTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipes = create_recipes(cls.author, 7, [])
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_limit_offset_is_default(self):
+        data = self.get_page('/api/recipes/?limit=3&offset=3')
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(len(data['results']), 3)
+
+    def test_pages_are_stable_while_recipes_are_added(self):
+        data = self.get_page('/api/recipes/?pagination=cursor&limit=3')
+        self.assertNotIn('count', data)
+        self.assertIsNone(data['previous'])
+        seen = [item['id'] for item in data['results']]
+        create_recipes(create_user('newcomer'), 2, [])
+        while data['next']:
+            data = self.get_page(data['next'])
+            seen += [item['id'] for item in data['results']]
+        expected = Recipe.objects.filter(
+            author=self.author).order_by('-created_at', '-id')
+        self.assertEqual(seen, [recipe.id for recipe in expected])
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.get_page('/api/recipes/?pagination=cursor&limit=3')
+        second = self.get_page(first['next'])
+        previous = self.get_page(second['previous'])
+        self.assertEqual(previous['results'], first['results'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+        self.client.force_authenticate(self.author)
+        for position in ([None, None], [[1], {}]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps({'p': position}).encode()).decode()
+            for url in ('/api/recipes/', '/api/recipes/feed/'):
+                with self.subTest(position=position, url=url):
+                    response = self.client.get(f'{url}?cursor={cursor}')
+                    self.assertEqual(response.status_code, 404)
+
+    def test_search_falls_back_to_limit_offset(self):
+        index_recipes([recipe.id for recipe in self.recipes])
+        data = self.client.get('/api/recipes/', {
+            'search': 'рецепт', 'pagination': 'cursor', 'limit': 3}).data
+        self.assertEqual(data['count'], 7)
+        seen = [item['id'] for item in data['results']]
+        while data['next']:
+            data = self.get_page(data['next'])
+            seen += [item['id'] for item in data['results']]
+        self.assertEqual(sorted(seen),
+                         sorted(recipe.id for recipe in self.recipes))
+
+
+class IngredientAutocompleteTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('Молоко', 'молоко сгущённое', 'Мёд', 'мука', 'Yeast')
+        )
+
+    def setUp(self):
+        super().setUp()
+        ingredient_index.invalidate()
+
+    def search(self, query):
+        response = self.client.get(f'/api/ingredients/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_search_folds_case(self):
+        self.assertEqual(self.search('name=МОЛ'),
+                         ['Молоко', 'молоко сгущённое'])
+        self.assertEqual(self.search('name=ме'), ['Мёд'])
+        self.assertEqual(self.search('name=y'), ['Yeast'])
+        self.assertEqual(self.search('name=мор'), [])
+
+    def test_limit(self):
+        self.assertEqual(self.search('name=м&limit=2'), ['Мёд', 'Молоко'])
+        self.assertEqual(len(self.search('')), 5)
+
+    def test_warm_index_does_not_query_database(self):
+        self.search('name=м')
+        with self.assertNumQueries(0):
+            self.search('name=му')
+
+    def test_index_is_invalidated_on_change(self):
+        self.assertEqual(self.search('name=мус'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Мускатный орех',
+                                      measurement_unit='г')
+        self.assertEqual(self.search('name=мус'), ['Мускатный орех'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='Мускатный орех').delete()
+        self.assertEqual(self.search('name=мус'), [])
+
+
+class RecipeSearchTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        flour = Ingredient.objects.create(name='мука', measurement_unit='г')
+        cls.pancakes = Recipe.objects.create(
+            author=cls.author, name='Блины на молоке', cooking_time=30,
+            text='Тонкие блины к завтраку.', image='recipes/images/test.png')
+        cls.bread = Recipe.objects.create(
+            author=cls.author, name='Домашний хлеб', cooking_time=90,
+            text='Хлеб без молочных продуктов.',
+            image='recipes/images/test.png')
+        cls.soup = Recipe.objects.create(
+            author=cls.author, name='Овощной суп', cooking_time=40,
+            text='Лёгкий суп.', image='recipes/images/test.png')
+        RecipeIngredient.objects.create(recipe=cls.pancakes, ingredient=milk,
+                                        amount=500)
+        RecipeIngredient.objects.create(recipe=cls.pancakes,
+                                        ingredient=flour, amount=200)
+        RecipeIngredient.objects.create(recipe=cls.bread, ingredient=flour,
+                                        amount=500)
+        index_recipes([cls.pancakes.id, cls.bread.id, cls.soup.id])
+
+    def search(self, query):
+        response = self.client.get(f'/api/recipes/?search={query}')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_search_uses_russian_stemming(self):
+        self.assertEqual(self.search('блинами'), [self.pancakes.id])
+        self.assertEqual(self.search('супы'), [self.soup.id])
+
+    def test_search_matches_ingredients_and_ranks_by_relevance(self):
+        self.assertEqual(self.search('мука'),
+                         [self.bread.id, self.pancakes.id])
+        self.assertEqual(self.search('молоко')[0], self.pancakes.id)
+
+    def test_index_follows_ingredient_rename(self):
+        Ingredient.objects.filter(name='мука').update(name='крупа')
+        ingredient = Ingredient.objects.get(name='крупа')
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(self.search('крупа'),
+                         [self.bread.id, self.pancakes.id])
+        self.assertEqual(self.search('мука'), [])
+
+    def test_deleted_recipe_leaves_index(self):
+        self.soup.delete()
+        self.assertEqual(self.search('суп'), [])
+
+
+class ShoppingListDownloadTest(RecipesAPITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('buyer')
+        author = create_user('author')
+        Ingredient.objects.bulk_create([
+            Ingredient(name='мука', measurement_unit='г'),
+            Ingredient(name='молоко', measurement_unit='мл'),
+        ])
+        ingredients = list(Ingredient.objects.all())
+        cls.recipes = create_recipes(author, 2, ingredients)
+        for recipe in cls.recipes:
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        add_to_shopping_list(cls.user.id, [r.id for r in cls.recipes])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def download(self, query=''):
+        response = self.client.get(f'{self.url}{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_txt_is_default(self):
+        self.assertEqual(
+            self.download().decode(),
+            'Список покупок:\n- молоко: 2 мл\n- мука: 2 г\n')
+        self.assertEqual(self.download('?format=txt'), self.download())
+
+    def test_csv(self):
+        lines = self.download('?format=csv').decode().splitlines()
+        self.assertEqual(lines[1:], ['молоко,2,мл', 'мука,2,г'])
+
+    def test_json(self):
+        self.assertEqual(json.loads(self.download('?format=json')), [
+            {'name': 'молоко', 'amount': 2, 'measurement_unit': 'мл'},
+            {'name': 'мука', 'amount': 2, 'measurement_unit': 'г'},
+        ])
+
+    def test_pdf(self):
+        self.assertTrue(self.download('?format=pdf').startswith(b'%PDF'))
+
+    def test_unknown_format(self):
+        response = self.client.get(f'{self.url}?format=docx')
+        self.assertEqual(response.status_code, 404)
+
+    def test_empty_cart(self):
+        for recipe in self.recipes:
+            self.client.delete(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertFalse(ShoppingListItem.objects.exists())
+        response = self.client.get(self.url)
+        self.assertEqual(response.content.decode(), 'Ваша корзина пуста.')
+
+    def test_cart_actions_update_shopping_list(self):
+        recipe = self.recipes[0]
+        self.client.delete(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(
+            self.download().decode(),
+            'Список покупок:\n- молоко: 1 мл\n- мука: 1 г\n')
+        response = self.client.post(
+            f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            self.download().decode(),
+            'Список покупок:\n- молоко: 2 мл\n- мука: 2 г\n')
+
+    def test_recipe_delete_updates_shopping_list(self):
+        self.recipes[0].delete()
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list('total_amount',
+                                                     flat=True)), {1})
+
+    def test_check_shopping_lists_fixes_drift(self):
+        ShoppingListItem.objects.filter(
+            ingredient__name='мука').update(total_amount=7)
+        ShoppingListItem.objects.filter(ingredient__name='молоко').delete()
+        out = StringIO()
+        call_command('check_shopping_lists', stdout=out)
+        self.assertIn('Найдено расхождений: 2', out.getvalue())
+        call_command('check_shopping_lists', '--fix', stdout=out)
+        call_command('check_shopping_lists', stdout=out)
+        self.assertTrue(
+            out.getvalue().endswith('Расхождений не найдено\n'))
+        self.assertEqual(
+            self.download().decode(),
+            'Список покупок:\n- молоко: 2 мл\n- мука: 2 г\n')
+
+
+class CountersTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipes = create_recipes(cls.author, 3, [])
+        call_command('recount', stdout=StringIO())
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_actions_update_counters(self):
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count), (1, 1))
+        self.assertEqual(
+            (self.author.recipes_count, self.author.subscribers_count),
+            (3, 1))
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.delete(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count), (0, 0))
+        self.assertEqual(self.author.subscribers_count, 0)
+
+    def test_deletes_update_counters(self):
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.user.delete()
+        self.recipes[1].delete()
+        Recipe.objects.create(
+            author=self.author, name='Новый', text='Описание',
+            cooking_time=5, image='recipes/images/test.png')
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(
+            (self.author.recipes_count, self.author.subscribers_count),
+            (3, 0))
+
+    def test_recount_repairs_drift(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        Recipe.objects.update(favorites_count=5)
+        User.objects.update(recipes_count=0)
+        call_command('recount', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('favorites_count', flat=True)),
+            [0, 0, 1])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 3)
+
+    def test_admin_cannot_edit_counted_rows(self):
+        favorite = Favorite.objects.create(
+            user=self.user, recipe=self.recipes[0])
+        self.client.force_login(User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password'))
+        self.assertEqual(self.client.get(
+            '/admin/recipes/favorite/').status_code, 200)
+        self.assertEqual(self.client.get(
+            '/admin/recipes/favorite/add/').status_code, 403)
+        self.assertEqual(self.client.post(
+            f'/admin/recipes/favorite/{favorite.id}/delete/',
+            {'post': 'yes'}).status_code, 403)
+        self.assertEqual(self.client.get(
+            '/admin/recipes/shoppingcart/add/').status_code, 403)
+        self.assertTrue(Favorite.objects.filter(pk=favorite.id).exists())
+
+    def test_ordering_by_favorites_count(self):
+        Recipe.objects.filter(pk=self.recipes[1].pk).update(favorites_count=3)
+        Recipe.objects.filter(pk=self.recipes[2].pk).update(favorites_count=1)
+        response = self.client.get('/api/recipes/?ordering=-favorites_count')
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [self.recipes[1].id, self.recipes[2].id, self.recipes[0].id])
+
+
+class ShortLinkTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe, = create_recipes(create_user('author'), 1, [])
+
+    def setUp(self):
+        super().setUp()
+        short_link_cache.clear()
+
+    def test_codes_are_unique(self):
+        codes = {encode_short_code(number) for number in range(1, 20000)}
+        self.assertEqual(len(codes), 19999)
+        self.assertEqual({len(code) for code in codes}, {4})
+        self.assertEqual(len(encode_short_code(62 ** 4)), 5)
+        with self.assertRaises(ValueError):
+            encode_short_code(62 ** 6)
+
+    def test_one_link_per_recipe(self):
+        first = self.client.get(f'/api/recipes/{self.recipe.id}/get_link/')
+        second = self.client.get(f'/api/recipes/{self.recipe.id}/get_link/')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(ShortLink.objects.count(), 1)
+
+    def test_legacy_code_collision_uses_longer_code(self):
+        other, = create_recipes(create_user('other'), 1, [])
+        ShortLink.objects.create(
+            recipe=other, short_code=encode_short_code(self.recipe.id))
+        short_link = get_or_create_short_link(self.recipe)
+        self.assertEqual(len(short_link.short_code), 5)
+        response = self.client.get(f'/s/{short_link.short_code}/')
+        self.assertRedirects(response, f'/api/recipes/{self.recipe.id}/',
+                             fetch_redirect_response=False)
+
+    def test_redirect_is_cached(self):
+        short_link = get_or_create_short_link(self.recipe)
+        url = f'/s/{short_link.short_code}/'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_unknown_code_is_cached_until_link_is_created(self):
+        url = f'/s/{encode_short_code(self.recipe.id)}/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            get_or_create_short_link(self.recipe)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_recipe_delete_invalidates_redirect(self):
+        short_link = get_or_create_short_link(self.recipe)
+        url = f'/s/{short_link.short_code}/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class RecipeResponseCacheTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.recipes = create_recipes(create_user('author'), 3, [])
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+
+    def test_etag_answers_not_modified(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipes[0].id}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response)
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_alone_is_not_trusted(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        response = self.client.get(url)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_lookups_leave_no_versions(self):
+        for lookup in ('junk', '0'):
+            self.assertEqual(
+                self.client.get(f'/api/recipes/{lookup}/').status_code, 404)
+        self.assertIsNone(cache.get(recipe_version_key('junk')))
+
+    def test_anonymous_pages_are_cached(self):
+        first = self.client.get('/api/recipes/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/recipes/')
+        self.assertEqual(first.data, second.data)
+
+    def test_write_bumps_version(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        etag = self.client.get(url)['ETag']
+        list_etag = self.client.get('/api/recipes/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.recipes[0]
+            recipe.name = 'Новое название'
+            recipe.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Новое название')
+        self.assertNotEqual(
+            self.client.get('/api/recipes/')['ETag'], list_etag)
+
+    def test_user_flags_do_not_leak(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        anonymous = self.client.get(url)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'{url}favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_favorited'])
+        self.client.force_authenticate(None)
+        self.assertFalse(self.client.get(url).data['is_favorited'])
+
+
+def make_image(size, image_format='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'orange').save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def to_base64(content, mime='image/png'):
+    return f'data:{mime};base64,{base64.b64encode(content).decode()}'
+
+
+class ImageVariantsTest(RecipesAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.use_temporary_media()
+        self.user = create_user('artist')
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.user, name='Пирог', text='Описание',
+                cooking_time=30,
+                image=ContentFile(make_image((1600, 1200), 'JPEG'),
+                                  name='pie.jpg'))
+        recipe.refresh_from_db()
+        return recipe
+
+    def test_variants_are_generated(self):
+        recipe = self.create_recipe()
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        for variant, size in (('small', 320), ('medium', 800)):
+            files = recipe.image_variants[variant]
+            self.assertTrue(files['url'].endswith('.jpg'))
+            self.assertTrue(files['webp'].endswith('.webp'))
+            for name in files.values():
+                with Image.open(os.path.join(self.media_root, name)) as image:
+                    self.assertEqual(max(image.size), size)
+
+    def test_lists_return_thumbnails(self):
+        recipe = self.create_recipe()
+        item = self.client.get('/api/recipes/').data['results'][0]
+        self.assertTrue(item['image'].endswith(
+            recipe.image_variants['medium']['url']))
+        self.assertTrue(item['image_variants']['small']['webp'].endswith(
+            '_small.webp'))
+        detail = self.client.get(f'/api/recipes/{recipe.id}/').data
+        self.assertTrue(detail['image'].endswith(recipe.image.name))
+
+    def test_originals_are_served_until_variants_are_ready(self):
+        recipe = create_recipes(self.user, 1, [])[0]
+        item = self.client.get('/api/recipes/').data['results'][0]
+        self.assertTrue(item['image'].endswith(recipe.image.name))
+        self.assertEqual(item['image_variants'], {})
+
+    def test_replaced_image_drops_old_variants(self):
+        recipe = self.create_recipe()
+        old_files = list(recipe.image_variants['small'].values())
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image = ContentFile(make_image((400, 300)), name='new.png')
+            recipe.save()
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.image_variants['small']['url'].endswith(
+            '.png'))
+        for name in old_files:
+            self.assertFalse(
+                os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_avatar_upload(self):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/api/users/me/avatar/', {
+                'avatar': to_base64(make_image((600, 600)))}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertIn('small', self.user.avatar_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_variants, {})
+
+    def test_limits_are_checked_before_decoding(self):
+        self.client.force_authenticate(self.user)
+        cases = (
+            (dict(IMAGE_MAX_UPLOAD_SIZE=1024), make_image((600, 600))),
+            (dict(IMAGE_MAX_PIXELS=100 * 100), make_image((101, 100))),
+        )
+        for limits, content in cases:
+            with self.subTest(limits=limits), override_settings(**limits):
+                response = self.client.put('/api/users/me/avatar/', {
+                    'avatar': to_base64(content)}, format='json')
+                self.assertEqual(response.status_code, 400)
+        response = self.client.put('/api/users/me/avatar/', {
+            'avatar': 'data:image/png;base64,bm90IGFuIGltYWdl'},
+            format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_command(self):
+        recipe = create_recipes(self.user, 1, [])[0]
+        recipe.image.save('backfill.png', ContentFile(make_image((900, 700))),
+                          save=False)
+        Recipe.objects.filter(pk=recipe.pk).update(image=recipe.image.name)
+        call_command('generate_image_variants', workers=1, stdout=StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+
+
+class IngredientLoaderTest(RecipesAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, path, **options):
+        out = StringIO()
+        call_command('load_ingredients', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_iter_json_reads_in_chunks(self):
+        items = [{'name': f'ингредиент {i}', 'amount': i * 1.5}
+                 for i in range(50)]
+        for content in (json.dumps(items, ensure_ascii=False),
+                        '\n'.join(json.dumps(item) for item in items)):
+            with self.subTest(content=content[:20]):
+                self.assertEqual(
+                    list(iter_json(StringIO(content), chunk_size=7)), items)
+
+    def test_iter_json_limits_object_size(self):
+        content = '[{"name": "' + 'а' * 100 + '"}]'
+        self.assertEqual(len(list(iter_json(
+            StringIO(content), chunk_size=7, max_size=200))), 1)
+        with self.assertRaises(ValueError):
+            list(iter_json(StringIO(content), chunk_size=7, max_size=50))
+        with self.assertRaises(ValueError):
+            list(iter_json(StringIO('[{"name": "' + 'а' * 1000),
+                           chunk_size=7, max_size=50))
+
+    def test_upsert_counts(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        Ingredient.objects.create(name='молоко', measurement_unit='г')
+        path = self.write('ingredients.json', json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'молоко', 'measurement_unit': 'мл'},
+            {'name': 'мука', 'measurement_unit': 'г'},
+            {'name': 'мука', 'measurement_unit': 'кг'},
+            {'name': '', 'measurement_unit': 'г'},
+            {'name': 'сахар', 'measurement_unit': 'г'},
+        ], ensure_ascii=False))
+        output = self.load(path, batch_size=2)
+        self.assertIn('Добавлено 2, обновлено 1, пропущено 3', output)
+        self.assertEqual(
+            dict(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {'соль': 'г', 'молоко': 'мл', 'мука': 'кг', 'сахар': 'г'})
+
+    def test_csv(self):
+        path = self.write('ingredients.csv',
+                          'name,measurement_unit\nсоль,г\nмолоко,мл\n\n')
+        output = self.load(path)
+        self.assertIn('Добавлено 2, обновлено 0, пропущено 1', output)
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_repository_catalogs(self):
+        self.load(os.path.join('data', 'ingredients.json'))
+        count = Ingredient.objects.count()
+        self.assertGreater(count, 2000)
+        output = self.load(os.path.join('data', 'ingredients.csv'))
+        self.assertIn('Добавлено 0, обновлено 0', output)
+        self.assertEqual(Ingredient.objects.count(), count)
+
+    def test_delete_in_batches(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(5))
+        ingredients = list(Ingredient.objects.all())
+        user = create_user('cook')
+        recipe = create_recipes(user, 1, ingredients)[0]
+        add_to_shopping_list(user.id, [recipe.id])
+        out = StringIO()
+        call_command('delete_ingredients', batch_size=2, stdout=out)
+        self.assertIn('удалено 5', out.getvalue())
+        self.assertFalse(RecipeIngredient.objects.exists())
+        self.assertFalse(ShoppingListItem.objects.exists())
+        self.assertTrue(post_delete.has_listeners(RecipeIngredient))
+
+
+class RecipeTransferTest(RecipesAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'recipes.jsonl')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар'))
+        self.ingredients = list(Ingredient.objects.all())
+        self.author = create_user('author')
+        self.recipes = create_recipes(self.author, 5, self.ingredients)
+        call_command('recount', stdout=StringIO())
+
+    def export(self):
+        call_command('export_recipes', self.path, batch_size=2,
+                     stdout=StringIO())
+        with open(self.path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def snapshot(self):
+        return sorted(
+            (recipe.id, recipe.name, recipe.image.name,
+             recipe.created_at, recipe.author.email,
+             sorted(recipe.recipeingredient_set.values_list(
+                 'ingredient__name', 'amount')))
+            for recipe in Recipe.objects.all()
+        )
+
+    def test_round_trip(self):
+        lines = self.export()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0]['author']['email'], 'author@example.com')
+        self.assertEqual(len(lines[0]['ingredients']), 2)
+        expected = self.snapshot()
+        Recipe.objects.all().delete()
+        User.objects.all().delete()
+        Ingredient.objects.all().delete()
+        out = StringIO()
+        call_command('import_recipes', self.path, batch_size=2, stdout=out)
+        self.assertIn('Загружено рецептов: 5, ингредиентов в рецептах: 10',
+                      out.getvalue())
+        self.assertIn('строк/с', out.getvalue())
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(User.objects.get().recipes_count, 5)
+        self.assertFalse(User.objects.get().has_usable_password())
+
+    def test_resume_from_checkpoint(self):
+        self.export()
+        ids = sorted(recipe.pk for recipe in self.recipes)
+        Recipe.objects.filter(pk__in=ids[2:]).delete()
+        checkpoint = os.path.join(self.directory, 'checkpoint')
+        with open(checkpoint, 'w') as file:
+            file.write('3')
+        out = StringIO()
+        call_command('import_recipes', self.path, batch_size=2,
+                     checkpoint=checkpoint, stdout=out)
+        self.assertIn('Загружено рецептов: 2', out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 4)
+        with open(checkpoint) as file:
+            self.assertEqual(file.read(), '5')
+        out = StringIO()
+        call_command('import_recipes', self.path, stdout=out)
+        self.assertIn('Загружено рецептов: 1, ингредиентов в рецептах: 2, '
+                      'уже были в базе: 4, пропущено рецептов: 0',
+                      out.getvalue())
+        self.assertIn('build_similar_recipes', out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 5)
+
+
+class BulkFavoriteCartTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('planner')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('рис', 'морковь'))
+        cls.ingredients = list(Ingredient.objects.all())
+        cls.recipes = sorted(
+            create_recipes(create_user('author'), 30, cls.ingredients),
+            key=lambda recipe: recipe.id)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def send(self, method, url, recipe_ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(
+                url, {'recipes': recipe_ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_per_id_results(self):
+        ids = [recipe.id for recipe in self.recipes[:3]]
+        Favorite.objects.create(user=self.user, recipe_id=ids[0])
+        results, _ = self.send('post', '/api/recipes/bulk_favorite/',
+                               ids + [ids[1], 999999])
+        self.assertEqual(results, [
+            {'id': ids[0], 'status': 'exists'},
+            {'id': ids[1], 'status': 'added'},
+            {'id': ids[2], 'status': 'added'},
+            {'id': 999999, 'status': 'not_found'},
+        ])
+        self.assertEqual(
+            set(self.user.favorites.values_list('recipe_id', flat=True)),
+            set(ids))
+        self.assertEqual(Recipe.objects.get(pk=ids[1]).favorites_count, 1)
+        results, _ = self.send('delete', '/api/recipes/bulk_favorite/',
+                               ids[1:] + [self.recipes[5].id])
+        self.assertEqual([result['status'] for result in results],
+                         ['removed', 'removed', 'absent'])
+        self.assertEqual(Recipe.objects.get(pk=ids[1]).favorites_count, 0)
+
+    def test_query_count_does_not_depend_on_size(self):
+        for url in ('/api/recipes/bulk_favorite/',
+                    '/api/recipes/bulk_shopping_cart/'):
+            for method in ('post', 'delete'):
+                with self.subTest(url=url, method=method):
+                    _, small = self.send(method, url, [self.recipes[0].id])
+                    _, large = self.send(
+                        method, url, [recipe.id for recipe in self.recipes])
+                    self.assertEqual(small, large)
+
+    def test_cart_updates_shopping_list(self):
+        ids = [recipe.id for recipe in self.recipes[:4]]
+        self.send('post', '/api/recipes/bulk_shopping_cart/', ids)
+        self.assertEqual(
+            set(ShoppingListItem.objects.filter(user=self.user).values_list(
+                'total_amount', flat=True)), {4})
+        self.send('delete', '/api/recipes/bulk_shopping_cart/', ids[:3])
+        self.assertEqual(
+            set(ShoppingListItem.objects.filter(user=self.user).values_list(
+                'total_amount', flat=True)), {1})
+        self.assertEqual(Recipe.objects.get(pk=ids[3]).shopping_cart_count, 1)
+
+    def test_validation(self):
+        for data in ({}, {'recipes': []}, {'recipes': ['x']},
+                     {'recipes': list(range(1, 102))}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    '/api/recipes/bulk_favorite/', data, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/recipes/bulk_favorite/',
+                                    {'recipes': [1]}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class RecipeWriteTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('writer')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(10))
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+
+    def payload(self, amounts, **fields):
+        return {
+            'name': 'Суп', 'text': 'Варить', 'cooking_time': 30,
+            'image': to_base64(make_image((10, 10))),
+            'ingredients': [
+                {'id': self.ingredients[index].id, 'amount': amount}
+                for index, amount in amounts.items()
+            ],
+            **fields,
+        }
+
+    def create(self, amounts):
+        self.use_temporary_media()
+        response = self.client.post(
+            '/api/recipes/', self.payload(amounts), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def test_create_returns_recipe(self):
+        response = self.create({0: 100, 1: 200})
+        self.assertEqual(response.data['author']['id'], self.author.id)
+        self.assertEqual(
+            [(item['name'], item['amount'])
+             for item in response.data['ingredients']],
+            [('ингредиент 0', 100), ('ингредиент 1', 200)])
+
+    def test_ingredients_are_validated_with_one_query(self):
+        payload = self.payload({index: 1 for index in range(10)})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/recipes/', {
+                **payload, 'image': 'не картинка'}, format='json')
+        ingredient_queries = [
+            query for query in queries
+            if 'recipes_ingredient' in query['sql']]
+        self.assertEqual(len(ingredient_queries), 1)
+        payload['ingredients'][0]['id'] = 999999
+        response = self.client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', str(response.data['ingredients']))
+
+    def test_update_changes_only_different_rows(self):
+        recipe_id = self.create({0: 1, 1: 2, 2: 3}).data['id']
+        rows = dict(RecipeIngredient.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', 'pk'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{recipe_id}/',
+                {'cooking_time': 5, 'ingredients': [
+                    {'id': self.ingredients[0].id, 'amount': 1},
+                    {'id': self.ingredients[1].id, 'amount': 2},
+                    {'id': self.ingredients[2].id, 'amount': 3},
+                ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        writes = [query['sql'] for query in queries
+                  if 'recipes_recipeingredient' in query['sql']
+                  and not query['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.client.patch(f'/api/recipes/{recipe_id}/', {'ingredients': [
+            {'id': self.ingredients[0].id, 'amount': 1},
+            {'id': self.ingredients[1].id, 'amount': 20},
+            {'id': self.ingredients[3].id, 'amount': 4},
+        ]}, format='json')
+        updated = dict(RecipeIngredient.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', 'pk'))
+        self.assertEqual(updated[self.ingredients[0].id],
+                         rows[self.ingredients[0].id])
+        self.assertEqual(updated[self.ingredients[1].id],
+                         rows[self.ingredients[1].id])
+        self.assertNotIn(self.ingredients[2].id, updated)
+        self.assertEqual(
+            dict(RecipeIngredient.objects.filter(
+                recipe_id=recipe_id).values_list('ingredient_id', 'amount')),
+            {self.ingredients[0].id: 1, self.ingredients[1].id: 20,
+             self.ingredients[3].id: 4})
+
+    def test_update_keeps_shopping_lists_in_sync(self):
+        recipe_id = self.create({0: 1, 1: 2}).data['id']
+        ShoppingCart.objects.create(user=self.author, recipe_id=recipe_id)
+        add_to_shopping_list(self.author.id, [recipe_id])
+        self.client.patch(f'/api/recipes/{recipe_id}/', {'ingredients': [
+            {'id': self.ingredients[1].id, 'amount': 5},
+            {'id': self.ingredients[2].id, 'amount': 7},
+        ]}, format='json')
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(
+                user=self.author).values_list('ingredient_id',
+                                              'total_amount')),
+            {self.ingredients[1].id: 5, self.ingredients[2].id: 7})
+
+
+class MetricsTest(RecipesAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_request_metrics_are_labelled_by_view_and_action(self):
+        self.client.get('/api/recipes/')
+        metrics = self.client.get('/metrics').content.decode()
+        labels = 'view="RecipeViewSet",action="list",method="GET",status="200"'
+        self.assertIn(
+            f'foodgram_request_duration_seconds_count{{{labels}}} 1', metrics)
+        self.assertIn(f'foodgram_request_db_queries_count{{{labels}}} 1',
+                      metrics)
+        self.assertIn(f'foodgram_response_size_bytes_sum{{{labels}}}',
+                      metrics)
+
+    def test_metrics_are_restricted(self):
+        self.assertEqual(self.client.get(
+            '/metrics', REMOTE_ADDR='203.0.113.5').status_code, 404)
+        with self.settings(METRICS_ALLOWED_NETWORKS=['203.0.113.0/24']):
+            self.assertEqual(self.client.get(
+                '/metrics', REMOTE_ADDR='203.0.113.5').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            self.client.force_login(User.objects.create_user(
+                username='admin', password='password', is_staff=True))
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_snapshots_of_other_workers_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        labels = [['view', 'RecipeViewSet'], ['action', 'list'],
+                  ['method', 'GET'], ['status', '200']]
+        buckets = len(DURATION_BUCKETS) + 1
+        with open(os.path.join(directory, 'metrics-1.json'), 'w') as file:
+            json.dump([['foodgram_request_duration_seconds', labels,
+                        [2] + [0] * (buckets - 1) + [0.004]]], file)
+        with override_settings(METRICS_DIR=directory):
+            self.client.get('/api/recipes/')
+            metrics = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'foodgram_request_duration_seconds_count{view="RecipeViewSet",'
+            'action="list",method="GET",status="200"} 3', metrics)
+        self.assertIn(f'metrics-{os.getpid()}.json', os.listdir(directory))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0.001)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            self.client.get('/api/recipes/')
+        self.assertIn('RecipeViewSet.list', logs.output[0])
+
+
+class BenchmarkDataTest(RecipesAPITestCase):
+
+    def seed(self):
+        call_command(
+            'seed_benchmark_data', users=20, recipes=50, ingredients=30,
+            per_recipe=4, favorites=200, carts=30, subscriptions=60,
+            stdout=StringIO())
+
+    def test_seed_creates_consistent_data(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Recipe.objects.count(), 50)
+        self.assertEqual(Ingredient.objects.count(), 30)
+        self.assertEqual(Favorite.objects.count(), 200)
+        self.assertFalse(Subscription.objects.filter(
+            user=F('author')).exists())
+        self.assertEqual(
+            sum(Recipe.objects.values_list('favorites_count', flat=True)),
+            200)
+        output = StringIO()
+        call_command('check_shopping_lists', stdout=output)
+        self.assertIn('Расхождений не найдено', output.getvalue())
+        # Повторный запуск дополняет базу, не конфликтуя по username.
+        self.seed()
+        self.assertEqual(User.objects.count(), 40)
+
+    def test_benchmark_writes_comparable_results(self):
+        self.seed()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'results.json')
+        call_command('benchmark_endpoints', repeat=2, output=path,
+                     stdout=StringIO())
+        with open(path) as file:
+            results = json.load(file)['results']
+        self.assertIn('recipes:list', results)
+        self.assertIn('short_link:redirect', results)
+        self.assertEqual(results['recipes:detail']['queries'],
+                         RECIPE_DETAIL_QUERY_BUDGET)
+        results['recipes:detail']['queries'] -= 1
+        with open(path, 'w') as file:
+            json.dump({'results': results}, file)
+        with self.assertRaisesMessage(CommandError, 'recipes:detail'):
+            call_command('benchmark_endpoints', repeat=2, compare=path,
+                         threshold=10 ** 6, stdout=StringIO())
+
+
+class RecipeDocumentTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        User.objects.filter(pk=cls.author.pk).update(
+            avatar='users/images/a.png', avatar_variants={
+                'source': 'users/images/a.png',
+                'small': {'url': 'users/images/variants/a_small.png',
+                          'webp': 'users/images/variants/a_small.webp'},
+            })
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+        cls.recipes = create_recipes(cls.author, 3, ingredients)
+        Recipe.objects.filter(pk=cls.recipes[0].pk).update(image_variants={
+            'source': 'recipes/images/test.png',
+            'medium': {'url': 'recipes/images/variants/test_medium.png',
+                       'webp': 'recipes/images/variants/test_medium.webp'},
+        })
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+        Subscription.objects.create(user=cls.reader, author=cls.author)
+        refresh_documents([recipe.id for recipe in cls.recipes])
+
+    def serialize(self, user, recipe_id, thumbnails):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user or AnonymousUser()
+        return RecipeReadSerializer(
+            Recipe.objects.get(pk=recipe_id),
+            context={'request': request, 'thumbnails': thumbnails}).data
+
+    def test_documents_match_serializer(self):
+        for user in (None, self.reader):
+            self.client.force_authenticate(user)
+            with self.subTest(user=user):
+                results = self.client.get('/api/recipes/').data['results']
+                for item in results:
+                    self.assertEqual(
+                        json.loads(json.dumps(item)),
+                        self.serialize(user, item['id'], thumbnails=True))
+                recipe_id = self.recipes[0].id
+                detail = self.client.get(f'/api/recipes/{recipe_id}/').data
+                self.assertEqual(
+                    json.loads(json.dumps(detail)),
+                    self.serialize(user, recipe_id, thumbnails=False))
+
+    def test_documents_follow_recipe_and_author_changes(self):
+        recipe = self.recipes[0]
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/', {'name': 'Новое название'},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Автор'
+            self.author.save()
+        document = Recipe.objects.get(pk=recipe.id).document
+        self.assertEqual(document['name'], 'Новое название')
+        self.assertEqual(document['author']['first_name'], 'Автор')
+
+    def test_unrelated_author_changes_skip_documents(self):
+        author = User.objects.get(pk=self.author.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            author.set_password('new-password-123')
+            author.save()
+            author.save(update_fields=['last_name'])
+        self.assertEqual(callbacks, [])
+
+    def test_single_ingredient_edits_follow_everywhere(self):
+        recipe = self.recipes[1]
+        ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+        add_to_shopping_list(self.reader.id, [recipe.id])
+        row = RecipeIngredient.objects.filter(recipe=recipe).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            row.amount = 5
+            row.save()
+        document = Recipe.objects.get(pk=recipe.id).document
+        self.assertIn(5, [item['amount'] for item in document['ingredients']])
+        self.assertEqual(ShoppingListItem.objects.get(
+            user=self.reader, ingredient_id=row.ingredient_id
+        ).total_amount, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            row.delete()
+        document = Recipe.objects.get(pk=recipe.id).document
+        self.assertEqual(len(document['ingredients']), 2)
+        self.assertFalse(ShoppingListItem.objects.filter(
+            user=self.reader, ingredient_id=row.ingredient_id).exists())
+        self.assertEqual(
+            sorted(pantry_index.search([row.ingredient_id]).ids.tolist()),
+            sorted(other.id for other in self.recipes if other != recipe))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=recipe.id).delete()
+        self.assertFalse(ShoppingListItem.objects.filter(
+            user=self.reader).exists())
+
+    def test_missing_documents_are_built_on_read_and_by_command(self):
+        Recipe.objects.update(document={})
+        response = self.client.get(f'/api/recipes/{self.recipes[1].id}/')
+        self.assertEqual(response.data['name'], self.recipes[1].name)
+        self.assertTrue(Recipe.objects.get(pk=self.recipes[1].id).document)
+        call_command('rebuild_recipe_documents', stdout=StringIO())
+        self.assertFalse(Recipe.objects.filter(document={}).exists())
+
+
+class FeedTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.celebrity = create_user('celebrity')
+        cls.other = create_user('other')
+        ingredient = Ingredient.objects.create(name='соль',
+                                               measurement_unit='г')
+        cls.recipes = []
+        for author in (cls.author, cls.celebrity, cls.other):
+            cls.recipes += create_recipes(author, 3, [ingredient])
+        # Разные даты, чтобы порядок ленты не зависел от id.
+        start = timezone.now()
+        for number, recipe in enumerate(cls.recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                created_at=start - timedelta(minutes=number * 7 % 9))
+        refresh_documents([recipe.id for recipe in cls.recipes])
+        User.objects.filter(pk=cls.celebrity.pk).update(
+            subscribers_count=FEED_FAN_OUT_MAX_SUBSCRIBERS)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.reader)
+        for author in (self.author, self.celebrity):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/users/{author.id}/subscribe/')
+
+    def expected(self):
+        return list(Recipe.objects.filter(
+            author__in=[self.author, self.celebrity]
+        ).order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def read_feed(self, url='/api/recipes/feed/?limit=2'):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_feed_merges_timeline_and_celebrity_recipes(self):
+        self.assertEqual(self.read_feed(), self.expected())
+        self.assertFalse(FeedEntry.objects.filter(
+            author=self.celebrity).exists())
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.reader).count(), 3)
+
+    def test_new_recipe_is_fanned_out(self):
+        self.use_temporary_media()
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'name': 'Новый', 'text': 'Текст', 'cooking_time': 5,
+                'image': to_base64(make_image((10, 10))),
+                'ingredients': [{'id': Ingredient.objects.get().id,
+                                 'amount': 1}],
+            }, format='json')
+        self.client.force_authenticate(self.reader)
+        feed = self.client.get('/api/recipes/feed/').data['results']
+        self.assertEqual(feed[0]['id'], response.data['id'])
+        self.assertTrue(feed[0]['author']['is_subscribed'])
+
+    def test_unsubscribe_clears_timeline(self):
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(set(self.read_feed()), {
+            recipe.id for recipe in self.recipes
+            if recipe.author_id == self.celebrity.id})
+
+    def test_feed_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/recipes/feed/?limit=5')
+        # Лента, подписки на популярных авторов, их рецепты и снимки.
+        self.assertEqual(len(queries), 4)
+
+    def test_rebuild_feeds(self):
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(self.read_feed(), self.expected())
+
+    def test_feed_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(
+            self.client.get('/api/recipes/feed/').status_code, 401)
+
+
+class SimilarRecipesTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(8)
+        ]
+        compositions = [
+            (0, 1, 2), (0, 1, 3), (0, 1, 2, 3), (4, 5), (4, 5, 6), (7,),
+        ]
+        cls.recipes = create_recipes(cls.author, len(compositions), [])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, amount=1,
+                             ingredient=cls.ingredients[index])
+            for recipe, composition in zip(cls.recipes, compositions)
+            for index in composition
+        )
+
+    def brute_force(self, rows, count, limit):
+        recipes = {}
+        for recipe_id, ingredient_id in rows:
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        frequencies = Counter(ingredient_id for _, ingredient_id in rows)
+        candidates = {
+            recipe_id: set(candidate_ingredients(
+                ingredients, frequencies, limit))
+            for recipe_id, ingredients in recipes.items()
+        }
+        return {
+            recipe_id: sorted((
+                round(len(ingredients & other) / len(ingredients | other), 6)
+                for other_id, other in recipes.items()
+                if other_id != recipe_id
+                and candidates[recipe_id] & candidates[other_id]
+            ), reverse=True)[:count]
+            for recipe_id, ingredients in recipes.items()
+        }
+
+    def test_matrix_matches_brute_force(self):
+        generator = random.Random(1)
+        rows = [
+            (recipe_id, ingredient_id)
+            for recipe_id in range(1, 300)
+            for ingredient_id in set(generator.choices(
+                range(40), weights=range(40, 0, -1), k=6))
+        ]
+        # Без частых ингредиентов и с частыми, вынесенными в маски.
+        for limit in (len(rows), 40):
+            with self.subTest(limit=limit):
+                matrix = SimilarityMatrix(rows, limit=limit)
+                expected = self.brute_force(rows, 5, limit)
+                for recipe_id, neighbours in matrix.block(
+                        0, len(matrix), 5):
+                    self.assertEqual([score for _, score in neighbours],
+                                     expected[recipe_id])
+
+    def test_build_and_endpoint(self):
+        call_command('build_similar_recipes', workers=2, block_size=2,
+                     stdout=StringIO())
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[0].id}/similar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['id'] for item in response.data],
+            [self.recipes[2].id, self.recipes[1].id])
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[5].id}/similar/')
+        self.assertEqual(response.data, [])
+        self.assertEqual(
+            self.client.get('/api/recipes/0/similar/').status_code, 404)
+
+    def test_refresh_after_write(self):
+        call_command('build_similar_recipes', workers=1, stdout=StringIO())
+        self.use_temporary_media()
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_id = self.client.post('/api/recipes/', {
+                'name': 'Двойник', 'text': 'Текст', 'cooking_time': 5,
+                'image': to_base64(make_image((10, 10))),
+                'ingredients': [
+                    {'id': self.ingredients[index].id, 'amount': 1}
+                    for index in (4, 5, 6)
+                ],
+            }, format='json').data['id']
+        similar = self.client.get(f'/api/recipes/{recipe_id}/similar/').data
+        self.assertEqual([item['id'] for item in similar],
+                         [self.recipes[4].id, self.recipes[3].id])
+        self.assertEqual(
+            RecipeSimilarity.objects.get(
+                recipe=self.recipes[4], similar_id=recipe_id).score, 1.0)
+        # Правка без смены набора ингредиентов соседей не пересчитывает.
+        RecipeSimilarity.objects.filter(recipe_id=recipe_id).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipes/{recipe_id}/', {
+                'name': 'Тройник',
+                'ingredients': [
+                    {'id': self.ingredients[index].id, 'amount': 2}
+                    for index in (4, 5, 6)
+                ],
+            }, format='json')
+        self.assertFalse(
+            RecipeSimilarity.objects.filter(recipe_id=recipe_id).exists())
+
+    def similar_ids(self, recipe):
+        return list(RecipeSimilarity.objects.filter(
+            recipe=recipe).order_by('-score').values_list(
+            'similar_id', flat=True))
+
+    def test_vacated_slots_are_refilled(self):
+        first, second, third = self.recipes[:3]
+        refill_similar([recipe.id for recipe in self.recipes], count=1)
+        self.assertEqual(self.similar_ids(first), [third.id])
+        RecipeIngredient.objects.filter(recipe=third).delete()
+        RecipeIngredient.objects.create(
+            recipe=third, ingredient=self.ingredients[7], amount=1)
+        refresh_similar(third.id, count=1)
+        self.assertEqual(self.similar_ids(first), [second.id])
+        self.assertEqual(self.similar_ids(third), [self.recipes[5].id])
+
+    def test_deleted_recipe_slots_are_refilled(self):
+        first, second, third = self.recipes[:3]
+        refill_similar([recipe.id for recipe in self.recipes], count=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            third.delete()
+        self.assertEqual(self.similar_ids(first), [second.id])
+
+
+class PantrySearchTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(12)
+        ]
+        generator = random.Random(2)
+        cls.recipes = create_recipes(cls.author, 60, [])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, amount=1, ingredient=ingredient)
+            for recipe in cls.recipes
+            for ingredient in set(generator.choices(
+                cls.ingredients, weights=range(12, 0, -1), k=4))
+        )
+        refresh_documents([recipe.id for recipe in cls.recipes])
+
+    def brute_force(self, ingredient_ids, min_match):
+        recipes = {}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id'):
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        matches = [
+            (len(ingredients & ingredient_ids) / len(ingredients),
+             len(ingredients & ingredient_ids), recipe_id)
+            for recipe_id, ingredients in recipes.items()
+            if len(ingredients & ingredient_ids) >= min_match
+        ]
+        return [
+            (recipe_id, matched, coverage)
+            for coverage, matched, recipe_id in sorted(matches, reverse=True)
+        ]
+
+    def test_index_matches_brute_force(self):
+        generator = random.Random(3)
+        ids = [ingredient.id for ingredient in self.ingredients]
+        for size in (1, 2, 3, 5):
+            query = set(generator.sample(ids, size))
+            for min_match in range(1, size + 1):
+                with self.subTest(size=size, min_match=min_match):
+                    self.assertEqual(
+                        pantry_index.search(query, min_match)[:],
+                        self.brute_force(query, min_match))
+            self.assertEqual(pantry_index.search(query)[:],
+                             self.brute_force(query, size))
+
+    def test_endpoint(self):
+        query = [ingredient.id for ingredient in self.ingredients[:3]]
+        expected = self.brute_force(set(query), 2)
+        url = (f'/api/recipes/pantry/?ingredients={query[0]},{query[1]}'
+               f'&ingredients={query[2]}&min_match=2&limit=5')
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], len(expected))
+            ids += [
+                (item['id'], item['matched_ingredients'], item['coverage'])
+                for item in response.data['results']
+            ]
+            url = response.data['next']
+        self.assertEqual(ids, [
+            (pk, matched, round(coverage, 3))
+            for pk, matched, coverage in expected])
+
+    def test_invalid_query(self):
+        for url in ('/api/recipes/pantry/',
+                    '/api/recipes/pantry/?ingredients=x',
+                    '/api/recipes/pantry/?ingredients=1&min_match=0'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_incremental_update(self):
+        ingredient_ids = {ingredient.id for ingredient in self.ingredients}
+        pantry_index.search(ingredient_ids)
+        generation = pantry_index._generation
+        self.use_temporary_media()
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_id = self.client.post('/api/recipes/', {
+                'name': 'Новый', 'text': 'Текст', 'cooking_time': 5,
+                'image': to_base64(make_image((10, 10))),
+                'ingredients': [
+                    {'id': self.ingredients[-1].id, 'amount': 1}],
+            }, format='json').data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipes/{self.recipes[0].id}/', {
+                'ingredients': [
+                    {'id': self.ingredients[-1].id, 'amount': 1},
+                    {'id': self.ingredients[-2].id, 'amount': 1},
+                ],
+            }, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{self.recipes[1].id}/')
+        for query in ({self.ingredients[-1].id},
+                      {self.ingredients[-1].id, self.ingredients[-2].id},
+                      {self.ingredients[0].id}):
+            with self.subTest(query=query):
+                self.assertEqual(pantry_index.search(query, 1)[:],
+                                 self.brute_force(query, 1))
+        self.assertIn(recipe_id, pantry_index.search(
+            {self.ingredients[-1].id}).ids)
+        self.assertEqual(pantry_index._generation, generation)
+
+
+class TrendingTest(RecipesAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(f'user{i}') for i in range(3)]
+        cls.recipes = create_recipes(cls.users[0], 6, [])
+        refresh_documents([recipe.id for recipe in cls.recipes])
+
+    def current_scores(self, moment):
+        landmark = get_landmark()
+        return {
+            pk: score_at(score, landmark, moment)
+            for pk, score in Recipe.objects.values_list(
+                'id', 'trending_score')
+        }
+
+    def brute_force(self, events, moment):
+        scores = {recipe.id: 0.0 for recipe in self.recipes}
+        for model, recipe_id, added_at in events:
+            scores[recipe_id] += WEIGHTS[model] * math.exp(
+                (added_at.timestamp() - moment) / TAU)
+        return scores
+
+    def assertScoresEqual(self, actual, expected):
+        for pk, score in expected.items():
+            self.assertAlmostEqual(
+                actual[pk], score, delta=1e-9 + score * 1e-9)
+
+    def test_incremental_scores_match_brute_force(self):
+        generator = random.Random(4)
+        moment = timezone.now() - timedelta(days=20)
+        renormalize(moment.timestamp())
+        live = []
+        for step in range(400):
+            moment += timedelta(seconds=generator.uniform(0, 4 * 60 * 60))
+            if live and generator.random() < 0.3:
+                model, recipe_id, added_at = live.pop(
+                    generator.randrange(len(live)))
+                change_trending(model, [(recipe_id, added_at)], sign=-1)
+            else:
+                batch = [
+                    (generator.choice(list(WEIGHTS)),
+                     generator.choice(self.recipes).id, moment)
+                    for _ in range(generator.randint(1, 3))
+                ]
+                for model, recipe_id, added_at in batch:
+                    change_trending(model, [(recipe_id, added_at)])
+                live += batch
+            if step % 97 == 0:
+                renormalize(moment.timestamp())
+        self.assertScoresEqual(
+            self.current_scores(moment.timestamp()),
+            self.brute_force(live, moment.timestamp()))
+
+    def test_batched_change_matches_single_events(self):
+        moment = timezone.now()
+        events = [
+            (self.recipes[index % 3].id, moment - timedelta(hours=index))
+            for index in range(10)
+        ]
+        change_trending(Favorite, events)
+        batched_scores = self.current_scores(moment.timestamp())
+        Recipe.objects.update(trending_score=0)
+        for event in events:
+            change_trending(Favorite, [event])
+        self.assertScoresEqual(
+            self.current_scores(moment.timestamp()), batched_scores)
+
+    def test_api_updates_scores_and_ordering(self):
+        favorites = {0: [1, 2], 1: [2], 2: [0, 1, 2]}
+        for user_index, recipe_indexes in favorites.items():
+            self.client.force_authenticate(self.users[user_index])
+            for index in recipe_indexes:
+                self.client.post(
+                    f'/api/recipes/{self.recipes[index].id}/favorite/')
+        self.client.force_authenticate(self.users[0])
+        self.client.post('/api/recipes/bulk_shopping_cart/', {
+            'recipes': [self.recipes[3].id, self.recipes[4].id]},
+            format='json')
+        self.client.delete(f'/api/recipes/{self.recipes[1].id}/favorite/')
+        self.client.delete('/api/recipes/bulk_shopping_cart/', {
+            'recipes': [self.recipes[4].id]}, format='json')
+        moment = timezone.now().timestamp()
+        events = [
+            (model, recipe_id, added_at)
+            for model in WEIGHTS
+            for recipe_id, added_at in model.objects.values_list(
+                'recipe_id', 'added_at')
+        ]
+        expected = self.brute_force(events, moment)
+        self.assertScoresEqual(self.current_scores(moment), expected)
+        ids = [item['id'] for item in self.client.get(
+            '/api/recipes/?ordering=trending&limit=3').data['results']]
+        self.assertEqual(ids, [
+            self.recipes[2].id, self.recipes[1].id, self.recipes[0].id])
+        self.assertEqual(ids[0], max(expected, key=expected.get))
+        rebuild_trending(moment)
+        self.assertScoresEqual(self.current_scores(moment), expected)
+
+    def test_renormalize_command_keeps_order(self):
+        moment = timezone.now()
+        for index, recipe in enumerate(self.recipes[:4]):
+            change_trending(
+                Favorite, [(recipe.id, moment - timedelta(days=index * 10))])
+        before = self.current_scores(moment.timestamp())
+        order = list(Recipe.objects.order_by(
+            '-trending_score', '-id').values_list('id', flat=True))
+        # Добавление трёхмесячной давности при перенормировке обнуляется.
+        change_trending(
+            Favorite, [(self.recipes[5].id, moment - timedelta(days=90))])
+        call_command('renormalize_trending', stdout=StringIO())
+        self.assertScoresEqual(
+            self.current_scores(moment.timestamp()), before)
+        self.assertEqual(list(Recipe.objects.order_by(
+            '-trending_score', '-id').values_list('id', flat=True)), order)
+
+
+REPLICA = 'replica_test'
+
+
+def add_database(alias, name):
+    connections.databases[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.databases[alias]
+
+
+@override_settings(READ_REPLICAS=[REPLICA], REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTest(RecipesAPITestCase):
+    # Реплику изображает второй файл SQLite, в котором есть только
+    # таблица ингредиентов с одной строкой, которой нет в основной базе.
+    # Она подключается после setUpClass и живёт вне транзакции теста.
+    replica_ingredient = 777
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        add_database(REPLICA, os.path.join(cls.directory, 'replica.sqlite3'))
+        with connections[REPLICA].schema_editor() as editor:
+            editor.create_model(Ingredient)
+        Ingredient.objects.using(REPLICA).create(
+            pk=cls.replica_ingredient, name='только на реплике',
+            measurement_unit='г')
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_database(REPLICA)
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = create_recipes(cls.user, 1, [])[0]
+
+    def setUp(self):
+        super().setUp()
+        replica_health.clear()
+
+    def reads_replica(self, client):
+        response = client.get(
+            f'/api/ingredients/{self.replica_ingredient}/')
+        self.assertIn(response.status_code, (200, 404))
+        return response.status_code == 200
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertTrue(self.reads_replica(self.client))
+        self.assertEqual(Ingredient.objects.count(), 0)
+
+    def test_write_sticks_client_to_primary(self):
+        response = self.client.post('/api/users/', {
+            'email': 'new@example.com', 'username': 'new',
+            'first_name': 'Имя', 'last_name': 'Фамилия',
+            'password': 'Zx9-secret-pass'})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(self.reads_replica(self.client))
+        self.assertTrue(self.reads_replica(APIClient()))
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            client = APIClient()
+            client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+            self.assertTrue(self.reads_replica(client))
+
+    def test_token_clients_stick_by_header(self):
+        # Токена нет на реплике: он всегда проверяется по основной базе.
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertTrue(self.reads_replica(self.client))
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.id}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertFalse(self.reads_replica(client))
+
+    def test_failed_query_is_retried_on_primary(self):
+        # На реплике нет таблицы рецептов.
+        self.client.raise_request_exception = False
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        self.assertFalse(self.reads_replica(self.client))
+
+    def test_unavailable_replica_is_skipped(self):
+        add_database('replica_broken', os.path.join(
+            self.directory, 'missing', 'replica.sqlite3'))
+        self.addCleanup(remove_database, 'replica_broken')
+        with override_settings(READ_REPLICAS=['replica_broken', REPLICA]):
+            with self.assertLogs('core.routers', 'WARNING'):
+                for _ in range(5):
+                    self.assertTrue(self.reads_replica(self.client))
+        with override_settings(READ_REPLICAS=['replica_broken']):
+            self.assertFalse(self.reads_replica(self.client))
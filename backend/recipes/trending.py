@@ -0,0 +1,125 @@
+import math
+import time
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Subquery, Value, When
+from django.db.models.functions import Exp, Greatest
+
+from core.streaming import batched
+from .cache_versions import COUNTERS_VERSION_KEY, bump_versions
+from .constants import (
+    TRENDING_CART_WEIGHT,
+    TRENDING_FAVORITE_WEIGHT,
+    TRENDING_HALF_LIFE_HOURS,
+    TRENDING_MIN_SCORE,
+)
+from .models import Favorite, Recipe, ShoppingCart, TrendingState
+
+# Популярность рецепта — сумма весов добавлений в избранное и корзину,
+# затухающих экспоненциально: w * exp(-(now - added_at) / TAU). Оценка
+# хранится приведённой к общей точке отсчёта landmark, то есть как
+# сумма w * exp((added_at - landmark) / TAU). Так добавление меняет одну
+# строку, а порядок рецептов со временем не меняется, и сортировка идёт
+# по обычному индексу. Слагаемые растут вместе с added_at, поэтому
+# периодическая перенормировка переносит landmark в текущий момент и
+# умножает все оценки на один множитель.
+TAU = TRENDING_HALF_LIFE_HOURS * 60 * 60 / math.log(2)
+WEIGHTS = {
+    Favorite: TRENDING_FAVORITE_WEIGHT,
+    ShoppingCart: TRENDING_CART_WEIGHT,
+}
+BATCH_SIZE = 500
+
+
+def score_at(score, landmark, moment):
+    # Сохранённая оценка, пересчитанная на момент moment.
+    return score * math.exp((landmark - moment) / TAU)
+
+
+def get_landmark():
+    state, _ = TrendingState.objects.get_or_create(
+        pk=1, defaults={'landmark': time.time()})
+    return state.landmark
+
+
+def change_trending(model, events, sign=1):
+    # events — пары (recipe_id, added_at) добавленных (sign=1) или
+    # удалённых (sign=-1) строк Favorite или ShoppingCart. Вклады
+    # считаются относительно самого позднего события, а к landmark
+    # приводятся в том же UPDATE, поэтому отдельного чтения точки
+    # отсчёта нет.
+    events = list(events)
+    if not events:
+        return
+    reference = max(added_at for _, added_at in events).timestamp()
+    deltas = {}
+    for recipe_id, added_at in events:
+        deltas[recipe_id] = deltas.get(recipe_id, 0) + (
+            sign * WEIGHTS[model]
+            * math.exp((added_at.timestamp() - reference) / TAU))
+    landmark = Subquery(
+        TrendingState.objects.filter(pk=1).values('landmark')[:1])
+    factor = Exp((Value(reference) - landmark) / Value(TAU))
+    for batch in batched(deltas.items(), BATCH_SIZE):
+        Recipe.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+            trending_score=Greatest(
+                F('trending_score') + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta in batch],
+                    output_field=FloatField(),
+                ) * factor,
+                Value(0.0)))
+
+
+def forget_user_trending(user):
+    # Вызывается перед удалением пользователя: его избранное и корзина
+    # удалятся каскадом.
+    for model in WEIGHTS:
+        change_trending(
+            model, model.objects.filter(user=user).values_list(
+                'recipe_id', 'added_at'), sign=-1)
+
+
+@transaction.atomic
+def renormalize(moment=None):
+    # Переносит точку отсчёта в moment. Оценки, которые в пересчёте на
+    # moment меньше TRENDING_MIN_SCORE, обнуляются.
+    moment = time.time() if moment is None else moment
+    state, _ = TrendingState.objects.select_for_update().get_or_create(
+        pk=1, defaults={'landmark': moment})
+    factor = math.exp((state.landmark - moment) / TAU)
+    recipes = Recipe.objects.filter(trending_score__gt=0)
+    if factor == 0:
+        count = recipes.update(trending_score=0)
+    else:
+        count = recipes.update(trending_score=Case(
+            When(trending_score__lt=TRENDING_MIN_SCORE / factor,
+                 then=Value(0.0)),
+            default=F('trending_score') * factor,
+            output_field=FloatField(),
+        ))
+    state.landmark = moment
+    state.save(update_fields=['landmark'])
+    bump_versions([COUNTERS_VERSION_KEY])
+    return count
+
+
+@transaction.atomic
+def rebuild_trending(moment=None):
+    # Полный пересчёт по строкам избранного и корзин, например после
+    # загрузки данных в обход API.
+    moment = time.time() if moment is None else moment
+    scores = {}
+    for model, weight in WEIGHTS.items():
+        for recipe_id, added_at in model.objects.values_list(
+                'recipe_id', 'added_at').iterator(chunk_size=10000):
+            scores[recipe_id] = scores.get(recipe_id, 0) + weight * math.exp(
+                (added_at.timestamp() - moment) / TAU)
+    TrendingState.objects.update_or_create(
+        pk=1, defaults={'landmark': moment})
+    Recipe.objects.filter(trending_score__gt=0).update(trending_score=0)
+    for batch in batched(scores.items(), BATCH_SIZE):
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, trending_score=score) for pk, score in batch],
+            ['trending_score'])
+    bump_versions([COUNTERS_VERSION_KEY])
+    return len(scores)
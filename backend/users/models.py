@@ -45,6 +45,20 @@ class User(AbstractUser):
         ],
         verbose_name='Аватар',
     )
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии аватара',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Рецептов',
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков',
+    )
 
     class Meta:
         ordering = ('username',)
@@ -0,0 +1,139 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from api.authentication import token_cache
+from recipes.models import Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+# Запросов на страницу подписок: count, авторы, рецепты авторов.
+SUBSCRIPTIONS_QUERY_BUDGET = 3
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        first_name=username, last_name=username, password='password')
+
+
+class SubscriptionsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = [create_user(f'author{i}') for i in range(6)]
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {i}', text='Описание',
+                   cooking_time=10, image='recipes/images/test.png')
+            for author in cls.authors for i in range(4)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=cls.user, author=author)
+            for author in cls.authors
+        )
+        call_command('recount', stdout=StringIO())
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def get_subscriptions(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/users/subscriptions/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data['results']
+
+    def test_query_budget_does_not_depend_on_page_size_and_limit(self):
+        for limit in (1, 3, 6):
+            for recipes_limit in ('', '1', '3', '10', 'abc'):
+                with self.subTest(limit=limit, recipes_limit=recipes_limit):
+                    count, _ = self.get_subscriptions(
+                        f'limit={limit}&recipes_limit={recipes_limit}')
+                    self.assertLessEqual(count, SUBSCRIPTIONS_QUERY_BUDGET)
+
+    def test_recipes_limit_is_applied_per_author(self):
+        _, results = self.get_subscriptions('limit=6&recipes_limit=2')
+        self.assertEqual(len(results), len(self.authors))
+        for item in results:
+            self.assertEqual(len(item['recipes']), 2)
+            self.assertEqual(item['recipes_count'], 4)
+            self.assertTrue(item['is_subscribed'])
+        newest = Recipe.objects.filter(author=self.authors[0])[:2]
+        first = next(item for item in results
+                     if item['id'] == self.authors[0].id)
+        self.assertEqual([recipe['id'] for recipe in first['recipes']],
+                         [recipe.id for recipe in newest])
+
+    def test_without_recipes_limit_returns_all_recipes(self):
+        _, results = self.get_subscriptions('limit=6')
+        for item in results:
+            self.assertEqual(len(item['recipes']), 4)
+
+    def test_subscribe_returns_author(self):
+        author = create_user('newauthor')
+        response = self.client.post(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], author.id)
+        self.assertEqual(response.data['recipes_count'], 0)
+        self.assertTrue(response.data['is_subscribed'])
+
+    def test_cursor_pagination(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?pagination=cursor&limit=4')
+        self.assertNotIn('count', response.data)
+        ids = [item['id'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, [author.id for author in self.authors])
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user('token')
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'token@example.com', 'password': 'password'})
+        self.token = response.data['auth_token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        return response, [query for query in queries
+                          if 'authtoken_token' in query['sql']]
+
+    def test_token_is_cached(self):
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.token_queries()
+        self.assertEqual(response.data['email'], 'token@example.com')
+        self.assertEqual(queries, [])
+        token_cache.clear()
+        self.assertEqual(self.token_queries()[1], [])
+
+    def test_logout_revokes_cached_token(self):
+        self.token_queries()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.token_queries()[0].status_code, 401)
+
+    def test_user_changes_reset_cache(self):
+        self.token_queries()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password', 'new_password': 'N3w-passw0rd!'})
+        self.assertEqual(response.status_code, 204, response.data)
+        self.assertEqual(len(self.token_queries()[1]), 1)
+        self.user.refresh_from_db()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_queries()[0].status_code, 401)